@@ -9,6 +9,10 @@
 
     // State management
     let knowledgeBase = [];
+    let knowledgeManifest = null; // shard list, each with a keyword route filter
+    const loadedShards = new Set();
+    let knowledgePostings = null; // term -> [[chunk ordinal, tf]] from a v3+ knowledge_index.json
+    let serverAskAvailable = false; // /api/ask answered, so shards aren't needed
     let resourcesCache = [];
     let isIndexing = false;
     let pdfLoaded = false;
@@ -235,20 +239,53 @@
 
     let currentQuizQuestion = null;
 
-    // Load pre-built knowledge index (primary method - fast!)
+    // Most knowledge shards fetched for one question
+    const MAX_SHARDS_PER_QUERY = 3;
+
+    // knowledge_index.json postings layout this code understands
+    const POSTINGS_VERSION = 1;
+
+    // knowledge/manifest.json layout this code understands (route filters)
+    const MANIFEST_VERSION = 2;
+
+    function dataPath(file) {
+        return (window.location.pathname.includes('/portal/') ? 'data/' : 'portal/data/') + file;
+    }
+
+    // Load the knowledge shard manifest (primary method - only a few KB!)
     async function loadKnowledgeIndex() {
         if (indexLoaded || isIndexing) return;
         isIndexing = true;
 
         try {
-            // Try loading pre-built index first (created by build_knowledge_index.py)
-            const indexPath = window.location.pathname.includes('/portal/') 
-                ? 'data/knowledge_index.json' : 'portal/data/knowledge_index.json';
-            
-            const res = await fetch(indexPath);
+            // Shards and manifest are written by build_knowledge_index.py
+            const res = await fetch(dataPath('knowledge/manifest.json'));
+            const manifest = res.ok ? await res.json() : null;
+            if (manifest && manifest.version === MANIFEST_VERSION) {
+                for (const shard of manifest.shards) {
+                    shard.routeBits = Uint8Array.from(atob(shard.route), c => c.charCodeAt(0));
+                }
+                knowledgeManifest = manifest;
+                indexLoaded = true;
+                pdfLoaded = true;
+                console.log(`✅ Loaded knowledge manifest: ${knowledgeManifest.shards.length} shards, ${knowledgeManifest.total_chunks} chunks`);
+                isIndexing = false;
+                return true;
+            }
+        } catch (e) {
+            console.log('Knowledge manifest not found, trying the full index');
+        }
+
+        try {
+            // Older builds only have the single-file index
+            const res = await fetch(dataPath('knowledge_index.json'));
             if (res.ok) {
                 const index = await res.json();
-                knowledgeBase = index.entries || [];
+                knowledgeBase = index.chunks || index.entries || [];
+                // Older indexes have no postings; searchKnowledge then scans every chunk
+                if (index.postings && index.postings.version === POSTINGS_VERSION) {
+                    knowledgePostings = index.postings.terms;
+                }
                 indexLoaded = true;
                 pdfLoaded = true;
                 console.log(`✅ Loaded pre-built knowledge index: ${knowledgeBase.length} chunks (v${index.version})`);
@@ -375,6 +412,80 @@
         await loadKnowledgeIndex();
     }
 
+    // The two 32-bit FNV-1a hashes a keyword's route filter bits come from;
+    // route_probes() in build_knowledge_index.py computes the same bits
+    function routeHashes(term) {
+        let h1 = 0x811c9dc5, h2 = 0x050c5d1f;
+        for (const byte of new TextEncoder().encode(term)) {
+            h1 = Math.imul(h1 ^ byte, 0x01000193) >>> 0;
+            h2 = Math.imul(h2 ^ byte, 0x01000193) >>> 0;
+        }
+        return [h1, (h2 | 1) >>> 0];
+    }
+
+    // Whether a shard's Bloom filter may hold a keyword (false positives ~1%)
+    function shardMayHave(shard, [h1, h2]) {
+        const bits = shard.routeBits;
+        const nBits = bits.length * 8;
+        for (let i = 0; i < knowledgeManifest.route_hashes; i++) {
+            const position = (h1 + i * h2) % nBits;
+            if (!(bits[position >> 3] & (1 << (position & 7)))) return false;
+        }
+        return true;
+    }
+
+    // Fetch the shards whose chunks share the most informative keywords with
+    // a question. Shard files are content-hashed, so the browser caches them.
+    async function loadShardsFor(query) {
+        if (!knowledgeManifest) await loadKnowledgeIndex();
+        if (!knowledgeManifest) return;
+
+        const shards = knowledgeManifest.shards;
+        const scores = new Map();
+        for (const kw of new Set(extractKeywords(query))) {
+            const hashes = routeHashes(kw);
+            const routed = [];
+            shards.forEach((shard, ordinal) => {
+                if (shardMayHave(shard, hashes)) routed.push(ordinal);
+            });
+            if (!routed.length) continue;
+            // Rarer terms say more about where the answer is
+            const weight = Math.log(1 + shards.length / routed.length);
+            for (const ordinal of routed) {
+                scores.set(ordinal, (scores.get(ordinal) || 0) + weight);
+            }
+        }
+
+        const wanted = [...scores.entries()]
+            .sort((a, b) => b[1] - a[1])
+            .slice(0, MAX_SHARDS_PER_QUERY)
+            .map(([ordinal]) => shards[ordinal])
+            .filter(shard => !loadedShards.has(shard.file));
+
+        await Promise.all(wanted.map(async shard => {
+            try {
+                const res = await fetch(dataPath('knowledge/' + shard.file));
+                if (!res.ok) return;
+                const data = await res.json();
+                loadedShards.add(shard.file);
+                for (const chunk of data.chunks) {
+                    knowledgeBase.push({
+                        ...chunk,
+                        id: `${data.resource_id}_${chunk.chunk_index}`,
+                        resource_id: data.resource_id,
+                        title: data.title,
+                        category: data.category
+                    });
+                }
+            } catch (e) {
+                console.log('Failed to load shard:', shard.file);
+            }
+        }));
+        if (wanted.length) {
+            console.log(`📦 Loaded ${wanted.length} knowledge shard(s), ${knowledgeBase.length} chunks in memory`);
+        }
+    }
+
     function splitText(text, size) {
         const sentences = text.split(/[.!?।]+/);
         const chunks = [];
@@ -406,7 +517,17 @@
         const keywords = extractKeywords(query);
         if (!keywords.length) return [];
 
-        const scored = knowledgeBase.map(item => {
+        // With postings, only chunks containing a query term are scored
+        let candidates = knowledgeBase;
+        if (knowledgePostings) {
+            const ordinals = new Set();
+            for (const kw of keywords) {
+                for (const [ordinal] of knowledgePostings[kw] || []) ordinals.add(ordinal);
+            }
+            candidates = [...ordinals].map(ordinal => knowledgeBase[ordinal]);
+        }
+
+        const scored = candidates.map(item => {
             let score = 0;
             const content = item.content.toLowerCase();
             const title = item.title.toLowerCase();
@@ -450,11 +571,40 @@
             console.log('Semantic search unavailable:', e.message);
         }
         
+        // Keyword retrieval on the server: a few KB instead of any shards
+        const asked = await askServer(query, topK);
+        if (asked && asked.length > 0) return asked;
+        
         // Fallback to local keyword search
         console.log('Using local keyword search as fallback');
+        if (!serverAskAvailable) await loadShardsFor(query);
         return searchKnowledge(query, topK);
     }
 
+    // Server-side keyword search over the knowledge index
+    async function askServer(query, topK = 5) {
+        try {
+            const response = await fetch('/api/ask', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ question: query, top_k: topK })
+            });
+            
+            if (response.ok) {
+                const data = await response.json();
+                if (data.success && data.results) {
+                    serverAskAvailable = true;
+                    console.log(`💬 Server found ${data.results.length} knowledge chunks for: "${query}"`);
+                    // Keyword scores aren't similarities; don't show them as a % match
+                    return data.results.map(({ score, ...result }) => result);
+                }
+            }
+        } catch (e) {
+            console.log('Ask API unavailable:', e.message);
+        }
+        return null;
+    }
+
     // Generate answer from context - improved version
     function generateAnswer(query, contexts) {
         if (!contexts.length) return null;
@@ -757,6 +907,7 @@
         }
 
         // Also try local knowledge base search as backup
+        if (!serverAskAvailable) await loadShardsFor(input);
         if (knowledgeBase.length > 0) {
             const localResults = searchKnowledge(input, 5);
             if (localResults.length > 0) {
@@ -6,6 +6,10 @@
 // Global state
 let allResources = [];
 let currentCategory = null;
+let catalogVersion = null;
+
+// How often to ask the server for catalog changes (ms)
+const CATALOG_POLL_INTERVAL = 30000;
 
 // DOM Elements
 const searchInput = document.getElementById('searchInput');
@@ -24,6 +28,7 @@ async function init() {
     updateCategoryCounts();
     displayResources(allResources);
     setupEventListeners();
+    startCatalogSync();
 }
 
 /**
@@ -41,28 +46,50 @@ function getBasePath() {
 }
 
 /**
- * Load metadata from JSON file
+ * Fetch the catalog with its version from the API, falling back to the
+ * static metadata.json (version null) when there is no server API.
+ * Both come from one response, so deltas start exactly where this copy ends.
+ */
+async function fetchCatalog(paths) {
+    try {
+        const response = await fetch('/api/metadata');
+        if (response.ok) {
+            const data = await response.json();
+            if (Array.isArray(data.resources)) {
+                return { resources: data.resources, version: data.version };
+            }
+        }
+    } catch (e) {
+        // Static hosting without the API
+    }
+    const response = await fetch(paths.metadata);
+    if (!response.ok) {
+        throw new Error('Failed to load metadata');
+    }
+    return { resources: await response.json(), version: null };
+}
+
+/**
+ * Load metadata from the server (or JSON file)
  */
 async function loadMetadata() {
     try {
         const paths = getBasePath();
-        const response = await fetch(paths.metadata);
-        if (!response.ok) {
-            throw new Error('Failed to load metadata');
-        }
-        allResources = await response.json();
+        const catalog = await fetchCatalog(paths);
         
         // Fix filepaths based on current location
-        allResources = allResources.map(r => ({
+        allResources = catalog.resources.map(r => ({
             ...r,
-            filepath: paths.contentPrefix + r.filepath
+            filepath: paths.contentPrefix + r.filepath,
+            thumbnail: r.thumbnail ? paths.contentPrefix + r.thumbnail : null
         }));
+        catalogVersion = catalog.version;
         
         // Filter out deleted resources
         const deletedResources = JSON.parse(localStorage.getItem('ilmify_deleted_resources') || '[]');
         allResources = allResources.filter(r => !deletedResources.includes(r.id));
         
-        console.log(`Loaded ${allResources.length} resources from ${paths.metadata}`);
+        console.log(`Loaded ${allResources.length} resources` + (catalogVersion === null ? ` from ${paths.metadata}` : ` (version ${catalogVersion})`));
     } catch (error) {
         console.error('Error loading metadata:', error);
         resourcesGrid.innerHTML = `
@@ -75,6 +102,81 @@ async function loadMetadata() {
     }
 }
 
+/**
+ * Poll the server for catalog changes and apply them in place.
+ * Only the resources that changed since our version are transferred.
+ * Called once the initial load has resolved; a catalog read from the
+ * static file has no version and nothing to poll.
+ */
+function startCatalogSync() {
+    if (catalogVersion === null) return;
+    const paths = getBasePath();
+
+    async function sync() {
+        try {
+            const response = await fetch(`/api/metadata?since=${catalogVersion}`);
+            if (!response.ok) return;
+            const data = await response.json();
+
+            if (data.full_reload) {
+                await loadMetadata();  // sets catalogVersion from the reloaded catalog
+            } else if (data.changes && data.changes.length > 0) {
+                applyCatalogChanges(data.changes, paths.contentPrefix);
+                catalogVersion = data.version;
+            } else {
+                catalogVersion = data.version;
+                return;
+            }
+            updateCategoryCounts();
+            refreshCurrentView();
+        } catch (e) {
+            // Server unreachable; try again at the next interval
+        }
+    }
+
+    setInterval(sync, CATALOG_POLL_INTERVAL);
+}
+
+/**
+ * Apply added/modified/removed resources from a catalog delta
+ * @param {Array} changes - Changes returned by /api/metadata?since=
+ * @param {string} contentPrefix - Path prefix for content files
+ */
+function applyCatalogChanges(changes, contentPrefix) {
+    const byPath = new Map(allResources.map(r => [r.filepath, r]));
+
+    changes.forEach(change => {
+        const r = change.resource;
+        const filepath = contentPrefix + r.filepath;
+        if (change.op === 'removed') {
+            byPath.delete(filepath);
+        } else {
+            byPath.set(filepath, {
+                ...r,
+                filepath,
+                thumbnail: r.thumbnail ? contentPrefix + r.thumbnail : null
+            });
+        }
+    });
+
+    const deletedResources = JSON.parse(localStorage.getItem('ilmify_deleted_resources') || '[]');
+    allResources = Array.from(byPath.values()).filter(r => !deletedResources.includes(r.id));
+}
+
+/**
+ * Re-render the current view after the catalog changed
+ */
+function refreshCurrentView() {
+    if (searchInput.value.trim()) {
+        filterBySearch(searchInput.value);
+    } else if (currentCategory) {
+        const filtered = allResources.filter(resource => resource.category === currentCategory);
+        displayResources(filtered);
+    } else {
+        displayResources(allResources);
+    }
+}
+
 /**
  * Update category counts in the UI
  */
@@ -157,13 +259,22 @@ function createResourceCard(resource) {
 
     card.dataset.resourceId = resource.id;
     card.dataset.filepath = resource.filepath;
+    // Preview and size details (added by the server's enrichment stage)
+    const iconHtml = resource.thumbnail
+        ? `<img class="resource-thumbnail" src="${resource.thumbnail}" alt="" loading="lazy">`
+        : icon;
+    const details = [];
+    if (resource.pages) details.push(`${resource.pages} pages`);
+    if (resource.size_bytes) details.push(formatFileSize(resource.size_bytes));
+
     card.innerHTML = `
-        <div class="resource-icon">${icon}</div>
+        <div class="resource-icon">${iconHtml}</div>
         <div class="resource-info">
             <h4 class="resource-title">${escapeHtml(resource.title)}</h4>
             <div class="resource-meta">
                 <span class="resource-format">${formatLabel}</span>
                 <span class="resource-category">${categoryLabel}</span>
+                ${details.length ? `<span class="resource-details">${details.join(' · ')}</span>` : ''}
             </div>
         </div>
         <div class="resource-actions">
@@ -179,6 +290,18 @@ function createResourceCard(resource) {
     return card;
 }
 
+/**
+ * Format a byte count for display
+ * @param {number} bytes - Size in bytes
+ * @returns {string} Human-readable size
+ */
+function formatFileSize(bytes) {
+    if (bytes < 1024 * 1024) {
+        return `${Math.max(1, Math.round(bytes / 1024))} KB`;
+    }
+    return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+}
+
 /**
  * Escape HTML to prevent XSS
  * @param {string} text - Text to escape
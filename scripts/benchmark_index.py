@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Vector Index Benchmarks
+Measures the vector index on synthetic corpora, so results don't depend on
+which PDFs happen to be in content/. Indexes are written to a temporary
+directory; the real index is never touched.
+
+Usage:
+    python scripts/benchmark_index.py build    # Build time from 10 to 1,000 PDFs
+    python scripts/benchmark_index.py ann      # ANN recall vs latency against exact search
+    python scripts/benchmark_index.py quantize # Memory, recall and latency of quantised weights
+    python scripts/benchmark_index.py batch    # Query throughput of search_many by batch size
+"""
+
+import math
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import embeddings
+from embeddings import VectorStore, compute_document_frequencies, compute_idf, load_manifest
+
+# Synthetic corpus shape (roughly a textbook PDF)
+CHUNKS_PER_PDF = 20
+TOKENS_PER_CHUNK = 80
+CORPUS_VOCABULARY = 20000  # distinct words, Zipf-distributed
+TOPICS = 50  # each PDF draws half its words from one topic's word list
+TOPIC_VOCABULARY = 300
+
+BUILD_SIZES = [10, 100, 1000]  # PDFs
+NAIVE_LIMIT = 5_000_000  # skip the old df scan above this many word x chunk checks
+
+ANN_SIZES = [10000, 50000]  # chunks
+ANN_PROBE_COUNTS = [1, 2, 4, 8, 16, 32]
+QUERIES = 200
+QUERY_WORDS = 4
+RECALL_AT = 10
+
+QUANTIZE_CHUNKS = 50000
+QUANTIZE_MODES = [('float32', 0), ('float16', 0), ('float16', 4), ('int8', 0), ('int8', 4)]  # (dtype, rerank)
+LIST_SAMPLE_ROWS = 5000  # rows measured for the Python-list baseline
+
+BATCH_CHUNKS = 50000
+BATCH_SIZES = [1, 4, 16, 64]
+
+
+def synthetic_words(count: int) -> List[str]:
+    """Distinct pronounceable words that survive tokenize()."""
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'te', 'vi', 'zo', 'ba', 'de', 'fu']
+    words = []
+    for i in range(count):
+        word, n = '', i + len(syllables)
+        while n:
+            n, digit = divmod(n, len(syllables))
+            word += syllables[digit]
+        words.append(word)
+    return words
+
+
+class SyntheticCorpus:
+    """Deterministic PDFs made of Zipf-distributed words on a few topics."""
+
+    def __init__(self, seed: int = 7):
+        self.rng = random.Random(seed)
+        self.words = synthetic_words(CORPUS_VOCABULARY)
+        self.weights = [1 / rank for rank in range(1, CORPUS_VOCABULARY + 1)]
+        self.topics = [self.rng.sample(self.words[500:], TOPIC_VOCABULARY) for _ in range(TOPICS)]
+        self.topic_weights = self.weights[:TOPIC_VOCABULARY]
+        self.pdf_count = 0
+
+    def pdf(self) -> List[Dict]:
+        """Chunks of one new synthetic PDF, shaped like build_index's."""
+        self.pdf_count += 1
+        path = f"/synthetic/book-{self.pdf_count:05d}.pdf"
+        topic = self.rng.choice(self.topics)
+        chunks = []
+        for i in range(CHUNKS_PER_PDF):
+            tokens = (self.rng.choices(self.words, self.weights, k=TOKENS_PER_CHUNK // 2) +
+                      self.rng.choices(topic, self.topic_weights, k=TOKENS_PER_CHUNK - TOKENS_PER_CHUNK // 2))
+            self.rng.shuffle(tokens)
+            chunks.append({
+                'id': f"book-{self.pdf_count}_{i}",
+                'title': f"Book {self.pdf_count}",
+                'category': 'textbooks',
+                'source_path': path,
+                'chunk_index': i,
+                'content': ' '.join(tokens),
+                'tokens': tokens[:50],
+                'token_counts': Counter(tokens),
+                'length': len(tokens)
+            })
+        return chunks
+
+
+def naive_idf(documents: List[List[str]]) -> Dict[str, float]:
+    """The original IDF computation: scan every chunk's token list per word."""
+    vocabulary = sorted({word for doc in documents for word in doc})
+    n_docs = len(documents)
+    return {
+        word: math.log((n_docs + 1) / (sum(1 for doc in documents if word in doc) + 1)) + 1
+        for word in vocabulary
+    }
+
+
+def use_index_dir(path: Path):
+    """Point the embeddings module at a scratch index directory."""
+    embeddings.VECTORS_DIR = path
+    embeddings.SEGMENTS_DIR = path / "segments"
+    embeddings.VECTOR_MANIFEST_FILE = path / "manifest.json"
+    embeddings.VECTOR_INDEX_FILE = path / "index.json"
+    embeddings.VECTOR_BINARY_FILE = path / "index.bin"
+    embeddings.RELATED_FILE = path / "related.json"
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_build():
+    """Full build, incremental add and update as the corpus grows."""
+    print(f"{'PDFs':>6} {'chunks':>7} {'old df':>9} {'df 1-pass':>10} {'full build':>11} "
+          f"{'add 1 PDF':>10} {'update 1':>9}")
+
+    for n_pdfs in BUILD_SIZES:
+        corpus = SyntheticCorpus()
+        pdfs = [corpus.pdf() for _ in range(n_pdfs)]
+        chunks = [chunk for pdf in pdfs for chunk in pdf]
+        token_lists = [chunk['content'].split() for chunk in chunks]
+
+        distinct = len({word for chunk in chunks for word in chunk['token_counts']})
+        if distinct * len(chunks) <= NAIVE_LIMIT:
+            old_df = f"{timed(naive_idf, token_lists):8.2f}s"
+        else:
+            old_df = f"{'skipped':>9}"
+
+        def one_pass():
+            doc_freqs = compute_document_frequencies(chunk['token_counts'] for chunk in chunks)
+            compute_idf(doc_freqs, len(chunks), list(doc_freqs))
+
+        with tempfile.TemporaryDirectory() as scratch:
+            use_index_dir(Path(scratch))
+            store = VectorStore()
+            full = timed(lambda: store.commit_changes(load_manifest(), chunks, set()))
+            add = timed(lambda: store.commit_changes(load_manifest(), corpus.pdf(), set()))
+            changed = [dict(chunk) for chunk in corpus.pdf()]
+            for chunk in changed:
+                chunk['source_path'] = pdfs[0][0]['source_path']
+            update = timed(lambda: store.commit_changes(load_manifest(), changed, {changed[0]['source_path']}))
+            for segment in store.snapshot.segments:
+                segment.close()
+
+        print(f"{n_pdfs:>6} {len(chunks):>7} {old_df} {timed(one_pass):9.2f}s {full:10.2f}s "
+              f"{add:9.2f}s {update:8.2f}s")
+
+
+def benchmark_ann():
+    """Recall@10 and latency of IVF search against exact TF-IDF search."""
+    if not embeddings.NUMPY_AVAILABLE:
+        print("❌ NumPy is required for ANN search. Install with: pip install numpy")
+        return
+
+    for n_chunks in ANN_SIZES:
+        corpus = SyntheticCorpus()
+        chunks = [chunk for _ in range(n_chunks // CHUNKS_PER_PDF) for chunk in corpus.pdf()]
+        rng = random.Random(11)
+        queries = [' '.join(rng.sample(rng.choice(chunks)['content'].split(), QUERY_WORDS))
+                   for _ in range(QUERIES)]
+
+        with tempfile.TemporaryDirectory() as scratch:
+            use_index_dir(Path(scratch))
+            embeddings.ANN_MIN_DOCS = 0
+            store = VectorStore()
+            store.commit_changes(load_manifest(), chunks, set())
+            store.query_cache.max_size = 0  # time real searches
+            print(f"\n{n_chunks} chunks, {len(store.snapshot.ivf.centroids)} IVF lists")
+            print(f"{'mode':>10} {'recall@10':>10} {'ms/query':>9}")
+
+            def run(mode, probes=embeddings.ANN_PROBES):
+                start = time.perf_counter()
+                results = [[r['id'] for r in store.search(q, RECALL_AT, mode=mode, probes=probes)]
+                           for q in queries]
+                return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+            exact, exact_ms = run('tfidf')
+            print(f"{'exact':>10} {1.0:10.3f} {exact_ms:9.2f}")
+            for probes in ANN_PROBE_COUNTS:
+                found, ms = run('ann', probes)
+                hits = sum(len(set(a) & set(e)) for a, e in zip(found, exact))
+                total = sum(len(e) for e in exact) or 1
+                print(f"{'probes=' + str(probes):>10} {hits / total:10.3f} {ms:9.2f}")
+            for segment in store.snapshot.segments:
+                segment.close()
+
+
+def list_bytes_per_chunk(store: VectorStore) -> float:
+    """Bytes per chunk of per-chunk Python lists of term ids and float weights."""
+    snapshot = store.snapshot
+    doc_ptr = snapshot._doc_ptr
+    rows = min(LIST_SAMPLE_ROWS, len(doc_ptr) - 1)
+    tracemalloc.start()
+    documents = [{'terms': snapshot._indices[doc_ptr[row]:doc_ptr[row + 1]].tolist(),
+                  'weights': snapshot._data[doc_ptr[row]:doc_ptr[row + 1]].tolist()}
+                 for row in range(rows)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del documents
+    return size / rows
+
+
+def benchmark_quantize():
+    """Resident memory, recall@10 and latency of each weight dtype."""
+    if not embeddings.NUMPY_AVAILABLE:
+        print("❌ NumPy is required for quantised weights. Install with: pip install numpy")
+        return
+
+    corpus = SyntheticCorpus()
+    chunks = [chunk for _ in range(QUANTIZE_CHUNKS // CHUNKS_PER_PDF) for chunk in corpus.pdf()]
+    rng = random.Random(11)
+    queries = [' '.join(rng.sample(rng.choice(chunks)['content'].split(), QUERY_WORDS))
+               for _ in range(QUERIES)]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        use_index_dir(Path(scratch))
+        embeddings.ANN_MIN_DOCS = len(chunks) + 1  # exact search only
+        VectorStore().commit_changes(load_manifest(), chunks, set())
+
+        print(f"{len(chunks)} chunks")
+        print(f"{'weights':>16} {'bytes/chunk':>12} {'recall@10':>10} {'ms/query':>9}")
+        exact = None
+        for dtype, rerank in QUANTIZE_MODES:
+            embeddings.VECTOR_DTYPE = dtype
+            embeddings.RERANK_FACTOR = rerank
+            store = VectorStore()
+            store.load()
+            store.query_cache.max_size = 0  # time real searches
+
+            if exact is None:
+                print(f"{'python lists':>16} {list_bytes_per_chunk(store):12.0f} {'-':>10} {'-':>9}")
+
+            start = time.perf_counter()
+            found = [[r['id'] for r in store.search(q, RECALL_AT)] for q in queries]
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            if exact is None:
+                exact = found
+            hits = sum(len(set(a) & set(e)) for a, e in zip(found, exact))
+            total = sum(len(e) for e in exact) or 1
+
+            label = dtype + (f" +rerank x{rerank}" if rerank else '')
+            print(f"{label:>16} {store.snapshot.vector_bytes() / len(chunks):12.0f} {hits / total:10.3f} {ms:9.2f}")
+            for segment in store.snapshot.segments:
+                segment.close()
+
+
+def benchmark_batch():
+    """Queries per second of one search() per query against search_many()."""
+    if not embeddings.NUMPY_AVAILABLE:
+        print("❌ NumPy is required for batch search. Install with: pip install numpy")
+        return
+
+    corpus = SyntheticCorpus()
+    chunks = [chunk for _ in range(BATCH_CHUNKS // CHUNKS_PER_PDF) for chunk in corpus.pdf()]
+    rng = random.Random(11)
+    queries = [' '.join(rng.sample(rng.choice(chunks)['content'].split(), QUERY_WORDS))
+               for _ in range(QUERIES)]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        use_index_dir(Path(scratch))
+        store = VectorStore()
+        store.commit_changes(load_manifest(), chunks, set())
+        store.query_cache.max_size = 0  # time real searches
+
+        print(f"{len(chunks)} chunks, {len(queries)} queries, {store.get_stats()['vector_dtype']} weights")
+        print(f"{'method':>16} {'queries/s':>10}")
+
+        start = time.perf_counter()
+        expected = [store.search(q, RECALL_AT) for q in queries]
+        print(f"{'search()':>16} {len(queries) / (time.perf_counter() - start):10.0f}")
+
+        for size in BATCH_SIZES:
+            start = time.perf_counter()
+            found = []
+            for i in range(0, len(queries), size):
+                found.extend(store.search_many(queries[i:i + size], RECALL_AT))
+            rate = len(queries) / (time.perf_counter() - start)
+            note = '' if found == expected else '  (results differ!)'
+            print(f"{'batch of ' + str(size):>16} {rate:10.0f}{note}")
+        for segment in store.snapshot.segments:
+            segment.close()
+
+
+BENCHMARKS = {
+    'build': benchmark_build,
+    'ann': benchmark_ann,
+    'quantize': benchmark_quantize,
+    'batch': benchmark_batch,
+}
+
+
+def main():
+    """CLI entry point."""
+    name = sys.argv[1] if len(sys.argv) > 1 else ''
+    if name not in BENCHMARKS:
+        print(f"Usage: python scripts/benchmark_index.py [{'|'.join(BENCHMARKS)}]")
+        return
+
+    print("=" * 50)
+    print(f"⏱️  Ilmify Index Benchmark: {name}")
+    print("=" * 50)
+    BENCHMARKS[name]()
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,23 @@
 """
 Ilmify PDF Indexer - Tokenizes PDFs for fast chatbot retrieval
 Run this after adding new resources to build/update the knowledge base
+Each file's chunks are cached by fingerprint, so only new or changed PDFs
+are extracted again, and an interrupted run resumes where it stopped
+With --postings-only, an existing index only gets postings added
 """
 
+import base64
+import hashlib
 import json
+import math
+import os
 import re
+from collections import Counter
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+
+from dedupe import MinHashDeduper
+from page_cache import get_file_hash, iter_pages
 
 try:
     import fitz  # PyMuPDF - type: ignore
@@ -21,6 +32,26 @@ CONTENT_DIR = BASE_DIR / "content"
 DATA_DIR = BASE_DIR / "portal" / "data"
 METADATA_FILE = DATA_DIR / "metadata.json"
 INDEX_FILE = DATA_DIR / "knowledge_index.json"
+SHARD_DIR = DATA_DIR / "knowledge"
+SHARD_MANIFEST_FILE = SHARD_DIR / "manifest.json"
+CACHE_DIR = DATA_DIR / "knowledge_cache"
+
+# Extraction settings; changing them (or CACHE_VERSION) re-extracts every file
+CHUNK_SIZE = 600
+CACHE_VERSION = 2  # 2: every page, not just the first 50
+
+# Layout of the 'postings' section of INDEX_FILE; readers skip other versions
+POSTINGS_VERSION = 1
+
+# Term routing: once there are ROUTE_MIN_SHARDS shards, terms found in more
+# than ROUTE_MAX_SHARE of them are left out (they can't narrow a fetch)
+ROUTE_MIN_SHARDS = 8
+ROUTE_MAX_SHARE = 0.5
+
+# Each shard's keywords are a Bloom filter in the manifest: ROUTE_FILTER_BITS
+# bits per keyword probed ROUTE_FILTER_HASHES times gives ~1% false routes
+ROUTE_FILTER_BITS = 10
+ROUTE_FILTER_HASHES = 7
 
 # Stop words for keyword extraction
 STOP_WORDS = {
@@ -39,29 +70,20 @@ STOP_WORDS = {
 }
 
 
-def extract_text_from_pdf(pdf_path: Path, max_pages: int = 50) -> str:
-    """Extract text from PDF using PyMuPDF"""
+def extract_text_from_pdf(pdf_path: Path) -> str:
+    """Extract the text of every page via the shared page text cache
+    
+    Pages the vector store (or an earlier run) already extracted are read
+    back from the cache; the rest are extracted once and cached for it.
+    """
     if not HAS_PYMUPDF:
         return ""
     
-    try:
-        doc = fitz.open(str(pdf_path))
-        text = ""
-        num_pages = min(len(doc), max_pages)
-        
-        for page_num in range(num_pages):
-            page = doc[page_num]
-            text += page.get_text() + "\n\n"
-        
-        doc.close()
-        return text.strip()
-    except (OSError, ValueError, RuntimeError) as e:
-        print(f"  ⚠️  Error extracting {pdf_path.name}: {e}")
-        return ""
+    return "\n\n".join(iter_pages(pdf_path)).strip()
 
 
-def extract_keywords(text: str) -> list:
-    """Extract meaningful keywords from text"""
+def term_frequencies(text: str) -> dict:
+    """Count the meaningful words of a text"""
     # Clean and tokenize
     words = re.sub(r'[^a-zA-Z0-9\s]', ' ', text.lower()).split()
     
@@ -70,9 +92,13 @@ def extract_keywords(text: str) -> list:
     for word in words:
         if len(word) > 2 and word not in STOP_WORDS and not word.isdigit():
             word_freq[word] = word_freq.get(word, 0) + 1
-    
+    return word_freq
+
+
+def extract_keywords(text: str) -> list:
+    """Extract meaningful keywords from text"""
     # Return top keywords by frequency
-    sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
+    sorted_words = sorted(term_frequencies(text).items(), key=lambda x: x[1], reverse=True)
     return [word for word, _ in sorted_words[:100]]
 
 
@@ -100,6 +126,230 @@ def split_into_chunks(text: str, chunk_size: int = 500) -> list:
     return [c for c in chunks if len(c) > 50]  # Filter very short chunks
 
 
+def drop_near_duplicates(chunks: list) -> list:
+    """Remove chunks that nearly duplicate an earlier one (MinHash/LSH)
+    
+    Each kept chunk lists the resource_id and chunk_index of the chunks
+    dropped in its favour under 'duplicates'.
+    """
+    deduper = MinHashDeduper()
+    kept = []
+    for chunk in chunks:
+        original = deduper.add(len(kept), chunk['content'])
+        if original is None:
+            kept.append(chunk)
+        else:
+            kept[original].setdefault('duplicates', []).append({
+                'resource_id': chunk['resource_id'],
+                'chunk_index': chunk['chunk_index']
+            })
+    return kept
+
+
+def build_postings(chunks: list) -> dict:
+    """Term -> [[chunk ordinal, term frequency], ...] plus per-chunk lengths
+    
+    Ordinals index the 'chunks' list they were built from and ascend within
+    each term; a chunk's length is its number of meaningful words, for
+    BM25-style length normalisation.
+    """
+    terms = {}
+    lengths = []
+    for ordinal, chunk in enumerate(chunks):
+        frequencies = term_frequencies(chunk['content'])
+        for term, count in frequencies.items():
+            terms.setdefault(term, []).append([ordinal, count])
+        lengths.append(sum(frequencies.values()))
+    
+    return {
+        'version': POSTINGS_VERSION,
+        'avg_length': round(sum(lengths) / len(lengths), 2) if lengths else 0.0,
+        'chunk_lengths': lengths,
+        'terms': dict(sorted(terms.items()))
+    }
+
+
+def write_json_atomic(path: Path, data, **kwargs):
+    """Write JSON to a temp file and move it into place"""
+    temp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **kwargs)
+    os.replace(temp_path, path)
+
+
+def file_fingerprint(pdf_path: Path) -> str:
+    """Fingerprint of a PDF version and the settings its chunks were made with"""
+    key = f"{get_file_hash(pdf_path.resolve())}:{CACHE_VERSION}:{CHUNK_SIZE}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def load_cached_file(fingerprint: str):
+    """Cached extraction of a file version ({'chunks', 'keywords'}), or None"""
+    try:
+        with open(CACHE_DIR / f"{fingerprint}.json", 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+    if not isinstance(entry, dict) or entry.get('fingerprint') != fingerprint:
+        return None
+    return entry
+
+
+def save_cached_file(fingerprint: str, filepath: str, chunks: list, keywords: list):
+    """Cache one file's chunks and keywords as soon as it is extracted
+    
+    Each file is its own entry, written atomically, so an interrupted build
+    keeps every file it finished and the next run picks up from there.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(CACHE_DIR / f"{fingerprint}.json", {
+        'fingerprint': fingerprint,
+        'filepath': filepath,
+        'chunks': chunks,
+        'keywords': keywords
+    }, separators=(',', ':'))
+
+
+def prune_knowledge_cache(fingerprints: set) -> int:
+    """Delete cache entries of every file version not in fingerprints; returns the count"""
+    removed = 0
+    if CACHE_DIR.exists():
+        for path in CACHE_DIR.glob('*.json'):
+            if path.stem not in fingerprints:
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+
+def route_probes(term: str, n_bits: int) -> list:
+    """Bit positions of a keyword in a route filter of n_bits bits.
+    
+    Two 32-bit FNV-1a hashes of the UTF-8 bytes, combined by double
+    hashing; chatbot.js computes the same positions.
+    """
+    h1, h2 = 0x811c9dc5, 0x050c5d1f
+    for byte in term.encode('utf-8'):
+        h1 = ((h1 ^ byte) * 0x01000193) & 0xffffffff
+        h2 = ((h2 ^ byte) * 0x01000193) & 0xffffffff
+    h2 |= 1
+    return [(h1 + i * h2) % n_bits for i in range(ROUTE_FILTER_HASHES)]
+
+
+def route_filter(terms: set) -> str:
+    """Base64 Bloom filter holding terms (at least 8 bytes)."""
+    bits = bytearray(max(8, -(-len(terms) * ROUTE_FILTER_BITS // 8)))
+    for term in terms:
+        for position in route_probes(term, len(bits) * 8):
+            bits[position >> 3] |= 1 << (position & 7)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+def routed_shards(manifest: dict, term: str) -> list:
+    """Ordinals of the shards whose route filter may hold term."""
+    routed = []
+    for ordinal, shard in enumerate(manifest['shards']):
+        bits = base64.b64decode(shard['route'])
+        if all(bits[p >> 3] & (1 << (p & 7)) for p in route_probes(term, len(bits) * 8)):
+            routed.append(ordinal)
+    return routed
+
+
+def write_shards(chunks: list) -> dict:
+    """Write one compact, content-hashed shard per resource plus a manifest
+    
+    The manifest lists the shards, each with a Bloom filter of its chunks'
+    keywords, so the chatbot only fetches shards relevant to a question
+    and the manifest grows with the number of shards rather than with the
+    vocabulary. A shard's file name changes whenever its content does, so
+    browsers can cache shards indefinitely. Returns the manifest.
+    """
+    by_resource = {}
+    for chunk in chunks:
+        by_resource.setdefault(chunk['resource_id'], []).append(chunk)
+    
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+    shards = []
+    shard_terms = []
+    for resource_id, resource_chunks in by_resource.items():
+        first = resource_chunks[0]
+        shard = {
+            'resource_id': resource_id,
+            'title': first['title'],
+            'category': first['category'],
+            'chunks': [{k: v for k, v in chunk.items()
+                        if k not in ('resource_id', 'title', 'category')}
+                       for chunk in resource_chunks]
+        }
+        payload = json.dumps(shard, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha1(payload).hexdigest()[:12]
+        name = f"kb-{re.sub(r'[^A-Za-z0-9_-]', '_', str(resource_id))}-{digest}.json"
+        if not (SHARD_DIR / name).exists():
+            temp_path = SHARD_DIR / (name + '.tmp')
+            temp_path.write_bytes(payload)
+            os.replace(temp_path, SHARD_DIR / name)
+        
+        shards.append({
+            'file': name,
+            'resource_id': resource_id,
+            'title': first['title'],
+            'category': first['category'],
+            'chunks': len(resource_chunks),
+            'bytes': len(payload)
+        })
+        shard_terms.append({kw for chunk in resource_chunks for kw in chunk['keywords']})
+    
+    common = set()
+    if len(shards) >= ROUTE_MIN_SHARDS:
+        limit = math.floor(len(shards) * ROUTE_MAX_SHARE)
+        shard_counts = Counter(term for terms in shard_terms for term in terms)
+        common = {term for term, count in shard_counts.items() if count > limit}
+    for shard, terms in zip(shards, shard_terms):
+        shard['route'] = route_filter(terms - common)
+    
+    manifest = {
+        'version': 2,
+        'generated': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        'total_chunks': len(chunks),
+        'route_hashes': ROUTE_FILTER_HASHES,
+        'shards': shards
+    }
+    write_json_atomic(SHARD_MANIFEST_FILE, manifest, separators=(',', ':'))
+    
+    # Drop shards the new manifest no longer lists
+    current = {shard['file'] for shard in shards}
+    for path in SHARD_DIR.glob('kb-*.json'):
+        if path.name not in current:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    
+    return manifest
+
+
+def add_postings(path: Path = INDEX_FILE) -> bool:
+    """Upgrade an index file without postings to v3 in place
+    
+    Postings only depend on the chunks, so an index built before they
+    existed gets them without extracting any PDF again (useful when some
+    of its PDFs aren't on this machine). Returns False if the file already
+    has current postings.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        index_data = json.load(f)
+    postings = index_data.get('postings')
+    if isinstance(postings, dict) and postings.get('version') == POSTINGS_VERSION:
+        return False
+    
+    index_data['version'] = max(index_data.get('version', 1), 3)
+    index_data['postings'] = build_postings(index_data.get('chunks', []))
+    write_json_atomic(path, index_data, separators=(',', ':'))
+    return True
+
+
 def build_index():
     """Build knowledge index from all PDF resources"""
     print("\n" + "=" * 50)
@@ -124,19 +374,9 @@ def build_index():
     pdfs = [r for r in resources if r.get('format') == 'pdf']
     print(f"📕 {len(pdfs)} PDF files to process")
     
-    # Check existing index
-    existing_index = {}
-    if INDEX_FILE.exists():
-        try:
-            with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                existing_index = {item['resource_id']: item for item in data.get('chunks', [])}
-                print(f"📦 Existing index has {len(existing_index)} entries")
-        except (json.JSONDecodeError, KeyError, OSError):
-            pass
-    
-    # Process each PDF
+    # Process each PDF (unchanged files come from the per-file cache)
     knowledge_chunks = []
+    fingerprints = set()
     processed = 0
     skipped = 0
     
@@ -156,76 +396,92 @@ def build_index():
             print(f"  ⚠️  Not found: {filepath}")
             continue
         
-        # Check if already indexed (by file modification time)
-        file_mtime = pdf_path.stat().st_mtime
-        existing = existing_index.get(resource_id)
+        fingerprint = file_fingerprint(pdf_path)
+        fingerprints.add(fingerprint)
+        entry = load_cached_file(fingerprint)
         
-        if existing and existing.get('file_mtime') == file_mtime:
-            # Use existing chunks
-            for chunk in existing.get('chunks', []):
-                knowledge_chunks.append({
-                    'resource_id': resource_id,
-                    'title': title,
-                    'category': category,
-                    'content': chunk['content'],
-                    'keywords': chunk['keywords'],
-                    'chunk_index': chunk['chunk_index']
-                })
+        if entry is not None:
             skipped += 1
             print(f"  ⏭️  Skipped (unchanged): {title}")
-            continue
-        
-        print(f"  📖 Processing: {title}...")
-        
-        # Extract text
-        text = extract_text_from_pdf(pdf_path, max_pages=50)
-        
-        if len(text) < 100:
-            print("      ⚠️  Too little text extracted")
-            continue
-        
-        # Split into chunks
-        chunks = split_into_chunks(text, chunk_size=600)
-        
-        # Process each chunk
-        for idx, chunk_text in enumerate(chunks):
-            keywords = extract_keywords(chunk_text)
+        else:
+            print(f"  📖 Processing: {title}...")
             
+            # Extract text
+            text = extract_text_from_pdf(pdf_path)
+            
+            if len(text) < 100:
+                # Cached too, so the file isn't extracted again until it changes
+                print("      ⚠️  Too little text extracted")
+                save_cached_file(fingerprint, filepath, [], [])
+                continue
+            
+            # Split into chunks and extract keywords for each
+            chunks = [{
+                'content': chunk_text,
+                'keywords': extract_keywords(chunk_text)[:50],
+                'chunk_index': idx
+            } for idx, chunk_text in enumerate(split_into_chunks(text, chunk_size=CHUNK_SIZE))]
+            entry = {'chunks': chunks, 'keywords': extract_keywords(text)}
+            save_cached_file(fingerprint, filepath, entry['chunks'], entry['keywords'])
+            
+            processed += 1
+            print(f"      ✅ Created {len(chunks)} chunks, {len(entry['keywords'])} keywords")
+        
+        # Title and category come from the current metadata, not the cache
+        for chunk in entry['chunks']:
             knowledge_chunks.append({
                 'resource_id': resource_id,
                 'title': title,
                 'category': category,
-                'content': chunk_text,
-                'keywords': keywords[:50],
-                'chunk_index': idx,
-                'file_mtime': file_mtime
+                'content': chunk['content'],
+                'keywords': chunk['keywords'],
+                'chunk_index': chunk['chunk_index']
             })
-        
-        processed += 1
-        print(f"      ✅ Created {len(chunks)} chunks, {len(extract_keywords(text))} keywords")
     
-    # Build final index
+    # Repeated headers, boilerplate and shared sections are kept once
+    extracted_count = len(knowledge_chunks)
+    knowledge_chunks = drop_near_duplicates(knowledge_chunks)
+    duplicate_count = extracted_count - len(knowledge_chunks)
+    
+    # Build final index (v3 adds 'postings'; readers of v2 only use 'chunks')
     index_data = {
-        'version': 2,
-        'generated': datetime.utcnow().isoformat() + 'Z',
+        'version': 3,
+        'generated': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
         'total_chunks': len(knowledge_chunks),
         'total_resources': len(pdfs),
-        'chunks': knowledge_chunks
+        'duplicates_removed': duplicate_count,
+        'chunks': knowledge_chunks,
+        'postings': build_postings(knowledge_chunks)
     }
     
-    # Save index
+    # Save index (the full file for server-side use, shards for the chatbot)
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-        json.dump(index_data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(INDEX_FILE, index_data, separators=(',', ':'))
+    manifest = write_shards(knowledge_chunks)
+    pruned = prune_knowledge_cache(fingerprints)
+    manifest_size = SHARD_MANIFEST_FILE.stat().st_size
+    largest_shard = max((shard['bytes'] for shard in manifest['shards']), default=0)
     
     print("\n" + "-" * 50)
     print("✅ Indexing complete!")
     print(f"   📊 Processed: {processed} PDFs")
     print(f"   ⏭️  Skipped: {skipped} (unchanged)")
+    if pruned:
+        print(f"   🗑️  Removed {pruned} stale cache entries")
+    print(f"   🧹 Near-duplicates removed: {duplicate_count}"
+          f" ({duplicate_count / max(extracted_count, 1):.1%} of {extracted_count})")
     print(f"   📦 Total chunks: {len(knowledge_chunks)}")
+    print(f"   🔎 Postings: {len(index_data['postings']['terms'])} terms")
     print(f"   💾 Saved to: {INDEX_FILE}")
+    print(f"   🧩 Shards: {len(manifest['shards'])} in {SHARD_DIR} "
+          f"(manifest {manifest_size / 1024:.0f} KB, largest shard {largest_shard / 1024:.0f} KB)")
     print("=" * 50 + "\n")
 
 
 if __name__ == "__main__":
-    build_index()
+    import sys
+    if '--postings-only' in sys.argv:
+        added = add_postings()
+        print(f"🔎 Postings added to {INDEX_FILE}" if added else "ℹ️  Postings are up to date.")
+    else:
+        build_index()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Near-Duplicate Chunk Detection
+Textbooks repeat headers, footers, boilerplate and whole sections across
+editions. MinHashDeduper spots chunks that are near-copies of one seen
+earlier, so the index builders can drop them and keep a back-reference to
+where the text also appears instead.
+
+Each chunk is reduced to a set of overlapping word shingles; a MinHash
+signature of NUM_PERM 32-bit values estimates the Jaccard similarity of two
+such sets as the share of positions where their signatures agree.
+Signatures are split into LSH_BANDS bands, and only chunks sharing a whole
+band with the new one are compared, so a build never compares all pairs.
+With 8 bands of 8 rows, pairs above ~0.8 similarity are found almost
+always and pairs below ~0.5 are almost never compared.
+"""
+
+import re
+import zlib
+from array import array
+from typing import Dict, Hashable, List, Optional
+
+# Try to import NumPy for vectorised hashing, fall back to pure Python
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Settings
+SHINGLE_WORDS = 5  # words per shingle
+NUM_PERM = 64  # MinHash values per signature
+LSH_BANDS = 8  # bands of NUM_PERM // LSH_BANDS values each
+DEDUPE_THRESHOLD = 0.8  # estimated Jaccard similarity at which a chunk is a duplicate
+SEED = 1
+
+MERSENNE_PRIME = (1 << 61) - 1
+MASK_64 = (1 << 64) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_WORDS) -> List[int]:
+    """32-bit hashes of the distinct word shingles of a text."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return [zlib.crc32(' '.join(words).encode('utf-8'))]
+    return list({zlib.crc32(' '.join(words[i:i + size]).encode('utf-8'))
+                 for i in range(len(words) - size + 1)})
+
+
+class MinHashDeduper:
+    """Streaming near-duplicate detector.
+
+    add() every chunk in build order; it returns the key of an earlier
+    chunk the new one nearly duplicates, or None after remembering the new
+    chunk as an original. Only originals are remembered (NUM_PERM * 4 bytes
+    each plus one bucket entry per band). Chunks indexed by an earlier
+    build can be remembered from their stored signatures with
+    add_original(), so new chunks are checked against them too.
+    """
+
+    def __init__(self, threshold: float = DEDUPE_THRESHOLD, num_perm: int = NUM_PERM,
+                 bands: int = LSH_BANDS, seed: int = SEED):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self._band_bytes = num_perm // bands * 4
+        # Hash functions h(x) = ((a * x + b) mod 2^64) mod p, truncated to 32 bits
+        state = seed
+        params = []
+        for _ in range(2 * num_perm):
+            state = (state * 6364136223846793005 + 1442695040888963407) & MASK_64
+            params.append(state % MERSENNE_PRIME)
+        self._a, self._b = params[:num_perm], params[num_perm:]
+        if NUMPY_AVAILABLE:
+            self._a_array = np.array(self._a, dtype=np.uint64)
+            self._b_array = np.array(self._b, dtype=np.uint64)
+        self._keys: List[Hashable] = []
+        self._signatures: List[bytes] = []
+        self._buckets: Dict[int, List[int]] = {}  # band hash -> originals in that bucket
+        self.added = 0
+        self.duplicates = 0
+
+    def signature(self, text: str) -> bytes:
+        """MinHash signature of a text (NUM_PERM little-endian uint32)."""
+        hashes = shingle_hashes(text)
+        if NUMPY_AVAILABLE:
+            values = np.array(hashes, dtype=np.uint64)[:, None]
+            permuted = (values * self._a_array + self._b_array) % np.uint64(MERSENNE_PRIME)
+            return (permuted & np.uint64(MAX_HASH)).min(axis=0).astype('<u4').tobytes()
+        minimums = array('I', (min(((a * x + b) & MASK_64) % MERSENNE_PRIME & MAX_HASH for x in hashes)
+                               for a, b in zip(self._a, self._b)))
+        return minimums.tobytes()
+
+    def similarity(self, first: bytes, second: bytes) -> float:
+        """Estimated Jaccard similarity of two signatures."""
+        if NUMPY_AVAILABLE:
+            same = np.count_nonzero(np.frombuffer(first, dtype='<u4') == np.frombuffer(second, dtype='<u4'))
+        else:
+            same = sum(1 for x, y in zip(array('I', first), array('I', second)) if x == y)
+        return same / self.num_perm
+
+    def _bands(self, signature: bytes) -> List[int]:
+        return [hash((band, signature[band * self._band_bytes:(band + 1) * self._band_bytes]))
+                for band in range(self.bands)]
+
+    def add(self, key: Hashable, text: str) -> Optional[Hashable]:
+        """Key of the earlier chunk this text nearly duplicates, else None."""
+        return self.add_signature(key, self.signature(text))
+
+    def add_signature(self, key: Hashable, signature: bytes) -> Optional[Hashable]:
+        """add() for a chunk whose signature is already computed."""
+        self.added += 1
+        bands = self._bands(signature)
+
+        checked = set()
+        for band in bands:
+            for original in self._buckets.get(band, ()):
+                if original in checked:
+                    continue
+                checked.add(original)
+                if self.similarity(signature, self._signatures[original]) >= self.threshold:
+                    self.duplicates += 1
+                    return self._keys[original]
+
+        self._remember(key, signature, bands)
+        return None
+
+    def add_original(self, key: Hashable, signature: bytes):
+        """Remember an already indexed chunk as an original, without checking it."""
+        if len(signature) != self.num_perm * 4:
+            raise ValueError("signature does not have num_perm values")
+        self._remember(key, signature, self._bands(signature))
+
+    def _remember(self, key: Hashable, signature: bytes, bands: List[int]):
+        original = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for band in bands:
+            self._buckets.setdefault(band, []).append(original)
+
+    def get_stats(self) -> Dict:
+        """Chunks seen and dropped so far."""
+        return {
+            'chunks': self.added,
+            'duplicates': self.duplicates,
+            'ratio': round(self.duplicates / self.added, 4) if self.added else 0.0
+        }
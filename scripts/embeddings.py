@@ -10,10 +10,22 @@ without requiring external APIs or large ML models.
 import json
 import math
 import re
-import hashlib
+import itertools
+import heapq
+import multiprocessing
+import os
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-from collections import Counter, defaultdict
-from typing import List, Dict, Tuple, Optional
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Dict, Tuple, Optional
+
+from dedupe import MinHashDeduper
+from page_cache import get_file_hash, iter_pages, prune_page_cache
+from vector_format import DTYPE_NAMES, IndexFormatError, MappedIndex, write_arrays, write_index
 
 # Try to import fitz (PyMuPDF), fall back gracefully if not available
 try:
@@ -23,19 +35,64 @@ except ImportError:
     PYMUPDF_AVAILABLE = False
     print("⚠️  PyMuPDF not installed. Run: pip install pymupdf")
 
+# Try to import NumPy for vectorised search, fall back to pure Python
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 # Configuration
 SCRIPT_DIR = Path(__file__).parent.resolve()
 PROJECT_DIR = SCRIPT_DIR.parent
 CONTENT_DIR = PROJECT_DIR / "content"
 METADATA_FILE = PROJECT_DIR / "portal" / "data" / "metadata.json"
 VECTORS_DIR = PROJECT_DIR / "portal" / "data" / "vectors"
-VECTOR_INDEX_FILE = VECTORS_DIR / "index.json"
+SEGMENTS_DIR = VECTORS_DIR / "segments"
+VECTOR_MANIFEST_FILE = VECTORS_DIR / "manifest.json"
+VECTOR_INDEX_FILE = VECTORS_DIR / "index.json"  # pre-segment formats, imported on first load
+VECTOR_BINARY_FILE = VECTORS_DIR / "index.bin"
+RELATED_FILE = VECTORS_DIR / "related.json"
 
 # Embedding settings
 CHUNK_SIZE = 500  # characters per chunk
 CHUNK_OVERLAP = 100  # overlap between chunks
-MAX_PAGES_PER_PDF = 100  # max pages to process
-VECTOR_DIMENSIONS = 300  # vocabulary size for vectors
+MIN_TEXT_LENGTH = 100  # PDFs with less extracted text than this are skipped
+MAX_PENDING_CHUNKS = 4  # an unfinished sentence longer than this many chunks is split anyway
+EXTRACT_WORKERS = 2  # processes extracting PDFs during a build (1 = in-process)
+SEGMENT_FLUSH_CHUNKS = 5000  # chunks buffered before they are written out as a segment
+MIN_DOCUMENT_FREQUENCY = 2  # words in fewer chunks than this are left out of the vocabulary
+SCORE_THRESHOLD = 0.05  # minimum similarity for a search result
+QUERY_CACHE_SIZE = 256  # recent search results kept in memory
+
+# Segment merging
+MAX_SEGMENTS = 8  # merge the smallest segments once there are more than this
+MAX_DELETED_RATIO = 0.3  # rewrite a segment once this share of its chunks is deleted
+
+# In-memory TF-IDF weights (NumPy path)
+VECTOR_DTYPE = 'int8'  # 'int8' (with a per-chunk scale), 'float16' or 'float32'
+RERANK_FACTOR = 4  # re-score top_k * this quantised hits with exact float32 weights (0 = off)
+
+# BM25 settings
+BM25_K1 = 1.2  # term-frequency saturation
+BM25_B = 0.75  # document-length normalisation
+SEARCH_MODES = ('tfidf', 'bm25', 'ann')
+
+# Approximate search (mode 'ann', needs NumPy)
+ANN_MIN_DOCS = 5000  # smaller indexes are always searched exactly
+ANN_PROBES = 16  # IVF lists scored per query: more probes, better recall, slower
+ANN_SKETCH_DIM = 256  # dense sketch size used for clustering
+ANN_TRAINING_PER_LIST = 40  # k-means training sample per list
+ANN_KMEANS_ITERATIONS = 8
+ANN_BLOCK_ROWS = 8192  # rows sketched at a time when filing chunks
+ANN_RETRAIN_GROWTH = 4  # retrain the centroids once the index is this many times their training size
+
+# Related-resources graph (built after each index update)
+RELATED_TOP_N = 10  # neighbours kept per resource
+RELATED_TERMS = 256  # heaviest terms kept in each resource's vector
+RELATED_BLOCK_ROWS = 256  # most resources scored against the rest at a time
+RELATED_BLOCK_SCORES = 4_000_000  # most (resource, resource) scores held per block
+RELATED_BLOCK_ENTRIES = 1_000_000  # most weights (or shared-term products) summed per block
 
 # Stopwords (English + Urdu common words)
 STOPWORDS = set([
@@ -55,28 +112,6 @@ STOPWORDS = set([
 ])
 
 
-def extract_pdf_text(pdf_path: Path, max_pages: int = MAX_PAGES_PER_PDF) -> str:
-    """Extract text from PDF file."""
-    if not PYMUPDF_AVAILABLE:
-        return ""
-    
-    try:
-        doc = fitz.open(str(pdf_path))
-        text_parts = []
-        
-        for page_num in range(min(len(doc), max_pages)):
-            page = doc[page_num]
-            text = page.get_text()
-            if text.strip():
-                text_parts.append(text)
-        
-        doc.close()
-        return '\n\n'.join(text_parts)
-    except Exception as e:
-        print(f"    ⚠️  Error extracting text: {e}")
-        return ""
-
-
 def clean_text(text: str) -> str:
     """Clean and normalize text."""
     # Remove excessive whitespace
@@ -88,32 +123,112 @@ def clean_text(text: str) -> str:
     return text.strip()
 
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
-    """Split text into overlapping chunks."""
-    if len(text) < chunk_size:
-        return [text] if text.strip() else []
-    
-    chunks = []
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+def iter_chunks(pages: Iterable[str], chunk_size: int = CHUNK_SIZE,
+                overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """Split a stream of page texts into overlapping chunks.
     
+    Only the chunk being filled and the unfinished sentence at the end of
+    the last page are held in memory, so documents of any length stream
+    through.
+    """
     current_chunk = ""
-    for sentence in sentences:
+    pending = ""  # text after the last sentence break, continued on the next page
+    
+    def add(sentence):
+        nonlocal current_chunk
         if len(current_chunk) + len(sentence) > chunk_size:
             if current_chunk:
-                chunks.append(current_chunk.strip())
+                finished = current_chunk.strip()
                 # Keep overlap from previous chunk
                 words = current_chunk.split()
                 overlap_words = words[-overlap//5:] if len(words) > overlap//5 else words
                 current_chunk = ' '.join(overlap_words) + ' ' + sentence
-            else:
-                current_chunk = sentence
+                return finished
+            current_chunk = sentence
         else:
             current_chunk += ' ' + sentence
+        return None
     
+    for page in pages:
+        sentences = re.split(r'(?<=[.!?])\s+', (pending + ' ' + clean_text(page)).strip())
+        pending = sentences.pop()
+        if len(pending) > chunk_size * MAX_PENDING_CHUNKS:
+            # Pages without sentence breaks (tables, scans) mustn't accumulate
+            sentences.append(pending)
+            pending = ""
+        for sentence in sentences:
+            finished = add(sentence)
+            if finished:
+                yield finished
+    
+    if pending:
+        finished = add(pending)
+        if finished:
+            yield finished
     if current_chunk.strip():
-        chunks.append(current_chunk.strip())
+        yield current_chunk.strip()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks."""
+    return list(iter_chunks([text], chunk_size, overlap))
+
+
+def extract_chunks(resource: Dict, pdf_path: str) -> List[Dict]:
+    """Extract, chunk and tokenise one PDF (runs in an extraction worker).
     
-    return chunks
+    Page text comes from the shared page cache, so a PDF the knowledge
+    index already extracted isn't opened again. Returns [] when the PDF
+    has too little text to index.
+    """
+    chunks = []
+    text_length = 0
+    pages = (text for text in iter_pages(Path(pdf_path)) if text.strip())
+    for i, chunk in enumerate(iter_chunks(pages)):
+        tokens = tokenize(chunk)
+        text_length += len(chunk)
+        chunks.append({
+            'id': f"{resource['id']}_{i}",
+            'title': resource['title'],
+            'category': resource['category'],
+            'source_path': pdf_path,
+            'chunk_index': i,
+            'content': chunk[:1000],  # Store first 1000 chars
+            'tokens': tokens[:50],  # Store top tokens for reference
+            'token_counts': Counter(tokens),
+            'length': len(tokens)
+        })
+    return chunks if text_length >= MIN_TEXT_LENGTH else []
+
+
+def extract_files(jobs: List[Tuple[Dict, Path]],
+                  workers: int = EXTRACT_WORKERS) -> Iterator[Tuple[Dict, Path, List[Dict]]]:
+    """Extract (resource, pdf_path) jobs across a process pool.
+    
+    Yields (resource, pdf_path, chunks) in job order. At most two files
+    per worker are in flight, so finished files never pile up in memory
+    however many there are.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for resource, pdf_path in jobs:
+            yield resource, pdf_path, extract_chunks(resource, str(pdf_path))
+        return
+    
+    # "spawn" avoids forking a process that may have live threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        remaining = iter(jobs)
+        in_flight = deque()
+        
+        def submit_next():
+            for resource, pdf_path in itertools.islice(remaining, 1):
+                in_flight.append((resource, pdf_path, executor.submit(extract_chunks, resource, str(pdf_path))))
+        
+        for _ in range(workers * 2):
+            submit_next()
+        while in_flight:
+            resource, pdf_path, future = in_flight.popleft()
+            submit_next()
+            yield resource, pdf_path, future.result()
 
 
 def tokenize(text: str) -> List[str]:
@@ -130,28 +245,37 @@ def compute_tf(tokens: List[str]) -> Dict[str, float]:
     return {word: count / total for word, count in tf.items()}
 
 
-def compute_idf(documents: List[List[str]], vocabulary: set) -> Dict[str, float]:
+def compute_document_frequencies(documents: Iterable[Iterable[str]]) -> Counter:
+    """Count, in one pass, how many documents contain each word."""
+    doc_freqs = Counter()
+    for doc in documents:
+        doc_freqs.update(set(doc))
+    return doc_freqs
+
+
+def compute_idf(doc_freqs: Dict[str, int], n_docs: int, vocabulary: List[str]) -> Dict[str, float]:
     """Compute inverse document frequency."""
-    n_docs = len(documents)
-    idf = {}
-    
-    for word in vocabulary:
-        doc_count = sum(1 for doc in documents if word in doc)
-        idf[word] = math.log((n_docs + 1) / (doc_count + 1)) + 1
-    
-    return idf
+    return {
+        word: math.log((n_docs + 1) / (doc_freqs.get(word, 0) + 1)) + 1
+        for word in vocabulary
+    }
+
 
+def create_tfidf_vector(tokens: List[str], idf: Dict[str, float],
+                        term_index: Dict[str, int]) -> Tuple[List[int], List[float]]:
+    """Create a sparse, unit-length TF-IDF vector for a document.
 
-def create_tfidf_vector(tokens: List[str], idf: Dict[str, float], vocabulary: List[str]) -> List[float]:
-    """Create TF-IDF vector for a document."""
+    Returns parallel lists of term ids (ascending) and weights; words outside
+    the vocabulary are dropped.
+    """
     tf = compute_tf(tokens)
-    vector = []
-    
-    for word in vocabulary:
-        tfidf = tf.get(word, 0) * idf.get(word, 0)
-        vector.append(round(tfidf, 6))
-    
-    return vector
+    entries = sorted(
+        (term_index[word], freq * idf.get(word, 0))
+        for word, freq in tf.items() if word in term_index
+    )
+    terms = [term for term, _ in entries]
+    weights = normalize_vector([weight for _, weight in entries])
+    return terms, weights
 
 
 def normalize_vector(vector: List[float]) -> List[float]:
@@ -162,79 +286,1533 @@ def normalize_vector(vector: List[float]) -> List[float]:
     return [round(v / magnitude, 6) for v in vector]
 
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Compute cosine similarity between two vectors."""
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    return dot_product  # Already normalized
+def sparse_dot(query: Dict[int, float], terms: List[int], weights: List[float]) -> float:
+    """Dot product of a sparse query {term: weight} with a sparse document."""
+    return sum(query.get(term, 0.0) * weight for term, weight in zip(terms, weights))
 
 
-def get_file_hash(file_path: Path) -> str:
-    """Get hash of file for change detection."""
-    stat = file_path.stat()
-    return hashlib.md5(f"{file_path}:{stat.st_mtime}:{stat.st_size}".encode()).hexdigest()
+class BM25Index:
+    """Inverted index with BM25 scoring and max-score top-k pruning.
 
+    Postings map a term id to ascending document rows and term counts, so a
+    query only visits the postings of its own terms. Each term also stores
+    the highest score it can contribute to any document; once the top-k
+    threshold exceeds the summed bounds of the weakest terms, those terms
+    stop producing candidates and are only probed for documents that can
+    still enter the top k.
+    """
+    
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        # Term-major postings: term t's rows are
+        # _post_rows[_post_ptr[t]:_post_ptr[t + 1]], its counts the same slice of _post_tfs
+        self._post_ptr: List[int] = [0]
+        self._post_rows = []
+        self._post_tfs = []
+        self.idf: List[float] = []  # per term id
+        self.max_scores: List[float] = []  # per term id, 0.0 for terms without postings
+        self.length_norms: List[float] = []  # k1 * (1 - b + b * dl / avgdl)
+    
+    def build(self, documents: List[Dict]):
+        """Build postings from each document's term ids and counts."""
+        postings = defaultdict(list)
+        lengths = []
+        
+        for row, doc in enumerate(documents):
+            terms = doc.get('terms', [])
+            counts = doc.get('counts') or [1] * len(terms)
+            lengths.append(doc.get('length', sum(counts)))
+            for term, count in zip(terms, counts):
+                postings[term].append((row, count))
+        
+        post_ptr = [0]
+        post_rows, post_tfs = [], []
+        for term in range(max(postings, default=-1) + 1):
+            for row, count in postings.get(term, []):
+                post_rows.append(row)
+                post_tfs.append(count)
+            post_ptr.append(len(post_rows))
+        
+        self.load(post_ptr, post_rows, post_tfs, lengths)
+    
+    def load(self, post_ptr, post_rows, post_tfs, lengths, max_scores=None):
+        """Load term-major postings (e.g. memoryviews of a mapped index).
 
-class VectorStore:
-    """Manages vector embeddings for documents."""
+        post_rows[post_ptr[t]:post_ptr[t + 1]] are the ascending rows that
+        contain term t, with matching counts in post_tfs. Rows and counts
+        are kept as given and only sliced for a query's own terms; with
+        NumPy, IDF and score bounds are computed over all postings at once,
+        or the bounds are taken from max_scores when they were persisted.
+        """
+        self._post_rows, self._post_tfs = post_rows, post_tfs
+        if NUMPY_AVAILABLE:
+            self._load_numpy(np.asarray(post_ptr, dtype=np.int64), post_rows, post_tfs,
+                             np.asarray(lengths, dtype=np.float64), max_scores)
+            return
+        
+        n_docs = len(lengths)
+        avg_length = (sum(lengths) / n_docs) if n_docs else 0
+        self.length_norms = [
+            self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+            for length in lengths
+        ]
+        self._post_ptr = list(post_ptr)
+        self.idf = []
+        self.max_scores = []
+        for term in range(len(post_ptr) - 1):
+            start, end = post_ptr[term], post_ptr[term + 1]
+            df = end - start
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            self.idf.append(idf)
+            self.max_scores.append(max(
+                (self._term_score(idf, tf, self.length_norms[row])
+                 for row, tf in zip(post_rows[start:end], post_tfs[start:end])),
+                default=0.0
+            ))
     
-    def __init__(self):
+    def _load_numpy(self, post_ptr, post_rows, post_tfs, lengths, max_scores=None):
+        """Vectorised load(): the same values as the Python loop, without the loop.
+        
+        Per-term and per-row values are kept as memoryviews of the arrays,
+        which index to plain Python numbers without a list per value.
+        """
+        n_docs = len(lengths)
+        avg_length = lengths.sum() / n_docs if n_docs else 0
+        if avg_length:
+            length_norms = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+        else:
+            length_norms = np.full(n_docs, self.k1)
+        
+        df = np.diff(post_ptr)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        if max_scores is None:
+            max_scores = np.zeros(len(df))
+            nonempty = df > 0
+            if nonempty.any():
+                # Every posting's score (in _term_score's operation order), then
+                # the maximum over each term's run of postings
+                tfs = np.asarray(post_tfs, dtype=np.float64)
+                scores = np.repeat(idf, df) * tfs * (self.k1 + 1) / (tfs + length_norms[np.asarray(post_rows)])
+                max_scores[nonempty] = np.maximum.reduceat(scores, post_ptr[:-1][nonempty])
+        
+        self.length_norms = memoryview(length_norms)
+        self._post_ptr = memoryview(post_ptr)
+        self.idf = memoryview(idf)
+        self.max_scores = memoryview(np.asarray(max_scores, dtype=np.float64))
+    
+    def _term_score(self, idf: float, tf: int, length_norm: float) -> float:
+        return idf * tf * (self.k1 + 1) / (tf + length_norm)
+    
+    def search(self, query_terms: List[int], top_k: int,
+               allowed: Optional[bytearray] = None) -> List[Tuple[int, float]]:
+        """Return (row, score) for the top_k documents, best first.
+        
+        With allowed, rows whose entry is 0 are skipped without scoring.
+        """
+        post_ptr = self._post_ptr
+        postings = {}
+        for t in set(query_terms):
+            if 0 <= t < len(post_ptr) - 1 and post_ptr[t] < post_ptr[t + 1]:
+                start, end = post_ptr[t], post_ptr[t + 1]
+                postings[t] = (self._post_rows[start:end], self._post_tfs[start:end])
+        terms = sorted(postings, key=lambda t: self.max_scores[t])
+        if not terms or top_k <= 0:
+            return []
+        
+        # bounds[i] = most that terms[0..i] can add to any document
+        bounds = list(itertools.accumulate(self.max_scores[t] for t in terms))
+        cursors = [0] * len(terms)
+        heap: List[Tuple[float, int]] = []
+        threshold = 0.0
+        first_essential = 0  # terms before this index can't form a top-k hit alone
+        
+        while True:
+            # Next candidate: the smallest row among essential terms' cursors
+            candidate = None
+            for i in range(first_essential, len(terms)):
+                rows = postings[terms[i]][0]
+                if cursors[i] < len(rows) and (candidate is None or rows[cursors[i]] < candidate):
+                    candidate = rows[cursors[i]]
+            if candidate is None:
+                break
+            
+            if allowed is not None and not allowed[candidate]:
+                for i in range(first_essential, len(terms)):
+                    rows = postings[terms[i]][0]
+                    if cursors[i] < len(rows) and rows[cursors[i]] == candidate:
+                        cursors[i] += 1
+                continue
+            
+            length_norm = self.length_norms[candidate]
+            score = 0.0
+            for i in range(first_essential, len(terms)):
+                rows, tfs = postings[terms[i]]
+                if cursors[i] < len(rows) and rows[cursors[i]] == candidate:
+                    score += self._term_score(self.idf[terms[i]], tfs[cursors[i]], length_norm)
+                    cursors[i] += 1
+            
+            # Probe non-essential terms, strongest first, while they can still matter
+            for i in range(first_essential - 1, -1, -1):
+                if score + bounds[i] <= threshold:
+                    break
+                rows, tfs = postings[terms[i]]
+                cursors[i] = bisect_left(rows, candidate, cursors[i])
+                if cursors[i] < len(rows) and rows[cursors[i]] == candidate:
+                    score += self._term_score(self.idf[terms[i]], tfs[cursors[i]], length_norm)
+            
+            if len(heap) < top_k:
+                heapq.heappush(heap, (score, candidate))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, candidate))
+            else:
+                continue
+            
+            if len(heap) == top_k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and bounds[first_essential] <= threshold:
+                    first_essential += 1
+        
+        return [(row, score) for score, row in sorted(heap, reverse=True)]
+
+
+def csr_positions(doc_ptr, rows):
+    """Positions in CSR arrays of the entries of the given rows.
+    
+    Returns (positions, owners) where owners[i] is the index into rows
+    that positions[i] belongs to. NumPy only.
+    """
+    starts = doc_ptr[rows]
+    lengths = doc_ptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets, owners
+
+
+def entry_blocks(entries, max_entries: int, n: int, max_rows: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+    """Split items 0..n-1 into consecutive [first, last) blocks whose
+    entries sum to at most max_entries (an item with more is a block by
+    itself), with at most max_rows items each. NumPy only.
+    """
+    totals = np.cumsum(entries)
+    first = 0
+    while first < n:
+        base = totals[first - 1] if first else 0
+        last = max(int(np.searchsorted(totals, base + max_entries, side='right')), first + 1)
+        if max_rows is not None:
+            last = min(last, first + max_rows)
+        yield first, min(last, n)
+        first = min(last, n)
+
+
+def row_sums(values, doc_ptr):
+    """Sum of each CSR row's entries (0 for empty rows). NumPy only."""
+    starts, ends = doc_ptr[:-1], doc_ptr[1:]
+    sums = np.zeros(len(starts), dtype=np.float32)
+    nonempty = starts < ends
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+    return sums
+
+
+def quantize_weights(data, rows, n_rows: int, dtype: str = VECTOR_DTYPE):
+    """Convert float32 CSR weights to the storage dtype. NumPy only.
+    
+    int8 weights are scaled per row so the row's largest weight maps to
+    127 (as in vector_format.quantize_row). Returns (values, scales), with
+    scales None unless dtype is int8.
+    """
+    if dtype == 'float16':
+        return data.astype(np.float16), None
+    if dtype != 'int8':
+        return data, None
+    peaks = np.zeros(n_rows, dtype=np.float32)
+    np.maximum.at(peaks, rows, np.abs(data))
+    scales = peaks / 127
+    scales[scales == 0] = 1.0
+    return np.rint(data / scales[rows]).astype(np.int8), scales
+
+
+def hash_words(words: List[str], dim: int):
+    """Sketch dimension and sign of each word (NumPy only).
+    
+    Both come from a CRC of the word itself rather than a term id, so
+    sketches of different segments, written against different
+    vocabularies, land in the same space.
+    """
+    hashes = np.array([zlib.crc32(word.encode('utf-8')) for word in words], dtype=np.uint32)
+    buckets = (hashes % dim).astype(np.int64)
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+    return buckets, signs
+
+
+class IVFIndex:
+    """Approximate nearest-neighbour index over the TF-IDF vectors (NumPy only).
+    
+    Each sparse vector is folded into a short dense sketch (count-sketch
+    feature hashing, which preserves dot products in expectation). Sketches
+    are clustered with spherical k-means into about sqrt(n) lists, and every
+    chunk is filed under its nearest centroid. A query only scores, exactly,
+    the chunks in its `probes` nearest lists, so more probes trade latency
+    for recall.
+    
+    Centroids and each segment's list assignments are computed when
+    segments are written (see update_ivf) and stored next to them, so a
+    snapshot only gathers the lists of its live rows.
+    """
+    
+    def __init__(self, centroids, lists, vocabulary: List[str]):
+        """lists holds the IVF list of every search row."""
+        self.centroids = centroids  # (n_lists, dim), unit rows
+        self.dim = centroids.shape[1]
+        self.vocabulary = vocabulary  # query term ids are hashed by word
+        # List l holds list_rows[list_ptr[l]:list_ptr[l + 1]]
+        self.list_rows = np.argsort(lists, kind='stable').astype(np.int32)
+        self.list_ptr = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(centroids)))))
+    
+    def candidates(self, query_terms: List[int], query_weights: List[float], probes: int):
+        """Rows in the `probes` lists nearest to a query, ascending."""
+        buckets, signs = hash_words([self.vocabulary[term] for term in query_terms], self.dim)
+        query = np.bincount(buckets, weights=signs * np.asarray(query_weights), minlength=self.dim)
+        probes = min(probes, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        return np.sort(np.concatenate([self.list_rows[self.list_ptr[l]:self.list_ptr[l + 1]] for l in nearest]))
+
+
+def top_k_scores(scores, top_k: int, threshold: float = SCORE_THRESHOLD) -> List[Tuple[int, float]]:
+    """(index, score) of the top_k scores above threshold, best first."""
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return []
+    
+    # argpartition finds the top k in O(n); only those k get sorted
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top if scores[i] > threshold]
+
+
+class QueryCache:
+    """Thread-safe LRU cache of search results.
+    
+    Keys include the index generation, so results computed against an
+    older index are never served; clear() just frees them early.
+    """
+    
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+    
+    def get(self, key: tuple) -> Optional[List[Dict]]:
+        with self._lock:
+            results = self._entries.get(key)
+            if results is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return results
+    
+    def put(self, key: tuple, results: List[Dict]):
+        with self._lock:
+            self._entries[key] = results
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self) -> Dict:
+        """Size and hit rate for the stats API."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0
+            }
+
+
+def load_manifest() -> Dict:
+    """Load the segment manifest (an empty one if none exists yet)."""
+    if VECTOR_MANIFEST_FILE.exists():
+        with open(VECTOR_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'format': 1, 'generation': 0, 'next_segment': 1, 'segments': [], 'file_hashes': {}}
+
+
+def save_manifest(manifest: Dict):
+    """Atomically replace the manifest, publishing a new index generation."""
+    manifest['generation'] += 1
+    manifest['updated'] = datetime.now().isoformat()
+    VECTORS_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = VECTOR_MANIFEST_FILE.with_suffix('.json.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, VECTOR_MANIFEST_FILE)
+
+
+def remove_unreferenced_segments(manifest: Dict):
+    """Delete segment, IVF and view files the manifest no longer lists.
+    
+    Processes that still map a removed file keep reading it until they
+    reload; on Windows the delete fails and is retried next time.
+    """
+    if not SEGMENTS_DIR.exists():
+        return
+    referenced = {entry['name'] for entry in manifest['segments']}
+    referenced.update(entry['ivf_lists'] for entry in manifest['segments'] if 'ivf_lists' in entry)
+    for model in ('ivf', 'view'):
+        if model in manifest:
+            referenced.add(manifest[model]['name'])
+    for segment_path in itertools.chain(SEGMENTS_DIR.glob('seg_*.bin'), SEGMENTS_DIR.glob('view_*.bin'),
+                                        SEGMENTS_DIR.glob('*.npy')):
+        if segment_path.name not in referenced:
+            try:
+                segment_path.unlink()
+            except OSError:
+                pass
+
+
+def save_related(related: Dict[str, List], generation: int):
+    """Atomically replace the related-resources graph file."""
+    VECTORS_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = RELATED_FILE.with_suffix('.json.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'format': 1, 'generation': generation, 'top_n': RELATED_TOP_N, 'related': related},
+                  f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, RELATED_FILE)
+
+
+def write_segment(manifest: Dict, chunks: List[Dict]) -> Dict:
+    """Write chunks to a new immutable segment and return its manifest entry.
+    
+    Each chunk carries its record fields plus 'token_counts' (word -> count),
+    'length' and its MinHash 'signature', which build_index checks later
+    chunks against. Chunks are grouped by source file so a file's chunks form
+    one row range, which is what tombstoning looks up.
+    """
+    by_file = defaultdict(list)
+    for chunk in chunks:
+        by_file[chunk['source_path']].append(chunk)
+    
+    vocabulary = sorted({word for chunk in chunks for word in chunk['token_counts']})
+    term_index = {word: term for term, word in enumerate(vocabulary)}
+    
+    documents = []
+    files = {}
+    for path, file_chunks in by_file.items():
+        files[path] = [len(documents), len(file_chunks)]
+        for chunk in file_chunks:
+            entries = sorted((term_index[word], count) for word, count in chunk['token_counts'].items())
+            doc = {k: v for k, v in chunk.items() if k not in ('token_counts', 'length')}
+            doc['terms'] = [term for term, _ in entries]
+            doc['counts'] = [count for _, count in entries]
+            doc['length'] = chunk['length']
+            documents.append(doc)
+    
+    name = f"seg_{manifest['next_segment']:06d}.bin"
+    manifest['next_segment'] += 1
+    write_index(SEGMENTS_DIR / name, vocabulary, [], documents, postings=False,
+                extra={'files': files, 'created': datetime.now().isoformat()})
+    return {'name': name, 'docs': len(documents), 'deleted': []}
+
+
+def import_legacy_index() -> bool:
+    """Turn a pre-segment index (index.bin or index.json) into a first segment.
+    
+    Term counts are recomputed from each chunk's stored content, which is
+    the whole chunk since chunks are shorter than the stored prefix.
+    """
+    if VECTOR_BINARY_FILE.exists():
+        legacy = MappedIndex(VECTOR_BINARY_FILE)
+        records = [legacy.record(row) for row in range(legacy.n_docs)]
+        file_hashes = legacy.extra.get('file_hashes', {})
+        legacy.close()
+    elif VECTOR_INDEX_FILE.exists():
+        with open(VECTOR_INDEX_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        records = data.get('documents', [])
+        file_hashes = data.get('file_hashes', {})
+    else:
+        return False
+    
+    print("🔄 Importing existing vector index as a segment...")
+    deduper = MinHashDeduper()
+    chunks = []
+    for record in records:
+        tokens = tokenize(record.get('content', ''))
+        chunk = {k: v for k, v in record.items() if k not in ('terms', 'weights', 'counts', 'length', 'vector')}
+        chunk['token_counts'] = Counter(tokens)
+        chunk['length'] = len(tokens)
+        chunk['signature'] = deduper.signature(record.get('content', ''))
+        chunks.append(chunk)
+    
+    manifest = load_manifest()
+    if chunks:
+        manifest['segments'].append(write_segment(manifest, chunks))
+    manifest['file_hashes'] = file_hashes
+    manifest['doc_freqs'] = compute_document_frequencies(chunk['token_counts'] for chunk in chunks)
+    manifest['total_docs'] = len(chunks)
+    update_ivf(manifest, {})
+    update_view(manifest, {})
+    save_manifest(manifest)
+    return True
+
+
+class Segment:
+    """One immutable, memory-mapped segment file.
+    
+    A segment stores raw term counts against its own vocabulary, never
+    weights or postings, so writing a new segment doesn't invalidate
+    existing ones. TF-IDF weights and BM25 postings depend on corpus-wide
+    statistics and live in the generation's view file (see update_view).
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.index = MappedIndex(SEGMENTS_DIR / name)
+        self.vocabulary = self.index.vocabulary()
+        self.files: Dict[str, List[int]] = self.index.extra.get('files', {})  # path -> [first row, count]
+    
+    @property
+    def n_docs(self) -> int:
+        return self.index.n_docs
+    
+    def rows_for(self, path: str) -> range:
+        """Rows holding the chunks of one source file."""
+        start, count = self.files.get(path, (0, 0))
+        return range(start, start + count)
+    
+    def words(self, row: int) -> List[str]:
+        """Distinct words of one chunk."""
+        doc_ptr = self.index.view('doc_ptr')
+        terms = self.index.view('terms')[doc_ptr[row]:doc_ptr[row + 1]]
+        return [self.vocabulary[term] for term in terms]
+    
+    def chunk(self, row: int) -> Dict:
+        """Rebuild a chunk (record, token counts, length and signature) for merging."""
+        doc = self.index.document(row)
+        chunk = {k: v for k, v in doc.items() if k not in ('terms', 'weights', 'counts', 'length')}
+        chunk['token_counts'] = {self.vocabulary[term]: count for term, count in zip(doc['terms'], doc['counts'])}
+        chunk['length'] = doc['length']
+        return chunk
+    
+    def close(self):
+        self.index.close()
+
+
+class SegmentSketcher:
+    """Dense sketches of one segment's rows, weighted by corpus IDF (NumPy only)."""
+    
+    def __init__(self, segment: Segment, idf: Dict[str, float], dim: int = ANN_SKETCH_DIM):
+        index = segment.index
+        self.n_docs = index.n_docs
+        self.dim = dim
+        self._doc_ptr = index.array('doc_ptr').astype(np.int64)
+        self._terms = index.array('terms')
+        self._counts = index.array('counts')
+        self._buckets, self._signs = hash_words(segment.vocabulary, dim)
+        # Words left out of the corpus vocabulary weigh nothing, as in a query
+        self._idf = np.array([idf.get(word, 0.0) for word in segment.vocabulary] or [0.0], dtype=np.float32)
+    
+    def sketch(self, rows):
+        """Unit-length dense sketches of the given rows."""
+        positions, owners = csr_positions(self._doc_ptr, rows)
+        terms = self._terms[positions]
+        flat = owners * self.dim + self._buckets[terms]
+        weights = self._signs[terms] * self._idf[terms] * self._counts[positions]
+        sketch = np.bincount(flat, weights=weights, minlength=len(rows) * self.dim).reshape(len(rows), self.dim)
+        norms = np.linalg.norm(sketch, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (sketch / norms).astype(np.float32)
+    
+    def nearest_lists(self, centroids):
+        """Nearest centroid of every row (deleted ones included), a block at a time."""
+        lists = np.empty(self.n_docs, dtype=np.int32)
+        for start in range(0, self.n_docs, ANN_BLOCK_ROWS):
+            block = np.arange(start, min(start + ANN_BLOCK_ROWS, self.n_docs))
+            lists[block] = np.argmax(self.sketch(block) @ centroids.T, axis=1)
+        return lists
+
+
+def live_row_mask(n_docs: int, deleted: Iterable[int]):
+    """Boolean mask of a segment's rows that are not deleted. NumPy only."""
+    live = np.ones(n_docs, dtype=bool)
+    live[list(deleted)] = False
+    return live
+
+
+def train_centroids(entries: List[Dict], sketchers: Dict[str, SegmentSketcher], n_docs: int, seed: int = 0):
+    """Spherical k-means centroids for about sqrt(n_docs) IVF lists.
+    
+    Trained on a sample of ANN_TRAINING_PER_LIST live rows per list, drawn
+    across all segments. NumPy only.
+    """
+    rng = np.random.default_rng(seed)
+    n_lists = max(1, int(math.sqrt(n_docs)))
+    sample_size = min(n_docs, ANN_TRAINING_PER_LIST * n_lists)
+    picks = np.sort(rng.choice(n_docs, sample_size, replace=False))
+    
+    # Picks number live rows consecutively across segments, like search rows
+    sample = []
+    base = 0
+    for entry in entries:
+        live_rows = np.flatnonzero(live_row_mask(entry['docs'], entry['deleted']))
+        chosen = picks[(picks >= base) & (picks < base + len(live_rows))] - base
+        if len(chosen):
+            sample.append(sketchers[entry['name']].sketch(live_rows[chosen]))
+        base += len(live_rows)
+    sample = np.concatenate(sample)
+    
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+    for _ in range(ANN_KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]  # reseed empty lists
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+def ivf_lists_name(segment_name: str, model_name: str) -> str:
+    """File holding one segment's IVF list assignments under one set of centroids."""
+    return f"{Path(segment_name).stem}.{Path(model_name).stem}.npy"
+
+
+def update_ivf(manifest: Dict, open_segments: Dict[str, Segment]):
+    """Bring the persisted IVF lists up to date with manifest's segments.
+    
+    Segments written since the centroids were trained are filed under the
+    existing centroids. Centroids are only retrained (and every segment
+    refiled) when there are none yet or the index has grown
+    ANN_RETRAIN_GROWTH-fold since training. Indexes below ANN_MIN_DOCS live
+    chunks get no IVF lists. Call before save_manifest(); segments missing
+    from open_segments are opened for the duration. No-op without NumPy.
+    """
+    if not NUMPY_AVAILABLE:
+        return
+    entries = manifest['segments']
+    n_docs = manifest['total_docs']
+    if not n_docs or n_docs < ANN_MIN_DOCS:
+        manifest.pop('ivf', None)
+        for entry in entries:
+            entry.pop('ivf_lists', None)
+        return
+    
+    model = manifest.get('ivf')
+    retrain = (model is None or model['dim'] != ANN_SKETCH_DIM
+               or n_docs > model['docs'] * ANN_RETRAIN_GROWTH)
+    pending = [entry for entry in entries
+               if retrain or entry.get('ivf_lists') != ivf_lists_name(entry['name'], model['name'])]
+    if not pending:
+        return
+    
+    doc_freqs = manifest['doc_freqs']
+    vocabulary = [word for word, count in doc_freqs.items() if count >= MIN_DOCUMENT_FREQUENCY]
+    idf = compute_idf(doc_freqs, n_docs, vocabulary)
+    opened = []
+    sketchers = {}
+    try:
+        for entry in pending:
+            segment = open_segments.get(entry['name'])
+            if segment is None:
+                segment = Segment(entry['name'])
+                opened.append(segment)
+            sketchers[entry['name']] = SegmentSketcher(segment, idf)
+        
+        if retrain:
+            model = {'name': f"ivf_{manifest['next_segment']:06d}.npy", 'dim': ANN_SKETCH_DIM, 'docs': n_docs}
+            manifest['next_segment'] += 1
+            centroids = train_centroids(entries, sketchers, n_docs)
+            np.save(SEGMENTS_DIR / model['name'], centroids)
+            model['lists'] = len(centroids)
+            manifest['ivf'] = model
+        else:
+            centroids = np.load(SEGMENTS_DIR / model['name'])
+        
+        for entry in pending:
+            name = ivf_lists_name(entry['name'], model['name'])
+            np.save(SEGMENTS_DIR / name, sketchers[entry['name']].nearest_lists(centroids))
+            entry['ivf_lists'] = name
+    finally:
+        sketchers.clear()
+        for segment in opened:
+            segment.close()
+
+
+def load_ivf(manifest: Dict, segments: List[Segment], deleted: List[set], vocabulary: List[str],
+             idf: Dict[str, float]) -> Optional[IVFIndex]:
+    """The persisted IVF index restricted to live rows, or None.
+    
+    None below ANN_MIN_DOCS live chunks or until update_ivf has trained
+    centroids. Segments without stored lists (e.g. written without NumPy)
+    are filed under the centroids in memory. NumPy only.
+    """
+    model = manifest.get('ivf')
+    n_live = sum(segment.n_docs - len(dead) for segment, dead in zip(segments, deleted))
+    if model is None or not n_live or n_live < ANN_MIN_DOCS:
+        return None
+    
+    centroids = np.load(SEGMENTS_DIR / model['name'])
+    lists = []
+    for entry, segment, dead in zip(manifest['segments'], segments, deleted):
+        name = ivf_lists_name(entry['name'], model['name'])
+        if entry.get('ivf_lists') == name:
+            segment_lists = np.load(SEGMENTS_DIR / name)
+        else:
+            segment_lists = SegmentSketcher(segment, idf, centroids.shape[1]).nearest_lists(centroids)
+        lists.append(segment_lists[live_row_mask(segment.n_docs, dead)])
+    return IVFIndex(centroids, np.concatenate(lists), vocabulary)
+
+
+def corpus_vocabulary(doc_freqs: Dict[str, int], n_docs: int) -> Tuple[List[str], Dict[str, float]]:
+    """Sorted vocabulary (words in at least MIN_DOCUMENT_FREQUENCY chunks) and its IDF."""
+    vocabulary = sorted(word for word, count in doc_freqs.items() if count >= MIN_DOCUMENT_FREQUENCY)
+    return vocabulary, compute_idf(doc_freqs, n_docs, vocabulary)
+
+
+def combine_segments(segments: List[Segment], deleted: List[set], vocabulary: List[str],
+                     idf: Dict[str, float]) -> Dict:
+    """Corpus-wide search arrays of the segments' live rows, keyed by
+    vector_format section name. NumPy only.
+    
+    Rows are numbered consecutively across segments and terms by their
+    position in vocabulary: TF-IDF CSR arrays (weights quantised to
+    VECTOR_DTYPE, with the exact norms kept for re-ranking), term counts
+    and lengths, BM25 postings and their per-term score bounds.
+    """
+    term_index = {word: term for term, word in enumerate(vocabulary)}
+    indices, counts, rows, lengths = [], [], [], []
+    first_row = 0
+    for segment, dead in zip(segments, deleted):
+        index = segment.index
+        local_rows = np.repeat(np.arange(index.n_docs, dtype=np.int64),
+                               np.diff(index.array('doc_ptr')).astype(np.int64))
+        # Renumber live rows consecutively; deleted rows become -1
+        live = live_row_mask(index.n_docs, dead)
+        row_map = np.full(index.n_docs, -1, dtype=np.int64)
+        row_map[live] = first_row + np.arange(int(live.sum()))
+        first_row += int(live.sum())
+        
+        # Map segment term ids to corpus term ids, dropping rare words (-1)
+        term_map = np.array([term_index.get(word, -1) for word in segment.vocabulary] or [-1], dtype=np.int32)
+        to_corpus = term_map[index.array('terms')]
+        keep = (row_map[local_rows] >= 0) & (to_corpus >= 0)
+        indices.append(to_corpus[keep])
+        counts.append(index.array('counts')[keep])
+        rows.append(row_map[local_rows][keep])
+        lengths.append(index.array('lengths')[live])
+    
+    n_docs = first_row
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.uint16)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.uint32)
+    
+    # Unit-length TF-IDF weights (the tf denominator cancels out)
+    idf_values = np.array([idf[word] for word in vocabulary], dtype=np.float32)
+    data = counts.astype(np.float32) * idf_values[indices]
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=n_docs))
+    norms[norms == 0] = 1.0
+    data /= norms[rows].astype(np.float32)
+    
+    # Term-major postings for BM25: sort entries by (term, row)
+    order = np.lexsort((rows, indices))
+    post_ptr = np.concatenate(([0], np.cumsum(np.bincount(indices, minlength=len(vocabulary)))))
+    post_rows = rows[order].astype(np.int32)
+    post_tfs = counts[order]
+    del order
+    bm25 = BM25Index()
+    bm25.load(post_ptr, memoryview(post_rows), memoryview(post_tfs), lengths)
+    # Round the bounds up to float32 so they stay upper bounds
+    max_scores = np.asarray(bm25.max_scores)
+    bounds = max_scores.astype(np.float32)
+    low = bounds < max_scores
+    bounds[low] = np.nextafter(bounds[low], np.float32(np.inf))
+    
+    # Rows are ascending, so CSR row pointers fall out of a binary search
+    doc_ptr = np.searchsorted(rows, np.arange(n_docs + 1))
+    data, scales = quantize_weights(data, rows, n_docs, VECTOR_DTYPE)
+    
+    return {
+        'idf': idf_values, 'doc_ptr': doc_ptr, 'terms': indices, 'weights': data,
+        'scales': scales if scales is not None else np.zeros(0, dtype=np.float32),
+        'counts': counts, 'lengths': lengths, 'norms': norms.astype(np.float32),
+        'post_ptr': post_ptr, 'post_rows': post_rows, 'post_tfs': post_tfs, 'bounds': bounds,
+    }
+
+
+def view_settings() -> Dict:
+    """Settings a view file's arrays depend on; a view written under others is ignored."""
+    return {'dtype': VECTOR_DTYPE, 'bm25': [BM25_K1, BM25_B], 'min_df': MIN_DOCUMENT_FREQUENCY}
+
+
+def update_view(manifest: Dict, open_segments: Dict[str, Segment]):
+    """Write the view file of manifest's live rows: the arrays of combine_segments().
+    
+    Snapshots memory-map these arrays instead of combining the segments
+    on every load, so only the writer pays for combining them, once per
+    generation. Call before save_manifest(); segments missing from
+    open_segments are opened for the duration. Without NumPy, or with a
+    VECTOR_DTYPE the file format can't store, no view is written and
+    snapshots combine the segments themselves.
+    """
+    manifest.pop('view', None)
+    doc_freqs = manifest.get('doc_freqs')
+    if not NUMPY_AVAILABLE or VECTOR_DTYPE not in DTYPE_NAMES or doc_freqs is None or 'total_docs' not in manifest:
+        return
+    
+    opened = []
+    try:
+        segments = []
+        for entry in manifest['segments']:
+            segment = open_segments.get(entry['name'])
+            if segment is None:
+                segment = Segment(entry['name'])
+                opened.append(segment)
+            segments.append(segment)
+        vocabulary, idf = corpus_vocabulary(doc_freqs, manifest['total_docs'])
+        arrays = combine_segments(segments, [set(entry['deleted']) for entry in manifest['segments']],
+                                  vocabulary, idf)
+        name = f"view_{manifest['next_segment']:06d}.bin"
+        manifest['next_segment'] += 1
+        write_arrays(SEGMENTS_DIR / name, vocabulary, arrays, extra=view_settings(), dtype=VECTOR_DTYPE)
+        manifest['view'] = {'name': name, **view_settings()}
+    finally:
+        for segment in opened:
+            segment.close()
+
+
+def count_document_frequencies(segments: List[Segment], deleted: List[set]) -> Dict[str, int]:
+    """Count document frequencies of live chunks by scanning segments.
+    
+    Only needed for manifests written before df counters were persisted.
+    """
+    return compute_document_frequencies(
+        segment.words(row) for segment, dead in zip(segments, deleted)
+        for row in range(segment.n_docs) if row not in dead
+    )
+
+
+def file_row_ranges(segments: List[Segment], deleted: List[set]) -> List[Tuple[int, int, Dict]]:
+    """Search-row range and filter attributes of each file part in each segment.
+    
+    A file's chunks are one row range within a segment and live rows are
+    numbered consecutively across segments, so each part stays a single
+    range of search rows. Attributes come from the part's first record.
+    """
+    parts = []
+    base = 0
+    for segment, dead in zip(segments, deleted):
+        dead_rows = sorted(dead)
+        for path, (first, count) in segment.files.items():
+            start = base + first - bisect_left(dead_rows, first)
+            end = base + first + count - bisect_left(dead_rows, first + count)
+            if start == end:
+                continue
+            record = segment.index.record(first)
+            parts.append((start, end, {
+                'category': record.get('category', ''),
+                'resource_id': str(record.get('id', '')).rsplit('_', 1)[0],
+                'format': Path(path).suffix.lstrip('.').lower(),
+            }))
+        base += segment.n_docs - len(dead_rows)
+    return sorted(parts, key=lambda part: part[0])
+
+
+def remember_indexed_chunks(deduper: MinHashDeduper, segments: List[Tuple[Segment, Dict]], skip_paths: set):
+    """Seed deduper with the live chunks of (segment, manifest entry) pairs.
+    
+    Chunks of skip_paths (about to be tombstoned) are left out, as are
+    segments written before signatures were stored. Keys are (segment,
+    row); resolve_original() turns one into (file, chunk id).
+    """
+    for segment, entry in segments:
+        first_signature = segment.index.signature(0) if segment.n_docs else None
+        if first_signature is None or len(first_signature) != deduper.num_perm * 4:
+            continue
+        dead = set(entry['deleted'])
+        for path, (first, count) in segment.files.items():
+            if path in skip_paths:
+                continue
+            for row in range(first, first + count):
+                if row not in dead:
+                    deduper.add_original((segment, row), segment.index.signature(row))
+
+
+def resolve_original(key: Tuple) -> Tuple[str, str]:
+    """(file, chunk id) of a deduper key: either already that, or a (segment, row)."""
+    if isinstance(key[0], Segment):
+        record = key[0].index.record(key[1])
+        return record['source_path'], record['id']
+    return key
+
+
+def dependent_paths(duplicates: Dict[str, List], stale_paths: set) -> set:
+    """Files whose dropped duplicates point into stale_paths.
+    
+    duplicates maps a file to its [chunk id, original's file, original's id]
+    entries. Includes files that depend on stale_paths only through other
+    dependent files.
+    """
+    dependents = set()
+    changed = True
+    while changed:
+        changed = False
+        for path, entries in duplicates.items():
+            if path in stale_paths or path in dependents:
+                continue
+            if any(original in stale_paths or original in dependents for _, original, _ in entries):
+                dependents.add(path)
+                changed = True
+    return dependents
+
+
+def intersect_ranges(a: List[Tuple[int, int]], b: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Intersection of two sorted lists of disjoint [start, end) ranges."""
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if start < end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+class IndexSnapshot:
+    """One generation of the index, fully built before anyone can search it.
+    
+    Combines the segments of a manifest into a single searchable view:
+    vocabulary and IDF (from the manifest's df counters), TF-IDF CSR
+    arrays, BM25 postings, the optional IVF index and the filter row
+    ranges. With NumPy, the CSR arrays, postings, norms and BM25 score
+    bounds are memory-mapped from the view file the writer stored for this
+    generation (see update_view), so opening a snapshot doesn't grow with
+    the number of stored terms; only manifests without a usable view file
+    combine the segments in memory. Chunk records stay in the segments and
+    are decoded on demand. A snapshot is never modified after
+    construction, so any number of threads may search it while the next
+    one is being built.
+    """
+    
+    def __init__(self, manifest: Optional[Dict] = None, reuse: Iterable[Segment] = ()):
+        """Open manifest's segments (reusing open ones); no manifest gives an empty index."""
+        self.manifest: Dict = manifest or {}
+        self.generation = manifest['generation'] if manifest else None
+        self.file_hashes: Dict[str, str] = self.manifest.get('file_hashes', {})
         self.vocabulary: List[str] = []
+        self.term_index: Dict[str, int] = {}
         self.idf: Dict[str, float] = {}
-        self.documents: List[Dict] = []
-        self.file_hashes: Dict[str, str] = {}
-        self.loaded = False
+        self.segments: List[Segment] = []
+        # Chunk id -> ids of the near-duplicates dropped in its favour
+        self.duplicates: Dict[str, List[str]] = {}
+        # Search rows cover live chunks only, numbered consecutively across
+        # segments: segment s holds rows _row_bases[s]:_row_bases[s + 1],
+        # whose rows in the segment itself are _live_rows[s]
+        self._row_bases: List[int] = [0]
+        self._live_rows: List = []
+        # NumPy CSR arrays: per stored weight, its term id and (possibly
+        # quantised) value, plus per-row int8 scales and TF-IDF norms
+        self._indices = None
+        self._data = None
+        self._scales = None
+        self._norms = None
+        # Per stored weight, its term count; with the IDF values these
+        # re-score hits in float32
+        self._counts = None
+        self._idf_values = None
+        self._view: Optional[MappedIndex] = None  # the mapped view file, if any
+        # Search filters: filter name -> value -> sorted, merged row ranges
+        self._row_ranges: Dict[str, Dict[str, List[Tuple[int, int]]]] = {}
+        # CSR row pointers (a NumPy array when available) and pure-Python
+        # CSR lists (used when NumPy isn't installed)
+        self._doc_ptr: List[int] = [0]
+        self._terms: List[int] = []
+        self._weights: List[float] = []
+        self.bm25 = BM25Index()
+        self.ivf: Optional[IVFIndex] = None  # loaded for large indexes when NumPy is available
+        
+        if manifest:
+            self._open(manifest, {segment.name: segment for segment in reuse})
     
-    def load(self) -> bool:
-        """Load existing vector index."""
-        try:
-            if VECTOR_INDEX_FILE.exists():
-                with open(VECTOR_INDEX_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.vocabulary = data.get('vocabulary', [])
-                    self.idf = data.get('idf', {})
-                    self.documents = data.get('documents', [])
-                    self.file_hashes = data.get('file_hashes', {})
-                    self.loaded = True
-                    return True
-        except Exception as e:
-            print(f"⚠️  Error loading vector index: {e}")
-        return False
+    @property
+    def n_docs(self) -> int:
+        return self._row_bases[-1]
+    
+    def _locate(self, row: int) -> Tuple[int, int]:
+        """(segment position, row in the segment) of a search row."""
+        segment = bisect_right(self._row_bases, row) - 1
+        return segment, int(self._live_rows[segment][row - self._row_bases[segment]])
+    
+    def _open(self, manifest: Dict, open_segments: Dict[str, Segment]):
+        """Combine the manifest's segments into one searchable view."""
+        segments = [open_segments.get(entry['name']) or Segment(entry['name'])
+                    for entry in manifest['segments']]
+        deleted = [set(entry.get('deleted', [])) for entry in manifest['segments']]
+        
+        # Live rows of every segment, numbered consecutively for search
+        live_rows = []
+        for segment, dead in zip(segments, deleted):
+            if not dead:
+                live_rows.append(range(segment.n_docs))
+            elif NUMPY_AVAILABLE:
+                live_rows.append(np.flatnonzero(live_row_mask(segment.n_docs, dead)))
+            else:
+                live_rows.append([row for row in range(segment.n_docs) if row not in dead])
+        row_bases = [0, *itertools.accumulate(len(rows) for rows in live_rows)]
+        
+        # Vocabulary and IDF come straight from the persisted df counters
+        doc_freqs = manifest.get('doc_freqs')
+        if doc_freqs is None:
+            doc_freqs = manifest['doc_freqs'] = count_document_frequencies(segments, deleted)
+        vocabulary, idf = corpus_vocabulary(doc_freqs, row_bases[-1])
+        term_index = {word: term for term, word in enumerate(vocabulary)}
+        
+        if NUMPY_AVAILABLE:
+            view = self._map_view(manifest, row_bases[-1], len(vocabulary))
+            if view is None:
+                view = self._search_arrays(combine_segments(segments, deleted, vocabulary, idf))
+            view['ivf'] = load_ivf(manifest, segments, deleted, vocabulary, idf)
+        else:
+            view = self._combine_python(segments, deleted, vocabulary, term_index, idf)
+        view.update(vocabulary=vocabulary, term_index=term_index, idf=idf)
+        
+        row_ranges = {'category': {}, 'resource_id': {}, 'format': {}}
+        for start, end, attributes in file_row_ranges(segments, deleted):
+            for name, value in attributes.items():
+                ranges = row_ranges[name].setdefault(value, [])
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+        view['_row_ranges'] = row_ranges
+        
+        duplicates = {}
+        for entries in manifest.get('duplicates', {}).values():
+            for duplicate_id, _, original_id in entries:
+                duplicates.setdefault(original_id, []).append(duplicate_id)
+        view['duplicates'] = duplicates
+        
+        self.segments = segments
+        self._live_rows = live_rows
+        self._row_bases = row_bases
+        for name, value in view.items():
+            setattr(self, name, value)
     
-    def save(self) -> bool:
-        """Save vector index to file."""
+    def _map_view(self, manifest: Dict, n_docs: int, vocab_size: int) -> Optional[Dict]:
+        """Search arrays memory-mapped from the manifest's view file, or None
+        if it has none that matches the current settings."""
+        model = manifest.get('view')
+        if model is None or {key: model.get(key) for key in view_settings()} != view_settings():
+            return None
         try:
-            VECTORS_DIR.mkdir(parents=True, exist_ok=True)
+            index = MappedIndex(SEGMENTS_DIR / model['name'])
+        except (OSError, IndexFormatError) as e:
+            print(f"⚠️  Combining segments in memory, view file unreadable: {e}")
+            return None
+        if index.version < 3 or index.n_docs != n_docs or index.vocab_size != vocab_size:
+            index.close()
+            return None
+        arrays = {name: index.array(name) for name in ('idf', 'doc_ptr', 'terms', 'weights', 'scales', 'counts',
+                                                        'lengths', 'norms', 'post_ptr', 'bounds')}
+        # Postings are walked an item at a time, so they stay memoryviews
+        arrays.update(post_rows=index.view('post_rows'), post_tfs=index.view('post_tfs'))
+        view = self._search_arrays(arrays)
+        view['_view'] = index
+        return view
+    
+    @staticmethod
+    def _search_arrays(arrays: Dict) -> Dict:
+        """Snapshot attributes for the arrays of combine_segments() (or a mapped view file)."""
+        bm25 = BM25Index()
+        bm25.load(arrays['post_ptr'], memoryview(arrays['post_rows']), memoryview(arrays['post_tfs']),
+                  arrays['lengths'], arrays['bounds'])
+        return {
+            'bm25': bm25,
+            '_indices': arrays['terms'], '_data': arrays['weights'],
+            '_scales': arrays['scales'] if len(arrays['scales']) else None,
+            '_norms': arrays['norms'], '_counts': arrays['counts'], '_idf_values': arrays['idf'],
+            # Offsets are far below 2**63, so stored uint64 pointers read as int64
+            '_doc_ptr': arrays['doc_ptr'].view(np.int64),
+            '_terms': [], '_weights': [],
+        }
+    
+    def _combine_python(self, segments: List[Segment], deleted: List[set], vocabulary: List[str],
+                        term_index: Dict[str, int], idf: Dict[str, float]) -> Dict:
+        live_docs = []  # (token counts, length)
+        for segment, dead in zip(segments, deleted):
+            doc_ptr = segment.index.view('doc_ptr')
+            terms = segment.index.view('terms')
+            counts = segment.index.view('counts')
+            lengths = segment.index.view('lengths')
+            for row in range(segment.n_docs):
+                if row in dead:
+                    continue
+                start, end = doc_ptr[row], doc_ptr[row + 1]
+                token_counts = {segment.vocabulary[t]: c for t, c in zip(terms[start:end], counts[start:end])}
+                live_docs.append((token_counts, lengths[row]))
+        
+        documents = []
+        doc_ptr, all_terms, all_weights = [0], [], []
+        for token_counts, length in live_docs:
+            entries = sorted((term_index[word], count) for word, count in token_counts.items()
+                             if word in term_index)
+            terms = [term for term, _ in entries]
+            counts = [count for _, count in entries]
+            all_terms.extend(terms)
+            all_weights.extend(normalize_vector([count * idf[vocabulary[term]] for term, count in entries]))
+            doc_ptr.append(len(all_terms))
+            documents.append({'terms': terms, 'counts': counts, 'length': length})
+        
+        bm25 = BM25Index()
+        bm25.build(documents)
+        
+        return {
+            'bm25': bm25, 'ivf': None,
+            '_indices': None, '_data': None, '_scales': None,
+            '_norms': None, '_counts': None, '_idf_values': None,
+            '_doc_ptr': doc_ptr, '_terms': all_terms, '_weights': all_weights,
+        }
+    
+    def top_k(self, query_terms: List[int], query_weights: List[float], top_k: int, mode: str,
+              probes: int, ranges: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[int, float]]:
+        """(row, score) of the best top_k rows for one query vector."""
+        if ranges is not None and not ranges:
+            return []
+        if mode == 'bm25':
+            return self.bm25.search(query_terms, top_k, self._row_mask(ranges))
+        if mode == 'ann' and self.ivf is not None:
+            return self._top_k_ann(query_terms, query_weights, top_k, probes, self._row_mask(ranges))
+        if self._data is not None:
+            return self._top_k_numpy(query_terms, query_weights, top_k, ranges)
+        return self._top_k_python(query_terms, query_weights, top_k, ranges)
+    
+    def _top_k_numpy(self, query_terms: List[int], query_weights: List[float], top_k: int,
+                     ranges: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[int, float]]:
+        """Score all documents (or those in ranges) with one vectorised sparse dot product."""
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        query[query_terms] = query_weights
+        if ranges is not None:
+            return self._score_rows(query, np.concatenate([np.arange(start, end) for start, end in ranges]), top_k)
+        
+        # Multiply every stored weight by the query weight of its term,
+        # then sum the products per document row
+        products = self._data * query[self._indices]
+        scores = row_sums(products, self._doc_ptr)
+        if self._scales is not None:
+            scores *= self._scales
+        return self._rerank(query, self._candidates(scores, top_k), top_k)
+    
+    def _top_k_ann(self, query_terms: List[int], query_weights: List[float], top_k: int,
+                   probes: int, mask: Optional[bytearray] = None) -> List[Tuple[int, float]]:
+        """Score only the chunks filed in the IVF lists nearest the query."""
+        candidates = self.ivf.candidates(query_terms, query_weights, probes)
+        if mask is not None:
+            candidates = candidates[np.frombuffer(mask, dtype=bool)[candidates]]
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        query[query_terms] = query_weights
+        return self._score_rows(query, candidates, top_k)
+    
+    def _score_rows(self, query, rows, top_k: int) -> List[Tuple[int, float]]:
+        """Score only the given (ascending) rows."""
+        positions, owners = csr_positions(self._doc_ptr, rows)
+        if not len(positions):
+            return []  # bincount of nothing would give integer scores
+        products = self._data[positions] * query[self._indices[positions]]
+        scores = np.bincount(owners, weights=products, minlength=len(rows))
+        if self._scales is not None:
+            scores *= self._scales[rows]
+        hits = [(int(rows[i]), score) for i, score in self._candidates(scores, top_k)]
+        return self._rerank(query, hits, top_k)
+    
+    def top_k_batch(self, vectors: List[Tuple[List[int], List[float]]], top_k: int,
+                    ranges: Optional[List[Tuple[int, int]]] = None) -> List[List[Tuple[int, float]]]:
+        """Score many query vectors against the index in one pass.
+        
+        The queries form a sparse (term x query) matrix over the union of
+        their terms, so the batch is one sparse matrix product: the stored
+        weights of those terms are gathered once, each is paired with the
+        queries containing its term, and a single bincount sums the products
+        per (document, query).
+        """
+        union = sorted({term for terms, _ in vectors for term in terms})
+        column = np.full(len(self.vocabulary), -1, dtype=np.int32)
+        column[union] = np.arange(len(union))
+        
+        # Query matrix, term-major: union term u is in query_ids[query_ptr[u]:query_ptr[u + 1]]
+        entries = sorted((int(column[term]), j, weight) for j, (terms, weights) in enumerate(vectors)
+                         for term, weight in zip(terms, weights))
+        query_ptr = np.searchsorted([u for u, _, _ in entries], np.arange(len(union) + 1))
+        query_ids = np.array([j for _, j, _ in entries], dtype=np.int64)
+        query_weights = np.array([weight for _, _, weight in entries], dtype=np.float32)
+        
+        if ranges is None:
+            positions = np.flatnonzero(column[self._indices] >= 0)
+        else:
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            positions, _ = csr_positions(self._doc_ptr, rows)
+            positions = positions[column[self._indices[positions]] >= 0]
+        rows = np.searchsorted(self._doc_ptr, positions, side='right') - 1
+        # Positions are ascending, so touched rows get ascending local numbers
+        first = np.diff(rows, prepend=-1) > 0
+        touched = rows[first]
+        local_rows = np.cumsum(first) - 1
+        if not len(touched):
+            return [[] for _ in vectors]
+        
+        pairs, owners = csr_positions(query_ptr, column[self._indices[positions]])
+        products = self._data[positions[owners]] * query_weights[pairs]
+        keys = local_rows[owners] * len(vectors) + query_ids[pairs]
+        scores = np.bincount(keys, weights=products, minlength=len(touched) * len(vectors))
+        scores = scores.reshape(len(touched), len(vectors))
+        if self._scales is not None:
+            scores *= self._scales[touched, None]
+        
+        batch_hits = []
+        for j, (terms, weights) in enumerate(vectors):
+            hits = [(int(touched[i]), score)
+                    for i, score in self._candidates(scores[:, j], top_k)]
+            query = np.zeros(len(self.vocabulary), dtype=np.float32)
+            query[terms] = weights
+            batch_hits.append(self._rerank(query, hits, top_k))
+        return batch_hits
+    
+    def _candidates(self, scores, top_k: int) -> List[Tuple[int, float]]:
+        """Hits for _rerank() from (possibly quantised) scores.
+        
+        Quantised scores are only estimates, so top_k * RERANK_FACTOR of
+        them are taken and SCORE_THRESHOLD is left to the exact scores.
+        """
+        if self._data.dtype == np.float32 or not RERANK_FACTOR:
+            return top_k_scores(scores, top_k)
+        return top_k_scores(scores, top_k * RERANK_FACTOR, threshold=0.0)
+    
+    def _rerank(self, query, hits: List[Tuple[int, float]], top_k: int) -> List[Tuple[int, float]]:
+        """Re-score quantised hits with float32 weights rebuilt from term counts.
+        
+        Only the counts of these few rows are read, so a mapped view file
+        pages in just those.
+        """
+        if self._data.dtype == np.float32 or not RERANK_FACTOR:
+            return hits[:top_k]
+        
+        rescored = []
+        for row, _ in hits:
+            start, end = self._doc_ptr[row], self._doc_ptr[row + 1]
+            terms = self._indices[start:end]
+            weights = self._counts[start:end] * self._idf_values[terms]
+            rescored.append((row, float(query[terms] @ weights) / float(self._norms[row])))
+        
+        rescored.sort(key=lambda hit: hit[1], reverse=True)
+        return [(row, score) for row, score in rescored[:top_k] if score > SCORE_THRESHOLD]
+    
+    def _top_k_python(self, query_terms: List[int], query_weights: List[float], top_k: int,
+                      ranges: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[int, float]]:
+        """Pure-Python fallback when NumPy isn't installed."""
+        query = dict(zip(query_terms, query_weights))
+        doc_ptr, terms, weights = self._doc_ptr, self._terms, self._weights
+        
+        def score(row):
+            start, end = doc_ptr[row], doc_ptr[row + 1]
+            return sparse_dot(query, terms[start:end], weights[start:end])
+        
+        if ranges is None:
+            rows = range(len(doc_ptr) - 1)
+        else:
+            rows = itertools.chain.from_iterable(range(start, end) for start, end in ranges)
+        best = heapq.nlargest(top_k, ((score(row), row) for row in rows))
+        return [(row, similarity) for similarity, row in best if similarity > SCORE_THRESHOLD]
+    
+    def filter_ranges(self, category: Optional[str], resource_id: Optional[str],
+                      file_format: Optional[str]) -> Optional[List[Tuple[int, int]]]:
+        """Row ranges matching every given filter, or None when unfiltered."""
+        ranges = None
+        for name, value in (('category', category), ('resource_id', resource_id), ('format', file_format)):
+            if value is None:
+                continue
+            matching = self._row_ranges.get(name, {}).get(str(value), [])
+            ranges = matching if ranges is None else intersect_ranges(ranges, matching)
+        return ranges
+    
+    def _row_mask(self, ranges: Optional[List[Tuple[int, int]]]) -> Optional[bytearray]:
+        """One byte per search row, 1 inside the ranges (None when unfiltered)."""
+        if ranges is None:
+            return None
+        mask = bytearray(self.n_docs)
+        for start, end in ranges:
+            mask[start:end] = b'\x01' * (end - start)
+        return mask
+    
+    def results(self, hits: List[Tuple[int, float]]) -> List[Dict]:
+        """Result dicts for (row, score) hits."""
+        results = []
+        for row, similarity in hits:
+            # Chunk text is read from the segment for the top k only
+            segment, segment_row = self._locate(row)
+            doc = self.segments[segment].index.record(segment_row)
+            results.append({
+                'id': doc['id'],
+                'title': doc['title'],
+                'category': doc['category'],
+                'content': doc['content'],
+                'score': round(similarity, 4),
+                'duplicates': list(self.duplicates.get(doc['id'], ()))
+            })
+        return results
+    
+    def vector_bytes(self) -> int:
+        """Size of the TF-IDF search arrays (NumPy path only; mapped from the
+        view file rather than resident when there is one)."""
+        arrays = (self._indices, self._data, self._scales, self._norms, self._doc_ptr)
+        return sum(array.nbytes for array in arrays if hasattr(array, 'nbytes'))
+    
+    def resource_rows(self) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """Resource ids and (row, resource index) pairs of their chunks.
+        
+        A resource also owns the kept originals of its dropped near-duplicate
+        chunks, so e.g. a new edition stays linked to the old one.
+        """
+        ranges_by_resource = self._row_ranges.get('resource_id', {})
+        originals = defaultdict(set)  # resource id -> ids of its chunks with duplicates
+        for original_id in self.duplicates:
+            originals[original_id.rsplit('_', 1)[0]].add(original_id)
+        
+        duplicate_rows = []  # (row, resource id of a duplicate)
+        for resource_id, ids in originals.items():
+            for start, end in ranges_by_resource.get(resource_id, ()):
+                for row in range(start, end):
+                    segment, segment_row = self._locate(row)
+                    chunk_id = self.segments[segment].index.record(segment_row)['id']
+                    if chunk_id in ids:
+                        duplicate_rows.extend((row, duplicate_id.rsplit('_', 1)[0])
+                                              for duplicate_id in self.duplicates[chunk_id])
+        
+        resource_ids = sorted(set(ranges_by_resource) | {resource_id for _, resource_id in duplicate_rows})
+        ordinal = {resource_id: r for r, resource_id in enumerate(resource_ids)}
+        pairs = [(row, ordinal[resource_id]) for resource_id, ranges in ranges_by_resource.items()
+                 for start, end in ranges for row in range(start, end)]
+        pairs.extend((row, ordinal[resource_id]) for row, resource_id in duplicate_rows)
+        return resource_ids, pairs
+    
+    def resource_vectors(self, max_terms: int = RELATED_TERMS) -> Dict[str, Dict[int, float]]:
+        """Per resource, the unit-length sum of its chunks' TF-IDF vectors,
+        pruned to its max_terms heaviest terms (pure-Python path)."""
+        resource_ids, pairs = self.resource_rows()
+        sums = [defaultdict(float) for _ in resource_ids]
+        for row, r in pairs:
+            vector = sums[r]
+            for position in range(self._doc_ptr[row], self._doc_ptr[row + 1]):
+                vector[self._terms[position]] += self._weights[position]
+        
+        vectors = {}
+        for resource_id, vector in zip(resource_ids, sums):
+            top = heapq.nlargest(max_terms, vector.items(), key=lambda item: item[1])
+            norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1.0
+            vectors[resource_id] = {term: weight / norm for term, weight in top}
+        return vectors
+    
+    def resource_arrays(self, max_terms: int = RELATED_TERMS):
+        """Resource ids and their vectors, as in resource_vectors(), stored
+        sparse: resource r's term ids are terms[ptr[r]:ptr[r + 1]] (ascending)
+        with matching weights. NumPy only.
+        
+        Chunk weights are summed for a group of resources at a time, at most
+        RELATED_BLOCK_ENTRIES weights per group unless one resource has more.
+        """
+        resource_ids, pairs = self.resource_rows()
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[np.argsort(pairs[:, 1], kind='stable')]
+        pair_ptr = np.searchsorted(pairs[:, 1], np.arange(len(resource_ids) + 1))
+        entries = np.bincount(pairs[:, 1], weights=self._doc_ptr[pairs[:, 0] + 1] - self._doc_ptr[pairs[:, 0]],
+                              minlength=len(resource_ids))
+        vocab_size = max(len(self.vocabulary), 1)
+        
+        owners, terms, sums = [], [], []
+        for first, last in entry_blocks(entries, RELATED_BLOCK_ENTRIES, len(resource_ids)):
+            block = pairs[pair_ptr[first]:pair_ptr[last]]
+            positions, which = csr_positions(self._doc_ptr, block[:, 0])
+            weights = self._data[positions].astype(np.float32)
+            if self._scales is not None:
+                weights *= self._scales[block[which, 0]]
             
-            data = {
-                'version': '2.0',
-                'timestamp': str(Path(__file__).stat().st_mtime),
-                'vocabulary': self.vocabulary,
-                'idf': self.idf,
-                'documents': self.documents,
-                'file_hashes': self.file_hashes,
-                'stats': {
-                    'total_documents': len(self.documents),
-                    'vocabulary_size': len(self.vocabulary),
-                    'total_files': len(self.file_hashes)
-                }
-            }
+            # Sum each resource's weights per term
+            keys, inverse = np.unique(block[which, 1] * vocab_size + self._indices[positions], return_inverse=True)
+            block_sums = np.bincount(inverse, weights=weights).astype(np.float32)
+            block_owners, block_terms = keys // vocab_size, keys % vocab_size
             
-            with open(VECTOR_INDEX_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
+            # Keep each resource's heaviest terms, ascending by term id
+            order = np.lexsort((-block_sums, block_owners))
+            ranks = np.arange(len(order)) - np.searchsorted(block_owners[order], block_owners[order])
+            top = np.sort(order[ranks < max_terms])
+            owners.append(block_owners[top])
+            terms.append(block_terms[top])
+            sums.append(block_sums[top])
+        
+        owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+        terms = np.concatenate(terms) if terms else np.zeros(0, dtype=np.int64)
+        sums = np.concatenate(sums) if sums else np.zeros(0, dtype=np.float32)
+        norms = np.sqrt(np.bincount(owners, weights=sums * sums, minlength=len(resource_ids)))
+        norms[norms == 0] = 1.0
+        ptr = np.concatenate(([0], np.cumsum(np.bincount(owners, minlength=len(resource_ids)))))
+        return resource_ids, ptr, terms, (sums / norms[owners]).astype(np.float32)
+    
+    def related_resources(self, top_n: int = RELATED_TOP_N) -> Dict[str, List[Tuple[str, float]]]:
+        """Each resource's top_n most similar resources, best first.
+        
+        Similarity is the cosine of the resources' vectors. With NumPy the
+        sparse vectors are multiplied through a term-major copy of
+        themselves, a block of resources at a time: each block's products
+        are only formed for terms it shares with another resource and are
+        summed into a dense (block x resources) array of scores. Blocks
+        stop at RELATED_BLOCK_ROWS resources, RELATED_BLOCK_SCORES scores
+        and RELATED_BLOCK_ENTRIES products (a resource whose own products
+        exceed that is a block by itself), so memory is bounded by those
+        plus the resource vectors.
+        """
+        if NUMPY_AVAILABLE and self._data is not None:
+            resource_ids, ptr, terms, weights = self.resource_arrays()
+            n = len(resource_ids)
+            owners = np.repeat(np.arange(n), np.diff(ptr))
+            
+            # Term-major: term t's resources are term_owners[term_ptr[t]:term_ptr[t + 1]]
+            order = np.argsort(terms, kind='stable')
+            term_ptr = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(self.vocabulary)))))
+            term_owners, term_weights = owners[order], weights[order]
+            del order
             
+            df = np.diff(term_ptr)
+            products = np.bincount(owners, weights=df[terms], minlength=n)
+            max_rows = max(1, min(RELATED_BLOCK_ROWS, RELATED_BLOCK_SCORES // max(n, 1)))
+            related = {}
+            for first, last in entry_blocks(products, RELATED_BLOCK_ENTRIES, n, max_rows):
+                positions = np.arange(ptr[first], ptr[last])
+                pairs, which = csr_positions(term_ptr, terms[positions])
+                keys = (owners[positions[which]] - first) * n + term_owners[pairs]
+                scores = np.bincount(keys, weights=weights[positions[which]] * term_weights[pairs],
+                                     minlength=(last - first) * n).reshape(last - first, n)
+                for i, row in enumerate(scores):
+                    row[first + i] = 0.0  # not related to itself
+                    related[resource_ids[first + i]] = [
+                        (resource_ids[j], round(score, 4)) for j, score in top_k_scores(row, top_n)
+                    ]
+            return related
+        
+        vectors = self.resource_vectors()
+        postings = defaultdict(list)
+        for resource_id, vector in vectors.items():
+            for term, weight in vector.items():
+                postings[term].append((resource_id, weight))
+        
+        related = {}
+        for resource_id, vector in vectors.items():
+            scores = defaultdict(float)
+            for term, weight in vector.items():
+                for other, other_weight in postings[term]:
+                    scores[other] += weight * other_weight
+            scores.pop(resource_id, None)
+            best = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+            related[resource_id] = [(other, round(score, 4)) for other, score in best if score > SCORE_THRESHOLD]
+        return related
+    
+    def get_stats(self) -> Dict:
+        """Index statistics."""
+        return {
+            'total_documents': self.n_docs,
+            'vocabulary_size': len(self.vocabulary),
+            'total_files': len(self.file_hashes),
+            'segments': len(self.segments),
+            'mapped_view': self._view is not None,
+            'ann_lists': len(self.ivf.centroids) if self.ivf is not None else 0,
+            'vector_dtype': str(self._data.dtype) if self._data is not None else 'float64',
+            'vector_bytes': self.vector_bytes(),
+            'duplicate_chunks': sum(len(ids) for ids in self.duplicates.values()),
+            'deleted_documents': sum(len(e['deleted']) for e in self.manifest.get('segments', []))
+        }
+
+
+class VectorStore:
+    """Manages vector embeddings for documents.
+    
+    The index is a list of immutable segments (see Segment) plus a manifest
+    recording which segments are live, which of their rows are deleted and
+    the file hashes. Indexing a changed PDF writes one small segment and
+    tombstones the file's old rows; merge_segments() later compacts them.
+    
+    Readers pick up a new manifest generation with load(), which builds an
+    IndexSnapshot off to the side and publishes it by swapping one
+    reference. A search reads self.snapshot once, so it never blocks on a
+    rebuild or sees a half-built index.
+    """
+    
+    def __init__(self):
+        self.snapshot = IndexSnapshot()
+        self.query_cache = QueryCache()
+        self._load_lock = threading.Lock()  # one load at a time
+    
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot.generation is not None
+    
+    def load(self, wait: bool = True) -> bool:
+        """Publish a snapshot of the current manifest generation.
+        
+        Cheap when nothing changed; segments that are already open are
+        reused. Loads are serialised: with wait=False this returns False at
+        once if another thread is loading. Segments the new snapshot drops
+        are closed when the last search using the old snapshot lets go.
+        """
+        if not self._load_lock.acquire(blocking=wait):
+            return False
+        try:
+            if not VECTOR_MANIFEST_FILE.exists() and not import_legacy_index():
+                return False
+            manifest = load_manifest()
+            if manifest['generation'] != self.snapshot.generation:
+                self.snapshot = IndexSnapshot(manifest, self.snapshot.segments)
+                self.query_cache.clear()
             return True
         except Exception as e:
-            print(f"❌ Error saving vector index: {e}")
+            print(f"⚠️  Error loading vector index: {e}")
             return False
+        finally:
+            self._load_lock.release()
     
     def needs_update(self, pdf_path: Path) -> bool:
         """Check if a PDF needs to be re-indexed."""
         current_hash = get_file_hash(pdf_path)
-        stored_hash = self.file_hashes.get(str(pdf_path), '')
+        stored_hash = self.snapshot.file_hashes.get(str(pdf_path), '')
         return current_hash != stored_hash
     
-    def build_index(self, force_rebuild: bool = False) -> int:
-        """Build or update the vector index from PDFs."""
+    def build_index(self, force_rebuild: bool = False, workers: int = EXTRACT_WORKERS) -> int:
+        """Index new or changed PDFs into new segments.
+        
+        PDFs are extracted page by page across `workers` processes and their
+        chunks streamed into segments of at most SEGMENT_FLUSH_CHUNKS, so
+        memory stays flat however many or large the PDFs are. Old chunks of
+        changed or removed PDFs are tombstoned; other segments are left
+        untouched. Returns the number of chunks added.
+        
+        Chunks that nearly duplicate one already in the index or indexed
+        earlier in the same build (repeated headers, boilerplate, sections
+        shared between editions, re-uploaded PDFs) are dropped; the
+        manifest keeps a back-reference from each to the chunk that was
+        kept. Existing chunks are matched by the MinHash signatures stored
+        in their segments.
+        """
         if not PYMUPDF_AVAILABLE:
             print("❌ PyMuPDF is required. Install with: pip install pymupdf")
             return 0
@@ -255,13 +1833,15 @@ class VectorStore:
         
         print(f"📚 Found {len(pdf_resources)} PDF(s) to process")
         
-        # Load existing index if not forcing rebuild
-        if not force_rebuild:
+        if force_rebuild:
+            manifest = load_manifest()
+            manifest.update(segments=[], file_hashes={}, doc_freqs={}, duplicates={})
+        else:
             self.load()
+            manifest = load_manifest()
         
-        # Collect all text for IDF calculation
-        all_documents_tokens = []
-        documents_to_process = []
+        jobs = []
+        unchanged = {}  # path -> resource of files already indexed
         
         for resource in pdf_resources:
             pdf_path = PROJECT_DIR / resource['filepath']
@@ -272,145 +1852,353 @@ class VectorStore:
             
             # Check if needs update
             if not force_rebuild and not self.needs_update(pdf_path):
-                print(f"  ✅ Already indexed: {resource['title']}")
-                # Keep existing documents for this file
+                unchanged[str(pdf_path)] = resource
                 continue
             
-            print(f"  📖 Processing: {resource['title']}...")
-            
-            # Extract and clean text
-            text = extract_pdf_text(pdf_path)
-            if len(text) < 100:
-                print(f"      ⚠️  Too little text extracted")
-                continue
-            
-            text = clean_text(text)
-            chunks = chunk_text(text)
-            
-            print(f"      📝 Created {len(chunks)} chunks")
-            
-            documents_to_process.append({
-                'resource': resource,
-                'pdf_path': pdf_path,
-                'chunks': chunks
-            })
-            
-            # Collect tokens for vocabulary
-            for chunk in chunks:
-                tokens = tokenize(chunk)
-                all_documents_tokens.append(tokens)
+            jobs.append((resource, pdf_path))
+        pdf_paths = set(unchanged) | {str(pdf_path) for _, pdf_path in jobs}
         
-        if not documents_to_process and not self.documents:
+        # Files that changed or disappeared lose their old chunks
+        removed_paths = {path for path in manifest['file_hashes'] if path not in pdf_paths}
+        for path in removed_paths:
+            print(f"  🗑️  Removing: {Path(path).name}")
+            del manifest['file_hashes'][path]
+        
+        # A file whose duplicates point at chunks about to be deleted is
+        # re-indexed too, so no back-reference outlives its original
+        stale_paths = {str(pdf_path) for _, pdf_path in jobs} | removed_paths
+        for path in dependent_paths(manifest.get('duplicates', {}), stale_paths):
+            if path in unchanged:
+                jobs.append((unchanged.pop(path), Path(path)))
+        for resource in unchanged.values():
+            print(f"  ✅ Already indexed: {resource['title']}")
+        
+        if not jobs and not removed_paths and not force_rebuild:
             print("📭 No documents to process.")
+            if self.loaded and not RELATED_FILE.exists():
+                self._update_related()
             return 0
         
-        # Include existing document tokens if doing incremental update
-        if not force_rebuild and self.documents:
-            for doc in self.documents:
-                all_documents_tokens.append(doc.get('tokens', []))
+        deduper = MinHashDeduper()
+        duplicates = manifest.setdefault('duplicates', {})
         
-        # Build vocabulary from most common words
-        all_tokens = [token for doc_tokens in all_documents_tokens for token in doc_tokens]
-        token_counts = Counter(all_tokens)
-        self.vocabulary = [word for word, _ in token_counts.most_common(VECTOR_DIMENSIONS)]
-        vocabulary_set = set(self.vocabulary)
+        def extracted_chunks():
+            """Chunks of every job, streamed as extraction workers finish files.
+            
+            Consumed by commit_changes only after it has dropped the stale
+            files' old back-references, so new ones can be added here.
+            """
+            for resource, pdf_path, chunks in extract_files(jobs, workers):
+                print(f"  📖 Processed: {resource['title']}...")
+                # Recorded even without chunks, so scanned PDFs aren't re-extracted every build
+                manifest['file_hashes'][str(pdf_path)] = get_file_hash(pdf_path)
+                if not chunks:
+                    print(f"      ⚠️  Too little text extracted")
+                    continue
+                kept = []
+                for chunk in chunks:
+                    signature = deduper.signature(chunk['content'])
+                    original = deduper.add_signature((chunk['source_path'], chunk['id']), signature)
+                    if original is None:
+                        chunk['signature'] = signature
+                        kept.append(chunk)
+                    else:
+                        duplicates.setdefault(str(pdf_path), []).append([chunk['id'], *resolve_original(original)])
+                dropped = len(chunks) - len(kept)
+                print(f"      📝 Created {len(kept)} chunks" + (f" ({dropped} near-duplicates dropped)" if dropped else ""))
+                yield from kept
         
-        print(f"\n📊 Vocabulary size: {len(self.vocabulary)} words")
+        stale_paths = {str(pdf_path) for _, pdf_path in jobs} | removed_paths
+        segments = {segment.name: segment for segment in self.snapshot.segments}
+        remember_indexed_chunks(deduper, [(segments[entry['name']], entry) for entry in manifest['segments']],
+                                stale_paths)
+        added_count, deleted_count = self.commit_changes(manifest, extracted_chunks(), stale_paths)
+        prune_page_cache(Path(path) for path in pdf_paths)
         
-        # Compute IDF
-        self.idf = compute_idf(all_documents_tokens, vocabulary_set)
+        dedupe_stats = deduper.get_stats()
+        if dedupe_stats['duplicates']:
+            print(f"\n🧹 Dropped {dedupe_stats['duplicates']} near-duplicate chunks "
+                  f"({dedupe_stats['ratio']:.1%} of {dedupe_stats['chunks']} extracted)")
         
-        # Remove old documents for files being reprocessed
-        if not force_rebuild:
-            paths_to_remove = {str(d['pdf_path']) for d in documents_to_process}
-            self.documents = [d for d in self.documents if d.get('source_path') not in paths_to_remove]
-        else:
-            self.documents = []
-        
-        # Create vectors for new chunks
-        new_doc_count = 0
-        for doc_info in documents_to_process:
-            resource = doc_info['resource']
-            pdf_path = doc_info['pdf_path']
-            chunks = doc_info['chunks']
-            
-            for i, chunk in enumerate(chunks):
-                tokens = tokenize(chunk)
-                vector = create_tfidf_vector(tokens, self.idf, self.vocabulary)
-                vector = normalize_vector(vector)
-                
-                self.documents.append({
-                    'id': f"{resource['id']}_{i}",
-                    'title': resource['title'],
-                    'category': resource['category'],
-                    'source_path': str(pdf_path),
-                    'chunk_index': i,
-                    'content': chunk[:1000],  # Store first 1000 chars
-                    'tokens': tokens[:50],  # Store top tokens for reference
-                    'vector': vector
-                })
-                new_doc_count += 1
-            
-            # Update file hash
-            self.file_hashes[str(pdf_path)] = get_file_hash(pdf_path)
+        snapshot = self.snapshot
+        print(f"\n📊 Vocabulary size: {len(snapshot.vocabulary)} words")
+        print(f"\n✅ Indexed {added_count} new chunks, deleted {deleted_count}")
+        print(f"📦 Total chunks in index: {snapshot.n_docs} in {len(snapshot.segments)} segment(s)")
+        
+        if added_count or deleted_count or not RELATED_FILE.exists():
+            self._update_related()
+        
+        return added_count
+    
+    def commit_changes(self, manifest: Dict, new_chunks: Iterable[Dict], stale_paths: set) -> Tuple[int, int]:
+        """Publish a new index generation and reload it.
+        
+        Tombstones the existing chunks of stale_paths (and drops their
+        duplicate back-references), then writes new_chunks
+        (any iterable, consumed lazily) as segments of at most
+        SEGMENT_FLUSH_CHUNKS. The persisted document frequencies are adjusted
+        by exactly the chunks added and removed, so IDF never needs a corpus
+        rescan. manifest must describe the segments currently loaded.
+        Returns (chunks added, chunks deleted).
+        """
+        doc_freqs = manifest.get('doc_freqs')
+        if doc_freqs is None:
+            doc_freqs = self.snapshot.manifest.get('doc_freqs', {})  # counted when loaded
+        doc_freqs = Counter(doc_freqs)
+        deleted_count = 0
+        
+        segments = {segment.name: segment for segment in self.snapshot.segments}
+        for entry in manifest['segments']:
+            segment = segments[entry['name']]
+            dead = set(entry['deleted'])
+            for path in stale_paths:
+                for row in segment.rows_for(path):
+                    if row not in dead:
+                        dead.add(row)
+                        doc_freqs.subtract(segment.words(row))
+                        deleted_count += 1
+            entry['deleted'] = sorted(dead)
+        for path in stale_paths:
+            manifest.get('duplicates', {}).pop(path, None)
         
-        # Save index
-        self.save()
+        added_count = 0
+        new_chunks = iter(new_chunks)
+        while True:
+            batch = list(itertools.islice(new_chunks, SEGMENT_FLUSH_CHUNKS))
+            if not batch:
+                break
+            doc_freqs.update(word for chunk in batch for word in chunk['token_counts'])
+            manifest['segments'].append(write_segment(manifest, batch))
+            added_count += len(batch)
         
-        print(f"\n✅ Indexed {new_doc_count} new chunks")
-        print(f"📦 Total chunks in index: {len(self.documents)}")
+        manifest['doc_freqs'] = {word: count for word, count in doc_freqs.items() if count > 0}
+        manifest['total_docs'] = sum(entry['docs'] - len(entry['deleted']) for entry in manifest['segments'])
+        update_ivf(manifest, segments)
+        update_view(manifest, segments)
+        save_manifest(manifest)
+        remove_unreferenced_segments(manifest)
+        self.load()
+        return added_count, deleted_count
+    
+    def _merge_candidates(self) -> List[int]:
+        """Positions of the segments the merge policy wants compacted."""
+        entries = self.snapshot.manifest.get('segments', [])
+        # Segments with many deleted rows are always rewritten
+        chosen = {i for i, entry in enumerate(entries)
+                  if entry['docs'] and len(entry['deleted']) / entry['docs'] > MAX_DELETED_RATIO}
+        # Too many segments: fold the smallest ones together
+        excess = len(entries) - len(chosen) - MAX_SEGMENTS
+        if excess > 0:
+            by_size = sorted((i for i in range(len(entries)) if i not in chosen),
+                             key=lambda i: entries[i]['docs'] - len(entries[i]['deleted']))
+            chosen.update(by_size[:excess + 1])
+        if len(chosen) == 1 and not entries[min(chosen)]['deleted']:
+            return []
+        return sorted(chosen)
+    
+    def needs_merge(self) -> bool:
+        """Whether merge_segments() has work to do."""
+        return bool(self._merge_candidates())
+    
+    def merge_segments(self) -> int:
+        """Rewrite small or mostly-deleted segments into one, dropping deleted rows.
+        
+        Must not run concurrently with build_index (the server runs both on
+        the same job key). Returns the number of segments merged.
+        """
+        if not self.load():
+            return 0
+        candidates = self._merge_candidates()
+        if not candidates:
+            return 0
+        segments = self.snapshot.segments
         
-        return new_doc_count
+        manifest = load_manifest()
+        entries = [manifest['segments'][i] for i in candidates]
+        chunks = []
+        for entry, i in zip(entries, candidates):
+            segment = segments[i]
+            dead = set(entry['deleted'])
+            chunks.extend(segment.chunk(row) for row in range(segment.n_docs) if row not in dead)
+        # Segments written before signatures were stored get them now
+        deduper = MinHashDeduper()
+        for chunk in chunks:
+            if 'signature' not in chunk:
+                chunk['signature'] = deduper.signature(chunk.get('content', ''))
+        
+        kept = [entry for i, entry in enumerate(manifest['segments']) if i not in candidates]
+        manifest['segments'] = kept + ([write_segment(manifest, chunks)] if chunks else [])
+        manifest['total_docs'] = sum(entry['docs'] - len(entry['deleted']) for entry in manifest['segments'])
+        open_segments = {segment.name: segment for segment in segments}
+        update_ivf(manifest, open_segments)
+        update_view(manifest, open_segments)
+        save_manifest(manifest)
+        remove_unreferenced_segments(manifest)
+        self.load()
+        
+        print(f"🧩 Merged {len(entries)} segment(s) into one with {len(chunks)} chunks")
+        return len(entries)
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Search for similar documents using vector similarity."""
-        if not self.vocabulary or not self.documents:
-            if not self.load():
-                return []
+    def _current_snapshot(self) -> Optional[IndexSnapshot]:
+        """The published snapshot, loading one first if there is none yet.
         
-        # Create query vector
+        Returns None rather than waiting while another thread (e.g. the
+        startup warmup) is loading.
+        """
+        if not self.loaded and not self.load(wait=False):
+            return None
+        return self.snapshot
+    
+    def search(self, query: str, top_k: int = 5, mode: str = 'tfidf',
+               probes: int = ANN_PROBES, category: Optional[str] = None,
+               resource_id: Optional[str] = None, file_format: Optional[str] = None) -> List[Dict]:
+        """Search for similar documents.
+        
+        mode 'tfidf' ranks by cosine similarity of TF-IDF vectors; mode
+        'bm25' ranks with the inverted index, touching only postings of
+        the query's terms; mode 'ann' ranks like 'tfidf' but only scores the
+        chunks in the query's `probes` nearest IVF lists (exact search when
+        the index is too small to have them).
+        
+        category, resource_id and file_format restrict the search to the
+        row ranges of matching files before anything is scored.
+        """
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return []
+        
+        filters = (category, resource_id, file_format)
         query_tokens = tokenize(query)
-        query_vector = create_tfidf_vector(query_tokens, self.idf, self.vocabulary)
-        query_vector = normalize_vector(query_vector)
+        cache_key = self._cache_key(snapshot, query_tokens, top_k, mode, probes, filters)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            return [dict(result) for result in cached]
         
-        # Calculate similarities
-        results = []
-        for doc in self.documents:
-            similarity = cosine_similarity(query_vector, doc.get('vector', []))
-            if similarity > 0.05:  # Threshold
-                results.append({
-                    'id': doc['id'],
-                    'title': doc['title'],
-                    'category': doc['category'],
-                    'content': doc['content'],
-                    'score': round(similarity, 4)
-                })
-        
-        # Sort by similarity
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results[:top_k]
+        # Create query vector
+        query_terms, query_weights = create_tfidf_vector(query_tokens, snapshot.idf, snapshot.term_index)
+        
+        if not query_terms:
+            return []
+        
+        hits = snapshot.top_k(query_terms, query_weights, top_k, mode, probes, snapshot.filter_ranges(*filters))
+        results = snapshot.results(hits)
+        self.query_cache.put(cache_key, results)
+        return [dict(result) for result in results]
+    
+    def search_many(self, queries: List[str], top_k: int = 5, mode: str = 'tfidf',
+                    probes: int = ANN_PROBES, category: Optional[str] = None,
+                    resource_id: Optional[str] = None, file_format: Optional[str] = None) -> List[List[Dict]]:
+        """Search several queries, returning one result list per query.
+        
+        In mode 'tfidf' (with NumPy) the queries missing from the cache are
+        scored together in a single pass over the index; other modes search
+        each query in turn. Filters apply to every query.
+        """
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return [[] for _ in queries]
+        
+        filters = (category, resource_id, file_format)
+        if mode != 'tfidf' or snapshot._data is None:
+            return [self.search(query, top_k, mode, probes, *filters) for query in queries]
+        
+        ranges = snapshot.filter_ranges(*filters)
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        pending = []  # (position, cache key, query terms, query weights)
+        for i, query in enumerate(queries):
+            query_tokens = tokenize(query)
+            cache_key = self._cache_key(snapshot, query_tokens, top_k, mode, probes, filters)
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                results[i] = [dict(result) for result in cached]
+                continue
+            query_terms, query_weights = create_tfidf_vector(query_tokens, snapshot.idf, snapshot.term_index)
+            if not query_terms:
+                results[i] = []
+                continue
+            pending.append((i, cache_key, query_terms, query_weights))
+        
+        if pending:
+            if ranges is not None and not ranges:
+                batch_hits = [[] for _ in pending]
+            else:
+                vectors = [(terms, weights) for _, _, terms, weights in pending]
+                batch_hits = snapshot.top_k_batch(vectors, top_k, ranges)
+            for (i, cache_key, _, _), hits in zip(pending, batch_hits):
+                found = snapshot.results(hits)
+                self.query_cache.put(cache_key, found)
+                results[i] = [dict(result) for result in found]
+        return results
+    
+    def _cache_key(self, snapshot: IndexSnapshot, query_tokens: List[str], top_k: int, mode: str,
+                   probes: int, filters: Tuple) -> Tuple:
+        """Queries with the same words share a cache entry, whatever their
+        case, punctuation, stopwords or word order."""
+        return (tuple(sorted(query_tokens)), top_k, mode,
+                probes if mode == 'ann' else None, filters, snapshot.generation)
+    
+    def build_related(self, top_n: int = RELATED_TOP_N) -> int:
+        """Write the related-resources graph of the loaded index.
+        
+        Run offline after the index changes; the server only looks resources
+        up in the file. Returns the number of resources in the graph.
+        """
+        snapshot = self.snapshot
+        related = snapshot.related_resources(top_n)
+        save_related(related, snapshot.generation)
+        return len(related)
+    
+    def _update_related(self):
+        """build_related() for build_index: the chunks are already committed,
+        so a failure here only leaves the previous graph in place."""
+        try:
+            print(f"🔗 Related resources computed for {self.build_related()} resource(s)")
+        except Exception as e:
+            print(f"⚠️  Related resources not updated: {e}")
     
     def get_stats(self) -> Dict:
         """Get index statistics."""
-        return {
-            'total_documents': len(self.documents),
-            'vocabulary_size': len(self.vocabulary),
-            'total_files': len(self.file_hashes)
-        }
+        return self.snapshot.get_stats()
+    
+    def release(self):
+        """Drop the published snapshot.
+        
+        For processes that only build: a long-lived worker shouldn't keep a
+        second copy of the index resident between tasks. As with a reload,
+        the snapshot's files are unmapped once nothing references it, so a
+        search still holding it finishes normally.
+        """
+        with self._load_lock:
+            self.snapshot = IndexSnapshot()
+            self.query_cache.clear()
 
 
 # Global vector store instance
 vector_store = VectorStore()
 
 
-def build_embeddings(force: bool = False) -> int:
-    """Build embeddings (called from server or CLI)."""
-    return vector_store.build_index(force_rebuild=force)
+def build_embeddings(force: bool = False, workers: int = EXTRACT_WORKERS) -> int:
+    """Build embeddings (called from a server worker process or CLI).
+    
+    The snapshot loaded for the build is released afterwards.
+    """
+    try:
+        return vector_store.build_index(force_rebuild=force, workers=workers)
+    finally:
+        vector_store.release()
 
 
-def search_embeddings(query: str, top_k: int = 5) -> List[Dict]:
+def merge_embeddings() -> int:
+    """Compact index segments (called from a server worker process or CLI)."""
+    try:
+        return vector_store.merge_segments()
+    finally:
+        vector_store.release()
+
+
+def search_embeddings(query: str, top_k: int = 5, mode: str = 'tfidf', **filters) -> List[Dict]:
     """Search embeddings (called from server)."""
-    return vector_store.search(query, top_k)
+    return vector_store.search(query, top_k, mode=mode, **filters)
 
 
 def main():
@@ -423,6 +2211,20 @@ def main():
     import sys
     force = '--force' in sys.argv or '-f' in sys.argv
     
+    if '--merge' in sys.argv:
+        merged = merge_embeddings()
+        print(f"✅ Merged {merged} segment(s)" if merged else "ℹ️  Nothing to merge.")
+        print("=" * 50)
+        return
+    
+    if '--related' in sys.argv:
+        if not vector_store.load():
+            print("📭 No index to link resources from.")
+        else:
+            print(f"🔗 Related resources computed for {vector_store.build_related()} resource(s)")
+        print("=" * 50)
+        return
+    
     if force:
         print("🔄 Force rebuild enabled\n")
     
@@ -432,7 +2234,7 @@ def main():
     print("-" * 50)
     if count > 0:
         print(f"✅ Successfully created {count} embeddings!")
-        print(f"💾 Saved to: {VECTOR_INDEX_FILE}")
+        print(f"💾 Saved to: {SEGMENTS_DIR}")
     else:
         print("ℹ️  No new embeddings created.")
     print("=" * 50)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Catalog Enrichment
+Adds file size, PDF page count and a small first-page thumbnail to each
+resource so phones can show a preview without downloading the file.
+
+Results are cached by file fingerprint, so each file version is only
+opened once. Thumbnails are written as tiny static JPEGs next to the
+catalog and served like any other portal asset.
+
+Usage:
+    python scripts/enrichment.py           # Enrich metadata.json in place
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from page_cache import get_file_hash
+
+# Try to import PyMuPDF
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent.resolve()
+PROJECT_DIR = SCRIPT_DIR.parent
+METADATA_FILE = PROJECT_DIR / "portal" / "data" / "metadata.json"
+ENRICHMENT_CACHE_FILE = PROJECT_DIR / "portal" / "data" / "enrichment_cache.json"
+THUMBNAILS_DIR = PROJECT_DIR / "portal" / "data" / "thumbnails"
+
+# Thumbnail settings
+THUMBNAIL_WIDTH = 120  # pixels
+THUMBNAIL_QUALITY = 60  # JPEG quality (0-100)
+
+_cache_lock = threading.Lock()
+
+
+def load_enrichment_cache() -> dict:
+    """Load cached enrichment results keyed by file fingerprint."""
+    if ENRICHMENT_CACHE_FILE.exists():
+        try:
+            with open(ENRICHMENT_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            pass
+    return {}
+
+
+def save_enrichment_cache(cache: dict):
+    """Save enrichment cache atomically (the server reads it while a worker writes it)."""
+    ENRICHMENT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = ENRICHMENT_CACHE_FILE.with_suffix(f'.{os.getpid()}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(temp_path, ENRICHMENT_CACHE_FILE)
+
+
+def render_thumbnail(doc, fingerprint: str) -> Optional[str]:
+    """Render the first page of an open PDF to a small JPEG.
+
+    Returns the thumbnail path relative to the project root, or None.
+    """
+    if len(doc) == 0:
+        return None
+
+    page = doc[0]
+    if page.rect.width <= 0:
+        return None
+
+    zoom = THUMBNAIL_WIDTH / page.rect.width
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+
+    THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
+    thumb_path = THUMBNAILS_DIR / f"{fingerprint[:16]}.jpg"
+    pixmap.save(str(thumb_path), jpg_quality=THUMBNAIL_QUALITY)
+
+    return str(thumb_path.relative_to(PROJECT_DIR)).replace('\\', '/')
+
+
+def compute_enrichment(file_path: Path, file_format: str, fingerprint: str) -> Dict:
+    """Compute size, page count and thumbnail for a single file."""
+    info = {'size_bytes': file_path.stat().st_size}
+
+    if file_format != 'pdf' or not PYMUPDF_AVAILABLE:
+        return info
+
+    try:
+        doc = fitz.open(str(file_path))
+        try:
+            info['pages'] = len(doc)
+            thumbnail = render_thumbnail(doc, fingerprint)
+            if thumbnail:
+                info['thumbnail'] = thumbnail
+        finally:
+            doc.close()
+    except Exception as e:
+        print(f"   ⚠️  Enrichment error for {file_path.name}: {e}")
+
+    return info
+
+
+def prune_thumbnails(cache: dict):
+    """Delete thumbnails no longer referenced by the cache."""
+    if not THUMBNAILS_DIR.exists():
+        return
+
+    referenced = {Path(entry['thumbnail']).name for entry in cache.values() if entry.get('thumbnail')}
+    for thumb_path in THUMBNAILS_DIR.glob('*.jpg'):
+        if thumb_path.name not in referenced:
+            try:
+                thumb_path.unlink()
+            except OSError:
+                pass
+
+
+def enrich_resources(resources: List[Dict], compute_missing: bool = True) -> int:
+    """Attach size, page count and thumbnail to each resource in place.
+
+    Cached results are applied to every resource. Files without a cache entry
+    are only opened when compute_missing is True; otherwise they get just
+    their size, which is cheap enough to serve from a request thread.
+
+    Returns the number of files that were newly enriched.
+    """
+    with _cache_lock:
+        cache = load_enrichment_cache()
+        fresh_cache = {}
+        computed = 0
+
+        for resource in resources:
+            file_path = PROJECT_DIR / resource['filepath']
+            if not file_path.exists():
+                continue
+
+            fingerprint = get_file_hash(file_path)
+            info = cache.get(fingerprint)
+
+            if info is None:
+                if not compute_missing:
+                    resource['size_bytes'] = file_path.stat().st_size
+                    continue
+                info = compute_enrichment(file_path, resource.get('format', ''), fingerprint)
+                computed += 1
+
+            fresh_cache[fingerprint] = info
+            resource.update(info)
+
+        # Only rewrite the cache when entries were added or files went away
+        if computed or (compute_missing and fresh_cache.keys() != cache.keys()):
+            save_enrichment_cache(fresh_cache)
+            prune_thumbnails(fresh_cache)
+
+        return computed
+
+
+def main():
+    """CLI entry point."""
+    print("=" * 50)
+    print("🖼️  Ilmify Catalog Enrichment")
+    print("=" * 50)
+    print()
+
+    if not METADATA_FILE.exists():
+        print("❌ No metadata.json found. Run the indexer first.")
+        return
+
+    with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+        resources = json.load(f)
+
+    computed = enrich_resources(resources)
+
+    with open(METADATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(resources, f, indent=4, ensure_ascii=False)
+
+    print(f"✅ Enriched {len(resources)} resource(s), {computed} newly processed")
+    print(f"💾 Thumbnails in: {THUMBNAILS_DIR}")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
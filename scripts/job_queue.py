@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Background Job Scheduler
+A single prioritised queue for slow background work (PDF compression,
+embedding builds, thumbnails) so it never runs inline in the file watcher
+or in unmanaged per-upload threads.
+
+- Jobs are keyed (e.g. "compress:content/textbooks/x.pdf"). Submitting a key
+  that is already queued coalesces into the queued job; submitting a key
+  that is running schedules exactly one re-run after it finishes. The same
+  key never runs twice at once.
+- Lower priority numbers run first, so uploads jump ahead of watcher work.
+- A fixed number of worker threads bounds concurrency.
+- Failed jobs are retried with exponential backoff.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+# Priorities (lower runs first)
+PRIORITY_UPLOAD = 0
+PRIORITY_BACKGROUND = 10
+
+# Scheduler settings
+MAX_WORKERS = 2  # concurrent jobs
+MAX_RETRIES = 2  # retries after the first failure
+RETRY_DELAY = 5  # seconds, doubled on each retry
+HISTORY_SIZE = 50  # finished jobs kept for /api/jobs
+
+
+class Job:
+    """A unit of background work."""
+
+    def __init__(self, key: str, func: Callable, args: tuple, priority: int, description: str = ''):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.description = description or key
+        self.status = 'pending'
+        self.attempts = 0
+        self.coalesced = 0
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.ready_at = 0.0  # earliest start time (used for retries)
+        self.rerun = None  # (func, args, priority) queued while running
+
+    def to_dict(self) -> Dict:
+        """Serialisable view for the jobs API."""
+        now = time.time()
+        info = {
+            'key': self.key,
+            'description': self.description,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'coalesced': self.coalesced,
+            'waiting_seconds': round((self.started_at or now) - self.submitted_at, 1),
+        }
+        if self.started_at:
+            info['running_seconds'] = round((self.finished_at or now) - self.started_at, 1)
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class JobScheduler:
+    """Thread-safe prioritised, deduplicating job queue with a worker pool."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_retries: int = MAX_RETRIES,
+                 retry_delay: float = RETRY_DELAY):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._cond = threading.Condition()
+        self._heap = []  # (priority, seq, job)
+        self._seq = itertools.count()
+        self._pending: Dict[str, Job] = {}
+        self._running: Dict[str, Job] = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._counts = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'retried': 0}
+        self._workers: List[threading.Thread] = []
+        self._stopping = False
+
+    def start(self):
+        """Start the worker threads."""
+        with self._cond:
+            if self._workers:
+                return
+            self._stopping = False
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def stop(self):
+        """Stop accepting work and let workers exit after their current job."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def submit(self, key: str, func: Callable, *args, priority: int = PRIORITY_BACKGROUND,
+               description: str = '') -> Job:
+        """Queue a job, coalescing with any queued or running job of the same key."""
+        with self._cond:
+            self._counts['submitted'] += 1
+
+            job = self._pending.get(key)
+            if job is not None:
+                # Coalesce: run once with the latest arguments, at the best priority
+                job.func, job.args = func, args
+                job.coalesced += 1
+                job.ready_at = 0.0  # fresh input, don't wait out a retry delay
+                self._counts['coalesced'] += 1
+                if priority < job.priority:
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+                self._cond.notify()
+                return job
+
+            job = self._running.get(key)
+            if job is not None:
+                # Re-run once after the current run, since its input changed
+                best = min(priority, job.rerun[2]) if job.rerun else priority
+                job.rerun = (func, args, best)
+                job.coalesced += 1
+                self._counts['coalesced'] += 1
+                return job
+
+            job = Job(key, func, args, priority, description)
+            self._enqueue(job)
+            return job
+
+    def _enqueue(self, job: Job):
+        """Add a job to the heap (lock held)."""
+        job.status = 'pending' if job.attempts == 0 else 'retrying'
+        self._pending[job.key] = job
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        self._cond.notify()
+
+    def _next_job(self) -> Optional[Job]:
+        """Pop the best ready job, waiting if needed (lock held)."""
+        while not self._stopping:
+            now = time.time()
+            deferred = []
+            job = None
+
+            while self._heap:
+                priority, _, candidate = heapq.heappop(self._heap)
+                # Skip stale heap entries left behind by priority bumps
+                if self._pending.get(candidate.key) is not candidate or priority != candidate.priority:
+                    continue
+                if candidate.ready_at > now:
+                    deferred.append((priority, next(self._seq), candidate))
+                    continue
+                job = candidate
+                break
+
+            for entry in deferred:
+                heapq.heappush(self._heap, entry)
+
+            if job is not None:
+                del self._pending[job.key]
+                return job
+
+            # Sleep until woken by a submit or until the next retry is due
+            wake_at = min((entry[2].ready_at for entry in deferred), default=None)
+            self._cond.wait(timeout=max(0.05, wake_at - now) if wake_at else None)
+
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                if job is None:
+                    return
+                job.status = 'running'
+                job.started_at = time.time()
+                job.attempts += 1
+                self._running[job.key] = job
+
+            error = None
+            try:
+                job.func(*job.args)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"   ⚠️  Job {job.description} failed (attempt {job.attempts}): {error}")
+
+            with self._cond:
+                del self._running[job.key]
+                job.finished_at = time.time()
+                job.error = error
+
+                if error and job.attempts <= self.max_retries:
+                    self._counts['retried'] += 1
+                    job.ready_at = time.time() + self.retry_delay * (2 ** (job.attempts - 1))
+                    if job.rerun:
+                        job.func, job.args, job.priority = job.rerun
+                        job.rerun = None
+                    self._enqueue(job)
+                    continue
+
+                job.status = 'failed' if error else 'done'
+                self._counts['failed' if error else 'completed'] += 1
+                self._history.appendleft(job)
+
+                if job.rerun:
+                    func, args, priority = job.rerun
+                    job.rerun = None
+                    self._enqueue(Job(job.key, func, args, priority, job.description))
+
+    def get_stats(self) -> Dict:
+        """Snapshot of queue state for the jobs API."""
+        with self._cond:
+            pending = sorted(self._pending.values(), key=lambda j: (j.priority, j.submitted_at))
+            return {
+                'workers': self.max_workers,
+                'pending_count': len(pending),
+                'running_count': len(self._running),
+                'running': [j.to_dict() for j in self._running.values()],
+                'pending': [j.to_dict() for j in pending],
+                'recent': [j.to_dict() for j in self._history],
+                'totals': dict(self._counts),
+            }
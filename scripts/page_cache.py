@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Extracted Page Text Cache
+Keeps the text PyMuPDF extracts from each PDF page, so the vector store,
+the chatbot knowledge index and the page-text API share one extraction
+per file version instead of each opening the PDF again.
+
+Entries are keyed by file fingerprint (path, mtime and size), so a file
+rewritten by the compressor gets a fresh entry; entries for files that no
+longer exist are removed by prune_page_cache().
+
+File layout (portal/data/page_cache/<fingerprint>.pages, little-endian):
+    header      magic "ILMP", format version, the PDF's page count, the
+                number of pages stored and the offset of the page table
+    pages       zlib-compressed UTF-8 text of pages 0 .. stored - 1
+    page table  stored + 1 offsets; page i is bytes [offsets[i], offsets[i + 1])
+
+A reader that stops early (e.g. get_page() for one page) leaves the
+pages it extracted in the cache; the next reader picks up from there.
+Readers only load the header and page table, then seek to the pages they
+want.
+"""
+
+import hashlib
+import os
+import struct
+import time
+import zlib
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+# Try to import fitz (PyMuPDF); cached pages can still be read without it
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent.resolve()
+PROJECT_DIR = SCRIPT_DIR.parent
+PAGE_CACHE_DIR = PROJECT_DIR / "portal" / "data" / "page_cache"
+
+MAGIC = b'ILMP'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<4sHxxIIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+COMPRESSION_LEVEL = 6  # zlib level: text compresses ~3-4x at the default
+COPY_BLOCK_SIZE = 1024 * 1024  # bytes copied at a time when extending a cache file
+STALE_TEMP_AGE = 3600  # seconds since its last write before an unfinished cache file is abandoned
+
+
+def get_file_hash(file_path: Path) -> str:
+    """Get hash of file for change detection."""
+    stat = file_path.stat()
+    return hashlib.md5(f"{file_path}:{stat.st_mtime}:{stat.st_size}".encode()).hexdigest()
+
+
+def cache_file(pdf_path: Path) -> Path:
+    """Cache file for the current version of a PDF (raises OSError if it is missing)."""
+    return PAGE_CACHE_DIR / f"{get_file_hash(Path(pdf_path).resolve())}.pages"
+
+
+def _read_table(f: BinaryIO) -> Tuple[Optional[int], List[int]]:
+    """Return (page count, page offsets) from an open cache file, or (None, []).
+
+    Only the header and the page table are read; pages stay on disk.
+    """
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        return None, []
+    magic, version, page_count, stored, table_offset = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None, []
+
+    f.seek(table_offset)
+    table = f.read(8 * (stored + 1))
+    if len(table) < 8 * (stored + 1):
+        return None, []
+    return page_count, list(struct.unpack(f'<{stored + 1}Q', table))
+
+
+def _read_page(f: BinaryIO, offsets: List[int], number: int) -> str:
+    """Decompress one stored page from an open cache file."""
+    f.seek(offsets[number])
+    return zlib.decompress(f.read(offsets[number + 1] - offsets[number])).decode('utf-8')
+
+
+def _open_cache(path: Path) -> Tuple[Optional[BinaryIO], Optional[int], List[int]]:
+    """Open a cache file: (file, page count, page offsets), or (None, None, []) if unusable."""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None, None, []
+    try:
+        page_count, offsets = _read_table(f)
+    except OSError:
+        page_count, offsets = None, []
+    if page_count is None:
+        f.close()
+        return None, None, []
+    return f, page_count, offsets
+
+
+def _start_cache_file(temp_path: Path, source: Optional[BinaryIO], offsets: List[int]) -> BinaryIO:
+    """Open a new cache file holding the stored pages of source, ready to append more.
+
+    The stored pages are copied block by block, and keep their offsets.
+    """
+    temp_path.parent.mkdir(parents=True, exist_ok=True)
+    out = open(temp_path, 'w+b')
+    try:
+        out.write(b'\0' * HEADER_SIZE)  # written for real by _finish_cache_file
+        if source is not None:
+            source.seek(offsets[0])
+            remaining = offsets[-1] - offsets[0]
+            while remaining > 0:
+                block = source.read(min(COPY_BLOCK_SIZE, remaining))
+                if not block:
+                    raise OSError("page cache file shrank while it was being extended")
+                out.write(block)
+                remaining -= len(block)
+    except BaseException:
+        out.close()
+        raise
+    return out
+
+
+def _finish_cache_file(out: BinaryIO, temp_path: Path, path: Path, page_count: int, offsets: List[int]):
+    """Write the page table and header, then move the file into place atomically."""
+    with out:
+        out.seek(offsets[-1])
+        out.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        out.seek(0)
+        out.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, page_count, len(offsets) - 1, offsets[-1]))
+    os.replace(temp_path, path)
+
+
+def _discard(out: Optional[BinaryIO], temp_path: Path):
+    """Close and delete an unfinished cache file."""
+    if out is not None:
+        out.close()
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+
+def iter_pages(pdf_path: Path) -> Iterator[str]:
+    """Yield the text of every page in order ('' for pages without text).
+
+    Cached pages are read back one at a time; the rest are extracted one
+    page at a time and appended to a new cache file as they go, which
+    replaces the old one when the caller is done, including when it stops
+    early. Memory use doesn't grow with the size of the book.
+    """
+    try:
+        path = cache_file(pdf_path)
+    except OSError as e:
+        print(f"    ⚠️  Error opening PDF: {e}")
+        return
+
+    source, page_count, offsets = _open_cache(path)
+    if source is None:
+        offsets = [HEADER_SIZE]
+    stored = len(offsets) - 1
+    try:
+        for number in range(stored):
+            yield _read_page(source, offsets, number)
+        if page_count is not None and stored >= page_count:
+            return
+        if not PYMUPDF_AVAILABLE:
+            return
+
+        try:
+            doc = fitz.open(str(pdf_path))
+        except Exception as e:
+            print(f"    ⚠️  Error opening PDF: {e}")
+            return
+
+        # Per-process temp name: two builders may extract the same file at once
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            out = _start_cache_file(temp_path, source, offsets)
+        except OSError as e:
+            print(f"    ⚠️  Error caching page text: {e}")
+            _discard(None, temp_path)
+            out = None
+        if source is not None:
+            source.close()
+            source = None
+
+        try:
+            for number in range(stored, len(doc)):
+                text = doc[number].get_text()
+                if out is not None:
+                    try:
+                        out.write(zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL))
+                        offsets.append(out.tell())
+                    except OSError as e:
+                        print(f"    ⚠️  Error caching page text: {e}")
+                        _discard(out, temp_path)
+                        out = None
+                yield text
+        except Exception as e:
+            print(f"    ⚠️  Error extracting text: {e}")
+        finally:
+            if out is not None:
+                try:
+                    if len(offsets) - 1 > stored:
+                        _finish_cache_file(out, temp_path, path, len(doc), offsets)
+                    else:
+                        _discard(out, temp_path)
+                except OSError as e:
+                    print(f"    ⚠️  Error caching page text: {e}")
+                    _discard(out, temp_path)
+            doc.close()
+    finally:
+        if source is not None:
+            source.close()
+
+
+def cached_page(pdf_path: Path, number: int) -> Tuple[Optional[int], Optional[str]]:
+    """(page count, text of one page) from the cache alone; either may be None.
+
+    Reads the page table and that one page, never the rest of the file, and
+    never opens the PDF.
+    """
+    try:
+        source, page_count, offsets = _open_cache(cache_file(pdf_path))
+    except OSError:
+        return None, None
+    if source is None:
+        return None, None
+    with source:
+        if 0 <= number < len(offsets) - 1:
+            return page_count, _read_page(source, offsets, number)
+        return page_count, None
+
+
+def get_page(pdf_path: Path, number: int) -> Optional[str]:
+    """Text of one page (0-based), or None if the PDF has no such page.
+
+    Extracts (and caches) the pages up to it when it isn't cached yet.
+    """
+    if number < 0:
+        return None
+    _, text = cached_page(pdf_path, number)
+    if text is not None:
+        return text
+    pages = iter_pages(pdf_path)
+    try:
+        return next(islice(pages, number, None), None)
+    finally:
+        pages.close()  # caches the pages extracted on the way
+
+
+def cache_pages(pdf_path: Path, count: int) -> int:
+    """Make sure the first `count` pages are cached; returns how many pages are.
+
+    For background jobs, so HTTP handlers never extract pages themselves.
+    """
+    pages = iter_pages(pdf_path)
+    try:
+        return sum(1 for _ in islice(pages, count))
+    finally:
+        pages.close()
+
+
+def get_page_count(pdf_path: Path) -> Optional[int]:
+    """Number of pages in a PDF, from the cache when possible."""
+    try:
+        source, page_count, _ = _open_cache(cache_file(pdf_path))
+    except OSError:
+        return None
+    if source is not None:
+        source.close()
+        return page_count
+    if not PYMUPDF_AVAILABLE:
+        return None
+
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            return len(doc)
+    except Exception:
+        return None
+
+
+def prune_page_cache(pdf_paths: Iterable[Path]) -> int:
+    """Delete cache files of every PDF version not in pdf_paths; returns the count.
+
+    Unfinished cache files left behind by a process that crashed while
+    extracting are deleted too, once nothing has written to them for
+    STALE_TEMP_AGE seconds (a live extraction appends every page).
+    """
+    keep = set()
+    for pdf_path in pdf_paths:
+        try:
+            keep.add(cache_file(pdf_path).name)
+        except OSError:
+            continue
+
+    removed = 0
+    stale_before = time.time() - STALE_TEMP_AGE
+    if PAGE_CACHE_DIR.exists():
+        for path in PAGE_CACHE_DIR.iterdir():
+            try:
+                if path.suffix == '.pages':
+                    stale = path.name not in keep
+                else:
+                    stale = path.suffix == '.tmp' and path.stat().st_mtime < stale_before
+                if stale:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Binary Vector Index Format
+A versioned, memory-mappable file for the vector store's segments, so the
+server reads arrays straight from the file instead of parsing a large JSON
+index, and chunk records are only paged in for the rows a query returns.
+
+Layout (little-endian):
+    header      magic "ILMV", format version, weight dtype, counts and a
+                table of (offset, length) for every section below
+    sections    8-byte aligned arrays and blobs:
+                vocabulary (offsets + UTF-8 blob), idf, per-document term
+                pointers, term ids, weights (float32 or int8 + per-row
+                scales), term counts and lengths for BM25, term-major
+                postings, per-document JSON records (offsets + blob), a
+                small JSON "extra" blob (file hashes, settings),
+                fixed-width per-document MinHash signatures (version 2),
+                per-document vector norms and per-term BM25 score bounds
+                (version 3)
+
+Sections a writer has no use for are stored empty: the vector store's
+segments keep only raw term counts and records, while the corpus-wide
+arrays built from them (weights, postings, norms and bounds, but no
+records) are written once per index generation with write_arrays().
+
+Chunk records (title, content, ...) are only decoded for rows a caller asks
+for, typically the final top-k.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+MAGIC = b'ILMV'
+FORMAT_VERSION = 3
+
+DTYPE_FLOAT32 = 0
+DTYPE_INT8 = 1
+DTYPE_NAMES = {'float32': DTYPE_FLOAT32, 'int8': DTYPE_INT8}
+
+# Sections in file order, with their array typecode ('' for raw bytes)
+SECTIONS = [
+    ('vocab_offsets', 'Q'),
+    ('vocab_blob', ''),
+    ('idf', 'f'),
+    ('doc_ptr', 'Q'),
+    ('terms', 'i'),
+    ('weights', 'f'),  # 'b' when the index is int8
+    ('scales', 'f'),  # empty for float32 indexes
+    ('counts', 'H'),
+    ('lengths', 'I'),
+    ('post_ptr', 'Q'),
+    ('post_rows', 'I'),
+    ('post_tfs', 'H'),
+    ('record_offsets', 'Q'),
+    ('record_blob', ''),
+    ('extra', ''),
+    ('signatures', ''),  # all documents' signatures back to back, or empty
+    ('norms', 'f'),  # per document, the length of its unquantised weight vector
+    ('bounds', 'f'),  # per term, the highest BM25 score any of its postings gets
+]
+
+# Sections each readable version has; later versions only append sections
+VERSION_SECTIONS = {1: len(SECTIONS) - 3, 2: len(SECTIONS) - 2, 3: len(SECTIONS)}
+HEADER_PREFIX = '<4sH'  # magic and version
+
+
+def _header_format(n_sections: int) -> str:
+    return '<4sHBBIIQ' + 'QQ' * n_sections
+
+
+HEADER_FORMAT = _header_format(len(SECTIONS))
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_COUNT = 65535  # counts and postings tfs are stored as uint16
+
+NUMPY_TYPES = {'Q': '<u8', 'f': '<f4', 'i': '<i4', 'b': 'i1', 'H': '<u2', 'I': '<u4'}
+
+
+class IndexFormatError(Exception):
+    """Raised when a file is not a readable vector index."""
+
+
+def _to_bytes(values, typecode: str) -> bytes:
+    """Pack values as a little-endian array."""
+    packed = array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _offsets_and_blob(strings: List[str]):
+    """Encode strings into an offsets table and one UTF-8 blob."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = [0]
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    return _to_bytes(offsets, 'Q'), b''.join(encoded)
+
+
+def quantize_row(weights: List[float]):
+    """Quantize one row of weights to int8 with a per-row scale."""
+    peak = max((abs(w) for w in weights), default=0.0)
+    if peak == 0:
+        return [0] * len(weights), 1.0
+    scale = peak / 127
+    return [int(round(w / scale)) for w in weights], scale
+
+
+def write_index(path: Path, vocabulary: List[str], idf: List[float], documents: List[Dict],
+                extra: Optional[Dict] = None, dtype: str = 'float32', postings: bool = True) -> int:
+    """Write documents to a binary index file atomically.
+
+    Each document needs 'terms', 'weights', 'counts' and 'length' and may
+    have a 'signature' (bytes); every other key is stored in its JSON
+    record. Signatures are only stored when every document has one of the
+    same length. With postings=False the term-major postings sections are
+    left empty. Returns the file size in bytes.
+    """
+    dtype_code = DTYPE_NAMES[dtype]
+    n_docs = len(documents)
+
+    doc_ptr = [0]
+    terms, weights, scales, counts, lengths = [], [], [], [], []
+    records = []
+    signatures = [doc.get('signature') for doc in documents]
+    if None in signatures or len({len(signature) for signature in signatures}) > 1:
+        signatures = []
+    term_postings = [[] for _ in vocabulary] if postings else []
+
+    for row, doc in enumerate(documents):
+        doc_terms = doc.get('terms', [])
+        doc_counts = doc.get('counts') or [1] * len(doc_terms)
+        doc_weights = doc.get('weights', [])
+
+        if dtype_code == DTYPE_INT8:
+            doc_weights, scale = quantize_row(doc_weights)
+            scales.append(scale)
+
+        terms.extend(doc_terms)
+        weights.extend(doc_weights)
+        counts.extend(min(c, MAX_COUNT) for c in doc_counts)
+        lengths.append(doc.get('length', sum(doc_counts)))
+        doc_ptr.append(len(terms))
+
+        if postings:
+            for term, count in zip(doc_terms, doc_counts):
+                term_postings[term].append((row, min(count, MAX_COUNT)))
+
+        records.append(json.dumps(
+            {k: v for k, v in doc.items() if k not in ('terms', 'weights', 'counts', 'length', 'signature')},
+            ensure_ascii=False, separators=(',', ':')
+        ))
+
+    post_ptr = [0] if postings else []
+    post_rows, post_tfs = [], []
+    for entries in term_postings:
+        for row, count in entries:
+            post_rows.append(row)
+            post_tfs.append(count)
+        post_ptr.append(len(post_rows))
+
+    vocab_offsets, vocab_blob = _offsets_and_blob(vocabulary)
+    record_offsets, record_blob = _offsets_and_blob(records)
+
+    payloads = {
+        'vocab_offsets': vocab_offsets,
+        'vocab_blob': vocab_blob,
+        'idf': _to_bytes(idf, 'f'),
+        'doc_ptr': _to_bytes(doc_ptr, 'Q'),
+        'terms': _to_bytes(terms, 'i'),
+        'weights': _to_bytes(weights, 'b' if dtype_code == DTYPE_INT8 else 'f'),
+        'scales': _to_bytes(scales, 'f'),
+        'counts': _to_bytes(counts, 'H'),
+        'lengths': _to_bytes(lengths, 'I'),
+        'post_ptr': _to_bytes(post_ptr, 'Q'),
+        'post_rows': _to_bytes(post_rows, 'I'),
+        'post_tfs': _to_bytes(post_tfs, 'H'),
+        'record_offsets': record_offsets,
+        'record_blob': record_blob,
+        'extra': json.dumps(extra or {}, ensure_ascii=False).encode('utf-8'),
+        'signatures': b''.join(signatures),
+        'norms': b'',
+        'bounds': b'',
+    }
+    return _write_sections(path, payloads, dtype_code, n_docs, len(vocabulary), len(terms))
+
+
+def write_arrays(path: Path, vocabulary: List[str], arrays: Dict, extra: Optional[Dict] = None,
+                 dtype: str = 'float32') -> int:
+    """Write prebuilt section arrays to a binary index file atomically.
+
+    arrays maps section names to NumPy arrays (converted to each section's
+    type); sections left out, such as the records, are stored empty. The
+    document count comes from 'doc_ptr'. NumPy required. Returns the file
+    size in bytes.
+    """
+    dtype_code = DTYPE_NAMES[dtype]
+    vocab_offsets, vocab_blob = _offsets_and_blob(vocabulary)
+    payloads = {'vocab_offsets': vocab_offsets, 'vocab_blob': vocab_blob,
+                'extra': json.dumps(extra or {}, ensure_ascii=False).encode('utf-8')}
+    for name, typecode in SECTIONS:
+        if name in arrays:
+            if name == 'weights' and dtype_code == DTYPE_INT8:
+                typecode = 'b'
+            payloads[name] = memoryview(np.ascontiguousarray(arrays[name], dtype=NUMPY_TYPES[typecode])).cast('B')
+        else:
+            payloads.setdefault(name, b'')
+    n_docs = max(len(arrays.get('doc_ptr', ())) - 1, 0)
+    return _write_sections(path, payloads, dtype_code, n_docs, len(vocabulary), len(arrays.get('terms', ())))
+
+
+def _write_sections(path: Path, payloads: Dict, dtype_code: int, n_docs: int, vocab_size: int, nnz: int) -> int:
+    """Lay out the header and 8-byte aligned sections, then replace path."""
+    table = []
+    offset = HEADER_SIZE
+    for name, _ in SECTIONS:
+        offset += -offset % 8  # align every section to 8 bytes
+        table.extend((offset, len(payloads[name])))
+        offset += len(payloads[name])
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, dtype_code, 0,
+                         n_docs, vocab_size, nnz, *table)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        for i, (name, _) in enumerate(SECTIONS):
+            f.write(b'\0' * (table[2 * i] - f.tell()))
+            f.write(payloads[name])
+
+    # Readers that still map the old file keep a valid view of it
+    os.replace(temp_path, path)
+    return offset
+
+
+class MappedIndex:
+    """Read-only, memory-mapped view of a binary index file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise IndexFormatError(f"{path} is empty")
+        self._view = memoryview(self._mmap)
+
+        if len(self._mmap) < struct.calcsize(HEADER_PREFIX):
+            self.close()
+            raise IndexFormatError(f"{path} is truncated")
+        magic, version = struct.unpack_from(HEADER_PREFIX, self._mmap, 0)
+        if magic != MAGIC or version not in VERSION_SECTIONS:
+            self.close()
+            raise IndexFormatError(f"{path} is not a version 1-{FORMAT_VERSION} vector index")
+
+        header_format = _header_format(VERSION_SECTIONS[version])
+        if len(self._mmap) < struct.calcsize(header_format):
+            self.close()
+            raise IndexFormatError(f"{path} is truncated")
+
+        fields = struct.unpack_from(header_format, self._mmap, 0)
+        _, _, dtype_code, _, n_docs, vocab_size, nnz = fields[:7]
+
+        self.dtype = 'int8' if dtype_code == DTYPE_INT8 else 'float32'
+        self.n_docs = n_docs
+        self.vocab_size = vocab_size
+        self.nnz = nnz
+        self.version = version
+        # Sections newer than the file's version read as empty
+        self._sections = {
+            name: (fields[7 + 2 * i], fields[8 + 2 * i]) if i < VERSION_SECTIONS[version] else (0, 0)
+            for i, (name, _) in enumerate(SECTIONS)
+        }
+        self.extra = json.loads(bytes(self._bytes('extra')).decode('utf-8') or '{}')
+
+    def _bytes(self, name: str) -> memoryview:
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def _typecode(self, name: str) -> str:
+        if name == 'weights' and self.dtype == 'int8':
+            return 'b'
+        return dict(SECTIONS)[name]
+
+    def view(self, name: str) -> memoryview:
+        """Zero-copy typed memoryview of a section (fast per-item access)."""
+        return self._bytes(name).cast(self._typecode(name))
+
+    def array(self, name: str):
+        """Zero-copy NumPy array of a section (NumPy required)."""
+        offset, length = self._sections[name]
+        dtype = np.dtype(NUMPY_TYPES[self._typecode(name)])
+        return np.frombuffer(self._mmap, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+
+    def vocabulary(self) -> List[str]:
+        """Decode all vocabulary words."""
+        offsets = self.view('vocab_offsets')
+        blob = self._bytes('vocab_blob')
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(self.vocab_size)]
+
+    def record(self, row: int) -> Dict:
+        """Decode one document's JSON record."""
+        offsets = self.view('record_offsets')
+        blob = self._bytes('record_blob')
+        return json.loads(bytes(blob[offsets[row]:offsets[row + 1]]).decode('utf-8'))
+
+    def signature(self, row: int) -> Optional[bytes]:
+        """One document's stored signature, or None if the file has none."""
+        length = self._sections['signatures'][1]
+        if not length or not self.n_docs:
+            return None
+        width = length // self.n_docs
+        return bytes(self._bytes('signatures')[row * width:(row + 1) * width])
+
+    def document(self, row: int) -> Dict:
+        """Rebuild a full document dict (record plus vector data)."""
+        doc_ptr = self.view('doc_ptr')
+        start, end = doc_ptr[row], doc_ptr[row + 1]
+        weights = list(self.view('weights')[start:end])
+        if self.dtype == 'int8':
+            scale = self.view('scales')[row]
+            weights = [round(w * scale, 6) for w in weights]
+        doc = self.record(row)
+        doc['terms'] = list(self.view('terms')[start:end])
+        doc['weights'] = weights
+        doc['counts'] = list(self.view('counts')[start:end])
+        doc['length'] = self.view('lengths')[row]
+        signature = self.signature(row)
+        if signature is not None:
+            doc['signature'] = signature
+        return doc
+
+    def close(self):
+        """Release the mapping (views handed out must no longer be used)."""
+        try:
+            self._view.release()
+            self._mmap.close()
+        except (BufferError, ValueError, AttributeError):
+            # NumPy arrays still reference the map; let GC close it
+            pass
+        self._file.close()
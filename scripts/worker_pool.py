@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Ilmify - Worker Process Pool
+Runs CPU-heavy PDF work (compression, text extraction, TF-IDF builds) in
+separate, lower-priority processes so it can't hold the server's GIL and
+stall HTTP handler threads.
+
+Each task gets a wall-clock time limit, and each worker process has a
+memory limit. Results (or exceptions) are pickled back to the parent.
+Resource limits rely on POSIX APIs and are skipped where unavailable
+(e.g. Windows); the pool itself works everywhere.
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+# Pool defaults (a Raspberry Pi should keep cores free for HTTP)
+WORKER_COUNT = 1  # worker processes
+WORKER_NICE = 10  # added niceness (0 = same priority as server)
+TASK_MEMORY_LIMIT_MB = 768  # per worker process, 0 = unlimited
+TASK_TIME_LIMIT = 900  # seconds per task, 0 = unlimited
+KILL_GRACE = 30  # extra seconds before the parent kills a stuck worker
+
+
+class TaskTimeoutError(Exception):
+    """Raised when a task exceeds its time limit."""
+
+
+def _init_worker(scripts_dir: str, nice: int, memory_limit_mb: int):
+    """Prepare a worker process: import path, priority and memory limit."""
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+
+    if nice and hasattr(os, 'nice'):
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+
+    if memory_limit_mb and RESOURCE_AVAILABLE:
+        # RLIMIT_DATA covers heap and anonymous mappings on modern Linux;
+        # it doesn't count shared libraries the way RLIMIT_AS does.
+        limit_kind = getattr(resource, 'RLIMIT_DATA', resource.RLIMIT_AS)
+        limit = memory_limit_mb * 1024 * 1024
+        try:
+            _, hard = resource.getrlimit(limit_kind)
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(limit_kind, (limit, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def _on_alarm(signum, frame):
+    raise TaskTimeoutError("Task exceeded its time limit")
+
+
+def _run_task(func: Callable, args: tuple, kwargs: dict, time_limit: int) -> Any:
+    """Run one task inside a worker, enforcing its time limit."""
+    use_alarm = bool(time_limit) and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(time_limit)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+class WorkerPool:
+    """Thread-safe wrapper around a lazily started process pool."""
+
+    def __init__(self, workers: int = WORKER_COUNT, nice: int = WORKER_NICE,
+                 memory_limit_mb: int = TASK_MEMORY_LIMIT_MB, time_limit: int = TASK_TIME_LIMIT):
+        self.workers = max(1, workers)
+        self.nice = nice
+        self.memory_limit_mb = memory_limit_mb
+        self.time_limit = time_limit
+
+        self._lock = threading.Lock()  # guards _executor and _stats
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._stats = {'completed': 0, 'failed': 0, 'timed_out': 0, 'restarts': 0}
+
+    def _count(self, name: str):
+        """Increment a task counter (run() is called from many job threads)."""
+        with self._lock:
+            self._stats[name] += 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn" avoids forking a process that has live server threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(str(SCRIPT_DIR), self.nice, self.memory_limit_mb),
+                )
+            return self._executor
+
+    def _reset(self, kill: bool = False):
+        """Discard the current pool, optionally killing stuck workers."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._stats['restarts'] += 1
+        if executor is None:
+            return
+        if kill:
+            # No public API to kill a busy worker; terminate the processes directly
+            for process in list(getattr(executor, '_processes', {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func: Callable, *args, time_limit: Optional[int] = None, **kwargs) -> Any:
+        """Run func(*args, **kwargs) in a worker process and return its result.
+
+        Blocks the calling thread (typically a job-queue worker) but not the
+        server's other threads. Exceptions raised by the task are re-raised.
+        """
+        limit = self.time_limit if time_limit is None else time_limit
+        future = self._get_executor().submit(_run_task, func, args, kwargs, limit)
+
+        try:
+            result = future.result(timeout=limit + KILL_GRACE if limit else None)
+        except FutureTimeoutError:
+            # The task is stuck in C code that ignores the alarm
+            self._count('timed_out')
+            self._reset(kill=True)
+            raise TaskTimeoutError(f"{getattr(func, '__name__', 'task')} killed after {limit}s")
+        except TaskTimeoutError:
+            self._count('timed_out')
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for exceeding its memory limit)
+            self._count('failed')
+            self._reset()
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+
+        self._count('completed')
+        return result
+
+    def get_stats(self) -> dict:
+        """Pool settings and task counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            'workers': self.workers,
+            'nice': self.nice,
+            'memory_limit_mb': self.memory_limit_mb,
+            'time_limit': self.time_limit,
+            **stats,
+        }
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -18,18 +18,26 @@ import time
 import json
 import re
 import hashlib
+import heapq
+import math
 import sys
+from collections import deque
+from bisect import bisect_left, bisect_right
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
 from datetime import datetime
 
 # Try to import embeddings module
 try:
     sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
-    from embeddings import build_embeddings, vector_store
+    from embeddings import ANN_PROBES, SEARCH_MODES, build_embeddings, merge_embeddings, vector_store
     EMBEDDINGS_AVAILABLE = True
 except ImportError:
     EMBEDDINGS_AVAILABLE = False
+    ANN_PROBES = 16
+    SEARCH_MODES = ('tfidf', 'bm25', 'ann')
     build_embeddings = None
+    merge_embeddings = None
     vector_store = None
     print("⚠️  Embeddings module not available. Vector search disabled.")
 
@@ -43,6 +51,61 @@ except ImportError:
     compress_pdf = None
     print("⚠️  PDF compressor module not available.")
 
+# Try to import catalog enrichment module
+try:
+    sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+    from enrichment import enrich_resources
+    ENRICHMENT_AVAILABLE = True
+except ImportError:
+    ENRICHMENT_AVAILABLE = False
+    enrich_resources = None
+    print("⚠️  Enrichment module not available. Thumbnails disabled.")
+
+# Try to import the knowledge indexer (keyword extraction for /api/ask)
+try:
+    sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+    from build_knowledge_index import INDEX_FILE as KNOWLEDGE_INDEX_FILE, POSTINGS_VERSION, extract_keywords
+    KNOWLEDGE_INDEX_AVAILABLE = True
+except ImportError:
+    KNOWLEDGE_INDEX_AVAILABLE = False
+    KNOWLEDGE_INDEX_FILE = Path(__file__).parent / "portal" / "data" / "knowledge_index.json"
+    POSTINGS_VERSION = None
+    extract_keywords = None
+    print("⚠️  Knowledge indexer not available. Server-side answers disabled.")
+
+# Try to import the background job queue
+try:
+    sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+    from job_queue import JobScheduler, PRIORITY_UPLOAD, PRIORITY_BACKGROUND
+    JOB_QUEUE_AVAILABLE = True
+except ImportError:
+    JOB_QUEUE_AVAILABLE = False
+    JobScheduler = None
+    PRIORITY_UPLOAD, PRIORITY_BACKGROUND = 0, 10
+    print("⚠️  Job queue module not available. Background PDF processing disabled.")
+
+# Try to import the shared page text cache
+try:
+    sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+    from page_cache import PYMUPDF_AVAILABLE as PAGE_EXTRACTION_AVAILABLE, cache_pages, cached_page
+    PAGE_CACHE_AVAILABLE = True
+except ImportError:
+    PAGE_CACHE_AVAILABLE = False
+    PAGE_EXTRACTION_AVAILABLE = False
+    cache_pages = None
+    cached_page = None
+    print("⚠️  Page cache module not available. Page text disabled.")
+
+# Try to import the worker process pool
+try:
+    sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+    from worker_pool import WorkerPool
+    WORKER_POOL_AVAILABLE = True
+except ImportError:
+    WORKER_POOL_AVAILABLE = False
+    WorkerPool = None
+    print("⚠️  Worker pool module not available. PDF work runs in the server process.")
+
 # Configuration
 PORT = 8080
 HOST = "0.0.0.0"  # Listen on all interfaces for mobile access
@@ -51,6 +114,7 @@ SESSION_TIMEOUT = 300  # 5 minutes for active session
 SCRIPT_DIR = Path(__file__).parent.resolve()
 CONTENT_DIR = SCRIPT_DIR / "content"
 OUTPUT_FILE = SCRIPT_DIR / "portal" / "data" / "metadata.json"
+RELATED_FILE = SCRIPT_DIR / "portal" / "data" / "vectors" / "related.json"
 
 # Supported file extensions
 SUPPORTED_EXTENSIONS = {
@@ -73,6 +137,47 @@ CATEGORY_MAPPING = {
 # Watch interval in seconds (increased for performance)
 WATCH_INTERVAL = 10
 
+# Resource listing API page sizes
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Most IVF lists probed by approximate ('ann') vector search (the default
+# is embeddings.ANN_PROBES)
+MAX_ANN_PROBES = 256
+
+# Most results per query from /api/search and /api/search/batch
+MAX_SEARCH_RESULTS = 50
+
+# Most queries accepted by one /api/search/batch request
+MAX_BATCH_QUERIES = 32
+
+# Most chunks returned by one /api/ask request
+MAX_ASK_RESULTS = 20
+
+# BM25 settings for /api/ask
+ASK_BM25_K1 = 1.2  # term-frequency saturation
+ASK_BM25_B = 0.75  # chunk-length normalisation
+
+# Extracted text of one PDF page: /api/resources/<id>/pages/<page>
+PAGE_TEXT_ROUTE = re.compile(r'^/api/resources/(\d+)/pages/(\d+)$')
+PAGE_PREFETCH = 20  # pages cached past the one asked for, for readers paging forward
+PAGE_RETRY_AFTER = 2  # seconds a client should wait for a page being extracted
+
+# Precomputed related resources: /api/resources/<id>/related
+RELATED_ROUTE = re.compile(r'^/api/resources/(\d+)/related$')
+
+# Chatbot knowledge shards are content-hashed, so they never change
+KNOWLEDGE_SHARD_FILE = re.compile(r'/knowledge/kb-[\w-]+-[0-9a-f]{12}\.json$')
+
+# Number of catalog changes kept for delta updates
+CHANGE_LOG_SIZE = 500
+
+# Worker processes for CPU-heavy PDF work (compression, embeddings)
+PDF_WORKERS = 1
+PDF_WORKER_NICE = 10  # lower priority than the HTTP server
+PDF_TASK_MEMORY_MB = 768  # per worker process
+PDF_TASK_TIME_LIMIT = 900  # seconds per task
+
 
 # ============================================
 # USER TRACKING SYSTEM WITH RATE LIMITING
@@ -148,18 +253,22 @@ class UserTracker:
     def cleanup_inactive(self):
         """Remove inactive sessions."""
         with self._lock:
-            current_time = time.time()
-            inactive = [
-                ip for ip, data in self._active_sessions.items()
-                if current_time - data['last_seen'] > SESSION_TIMEOUT
-            ]
-            for ip in inactive:
-                del self._active_sessions[ip]
+            self._cleanup_inactive_locked()
+    
+    def _cleanup_inactive_locked(self):
+        """Remove inactive sessions; the caller holds self._lock."""
+        current_time = time.time()
+        inactive = [
+            ip for ip, data in self._active_sessions.items()
+            if current_time - data['last_seen'] > SESSION_TIMEOUT
+        ]
+        for ip in inactive:
+            del self._active_sessions[ip]
     
     def get_stats(self):
         """Get current statistics."""
         with self._lock:
-            self.cleanup_inactive()
+            self._cleanup_inactive_locked()
             current_time = time.time()
             
             active_users = len(self._active_sessions)
@@ -219,10 +328,341 @@ class UserTracker:
 user_tracker = UserTracker()
 
 
+# ============================================
+# RESOURCE CATALOG
+# ============================================
+
+class ResourceCatalog:
+    """Thread-safe in-memory catalog with per-category and per-format indexes.
+
+    Resources are kept sorted by id so a page can resume from the last id a
+    client saw (the cursor). Category and format indexes hold positions into
+    that list, and a sorted title index answers prefix filters with bisect.
+
+    Every update that changes the catalog bumps a version number and records
+    the added, removed and modified resources in a bounded change log, so
+    clients can fetch only what changed since the version they hold.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()  # serialises writers
+        self._resources = []  # sorted by id
+        self._ids = []  # parallel list of ids for bisect
+        self._by_category = {}  # category -> ascending positions
+        self._by_format = {}  # format -> ascending positions
+        self._titles = []  # sorted (lowercase title, position)
+        self._by_path = {}  # filepath -> resource
+        self._next_id = 1
+        # Versions start from the clock so clients from a previous run reload
+        self._version = int(time.time())
+        self._log_floor = self._version  # oldest version the log can answer
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+    
+    def seed(self, resources):
+        """Load a previously saved catalog as the baseline, without logging it."""
+        with self._update_lock:
+            with self._lock:
+                self._by_path = {r['filepath']: dict(r) for r in resources if 'filepath' in r}
+                self._next_id = max((r.get('id', 0) for r in resources), default=0) + 1
+            self._rebuild_indexes(list(self._by_path.values()))
+    
+    def update(self, resources):
+        """Apply a freshly scanned resource list.
+
+        Ids are kept stable per filepath, so adding one file doesn't renumber
+        (and thus "modify") every resource after it. The given dicts are
+        updated in place with their stable ids.
+        """
+        with self._update_lock:
+            self._apply_update(resources)
+    
+    def _apply_update(self, resources):
+        """Assign ids, log the diff and rebuild indexes (update lock held)."""
+        with self._lock:
+            old_by_path = self._by_path
+            
+            for resource in resources:
+                existing = old_by_path.get(resource['filepath'])
+                if existing is not None:
+                    resource['id'] = existing['id']
+                else:
+                    resource['id'] = self._next_id
+                    self._next_id += 1
+            
+            new_by_path = {r['filepath']: dict(r) for r in resources}
+            changes = []
+            for path, resource in new_by_path.items():
+                previous = old_by_path.get(path)
+                if previous is None:
+                    changes.append(('added', resource))
+                elif previous != resource:
+                    changes.append(('modified', resource))
+            for path, resource in old_by_path.items():
+                if path not in new_by_path:
+                    changes.append(('removed', {'id': resource['id'], 'filepath': path}))
+            
+            if changes:
+                self._version += 1
+                for op, resource in changes:
+                    if len(self._changes) == self._changes.maxlen:
+                        self._log_floor = self._changes[0]['version']
+                    self._changes.append({'version': self._version, 'op': op, 'resource': resource})
+            
+            self._by_path = new_by_path
+        
+        self._rebuild_indexes(list(new_by_path.values()))
+    
+    def _rebuild_indexes(self, resources):
+        """Rebuild the id, category, format and title indexes."""
+        ordered = sorted(resources, key=lambda r: r['id'])
+        by_category = {}
+        by_format = {}
+        
+        for pos, resource in enumerate(ordered):
+            by_category.setdefault(resource.get('category', ''), []).append(pos)
+            by_format.setdefault(resource.get('format', ''), []).append(pos)
+        
+        titles = sorted((r.get('title', '').lower(), pos) for pos, r in enumerate(ordered))
+        
+        with self._lock:
+            self._resources = ordered
+            self._ids = [r['id'] for r in ordered]
+            self._by_category = by_category
+            self._by_format = by_format
+            self._titles = titles
+    
+    def changes_since(self, since):
+        """Return changes after a client's version, or None if it must reload."""
+        with self._lock:
+            if since < self._log_floor or since > self._version:
+                return self._version, None
+            
+            # Keep only the latest change per resource
+            latest = {}
+            for change in self._changes:
+                if change['version'] > since:
+                    path = change['resource']['filepath']
+                    op = change['op']
+                    previous = latest.pop(path, None)
+                    if previous and previous['op'] == 'added' and op == 'modified':
+                        op = 'added'  # the client has never seen it
+                    latest[path] = {'op': op, 'resource': change['resource']}
+            return self._version, list(latest.values())
+    
+    def get(self, resource_id):
+        """Return a copy of one resource by id, or None."""
+        with self._lock:
+            pos = bisect_left(self._ids, resource_id)
+            if pos < len(self._ids) and self._ids[pos] == resource_id:
+                return dict(self._resources[pos])
+            return None
+    
+    def snapshot(self):
+        """Return the current version and full resource list."""
+        with self._lock:
+            return self._version, [dict(r) for r in self._resources]
+    
+    def query(self, category=None, file_format=None, prefix=None,
+              cursor=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+        """Return one page of resources matching the filters."""
+        with self._lock:
+            resources = self._resources
+            
+            # Start from the most selective index available
+            candidates = None
+            if category is not None:
+                candidates = self._by_category.get(category, [])
+            if file_format is not None:
+                format_positions = self._by_format.get(file_format, [])
+                if candidates is None or len(format_positions) < len(candidates):
+                    candidates = format_positions
+            
+            if prefix:
+                prefix = prefix.lower()
+                lo = bisect_left(self._titles, (prefix,))
+                hi = bisect_left(self._titles, (prefix + '\uffff',))
+                title_positions = sorted(pos for _, pos in self._titles[lo:hi])
+                if candidates is None or len(title_positions) < len(candidates):
+                    candidates = title_positions
+            
+            if candidates is None:
+                candidates = range(len(resources))
+            
+            # Skip everything up to and including the cursor id
+            start = 0
+            if cursor is not None:
+                start = bisect_left(candidates, bisect_right(self._ids, cursor))
+            
+            page = []
+            has_more = False
+            for i in range(start, len(candidates)):
+                resource = resources[candidates[i]]
+                if category is not None and resource.get('category') != category:
+                    continue
+                if file_format is not None and resource.get('format') != file_format:
+                    continue
+                if prefix and not resource.get('title', '').lower().startswith(prefix):
+                    continue
+                if len(page) == limit:
+                    has_more = True
+                    break
+                page.append(resource)
+        
+        if fields:
+            page = [{k: r[k] for k in ['id', *fields] if k in r} for r in page]
+        else:
+            page = [dict(r) for r in page]
+        
+        return {
+            'resources': page,
+            'count': len(page),
+            'next_cursor': str(page[-1]['id']) if has_more else None
+        }
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._resources)
+
+
+# Global resource catalog
+resource_catalog = ResourceCatalog()
+
+
+class RelatedGraph:
+    """Related-resources graph written offline by the embeddings build.
+
+    The file maps each resource id to its most similar resources, so a
+    lookup is one dict access. It is re-read whenever a build replaces it.
+    """
+    
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._related = {}
+    
+    def get(self, resource_id):
+        """Return [(related id, score), ...] for a resource, best first."""
+        try:
+            mtime = self._path.stat().st_mtime
+        except OSError:
+            return []
+        
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self._path, 'r', encoding='utf-8') as f:
+                        self._related = json.load(f).get('related', {})
+                except (json.JSONDecodeError, OSError, AttributeError):
+                    self._related = {}
+                self._mtime = mtime
+            return self._related.get(str(resource_id), [])
+
+
+# Global related-resources graph
+related_graph = RelatedGraph(RELATED_FILE)
+
+
+class KnowledgeIndex:
+    """BM25 inverted index over the chatbot knowledge index for /api/ask.
+    
+    Uses the postings the indexer writes into the file (term frequencies
+    and chunk lengths); for older files without them, postings are built
+    from each chunk's keywords with a frequency of one. Loaded the first
+    time a question comes in and again only when the indexer replaces the
+    file. A question only touches the chunks that share a term with it.
+    """
+    
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()  # one rebuild at a time
+        self._mtime = None
+        self._state = ([], {}, [], 0.0)  # (chunks, term -> [[ordinal, tf]], chunk lengths, avg length)
+    
+    @staticmethod
+    def _load(data):
+        """Return (chunks, postings, lengths, avg length) from a parsed index file."""
+        chunks = data.get('chunks', [])
+        postings = data.get('postings')
+        if (isinstance(postings, dict) and postings.get('version') == POSTINGS_VERSION
+                and len(postings.get('chunk_lengths', ())) == len(chunks)):
+            return chunks, postings['terms'], postings['chunk_lengths'], postings['avg_length']
+        
+        # Pre-v3 file: every keyword counts once
+        terms = {}
+        lengths = []
+        for ordinal, chunk in enumerate(chunks):
+            keywords = set(chunk.get('keywords', []))
+            for keyword in keywords:
+                terms.setdefault(keyword, []).append([ordinal, 1])
+            lengths.append(len(keywords))
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        return chunks, terms, lengths, avg_length
+    
+    def _current(self):
+        """Return the index state, reloading it if the file changed."""
+        try:
+            mtime = self._path.stat().st_mtime
+        except OSError:
+            return self._state
+        if mtime == self._mtime:
+            return self._state
+        
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self._path, 'r', encoding='utf-8') as f:
+                        state = self._load(json.load(f))
+                except (json.JSONDecodeError, OSError, AttributeError, KeyError, TypeError):
+                    state = ([], {}, [], 0.0)
+                
+                self._state = state  # readers see old or new, never half
+                self._mtime = mtime
+            return self._state
+    
+    def ask(self, question, top_k=5, category=None):
+        """Return the top_k chunks scoring highest (BM25) for a question."""
+        chunks, postings, lengths, avg_length = self._current()
+        n_chunks = len(chunks)
+        avg_length = avg_length or 1.0
+        scores = {}
+        for term in extract_keywords(question):
+            entries = postings.get(term)
+            if not entries:
+                continue
+            idf = math.log(1 + (n_chunks - len(entries) + 0.5) / (len(entries) + 0.5))
+            for ordinal, tf in entries:
+                norm = ASK_BM25_K1 * (1 - ASK_BM25_B + ASK_BM25_B * lengths[ordinal] / avg_length)
+                scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (ASK_BM25_K1 + 1) / (tf + norm)
+        
+        if category is not None:
+            scores = {i: score for i, score in scores.items() if chunks[i].get('category') == category}
+        
+        best = heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [{
+            'resource_id': chunks[i].get('resource_id'),
+            'title': chunks[i].get('title', ''),
+            'category': chunks[i].get('category', ''),
+            'chunk_index': chunks[i].get('chunk_index'),
+            'content': chunks[i].get('content', ''),
+            'score': round(score, 4)
+        } for i, score in best]
+
+
+# Global knowledge index for server-side answers
+knowledge_index = KnowledgeIndex(KNOWLEDGE_INDEX_FILE)
+
+
 # ============================================
 # UTILITY FUNCTIONS
 # ============================================
 
+def is_bounded_int(value, low: int, high: int) -> bool:
+    """Whether a JSON value is an integer in [low, high] (booleans are not)."""
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+
 def filename_to_title(filename: str) -> str:
     """Convert filename to human-readable title."""
     name = Path(filename).stem
@@ -294,18 +734,112 @@ def get_content_hash() -> str:
 
 def save_metadata(resources: list) -> None:
     """Save resources to metadata.json."""
+    resource_catalog.update(resources)
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
     with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
         json.dump(resources, f, indent=4, ensure_ascii=False)
 
 
-def update_metadata() -> bool:
-    """Scan and update metadata."""
+def build_catalog(compute_missing: bool = False) -> list:
+    """Scan content and attach cached size, page count and thumbnails."""
     resources = scan_content_directory()
-    save_metadata(resources)
+    if ENRICHMENT_AVAILABLE:
+        try:
+            enrich_resources(resources, compute_missing=compute_missing)
+        except Exception as e:
+            print(f"   ⚠️  Enrichment error: {e}")
+    return resources
+
+
+# ============================================
+# BACKGROUND JOBS
+# ============================================
+
+# Global job scheduler for compression, embeddings and thumbnails
+job_scheduler = JobScheduler() if JOB_QUEUE_AVAILABLE else None
+
+# Global process pool; jobs hand CPU-heavy work to it so the GIL stays free
+worker_pool = WorkerPool(workers=PDF_WORKERS, nice=PDF_WORKER_NICE,
+                         memory_limit_mb=PDF_TASK_MEMORY_MB,
+                         time_limit=PDF_TASK_TIME_LIMIT) if WORKER_POOL_AVAILABLE else None
+
+
+def submit_job(key: str, func, *args, priority: int = PRIORITY_BACKGROUND, description: str = '') -> bool:
+    """Queue a background job; returns False when there is no job queue."""
+    if job_scheduler is None:
+        return False
+    job_scheduler.submit(key, func, *args, priority=priority, description=description)
     return True
 
 
+def run_in_worker(func, *args, **kwargs):
+    """Run func in the worker pool, or in this process without one."""
+    if worker_pool is None:
+        return func(*args, **kwargs)
+    return worker_pool.run(func, *args, **kwargs)
+
+
+def schedule_embeddings(priority: int = PRIORITY_BACKGROUND) -> None:
+    """Queue an embeddings update (one build at a time, repeats coalesced)."""
+    if EMBEDDINGS_AVAILABLE:
+        submit_job('embeddings', run_embeddings_job,
+                   priority=priority, description='Update embeddings')
+
+
+def run_embeddings_job() -> None:
+    """Update embeddings for new or changed PDFs in a worker process.
+
+    The worker writes a new segment, which is searchable as soon as this
+    process reloads the manifest. Segment merging runs afterwards in the
+    same job, so it never races a build. PDFs are extracted serially
+    inside the worker, so the whole build stays within its memory limit.
+    """
+    new_embeddings = run_in_worker(build_embeddings, False, workers=1)
+    vector_store.load()
+    if new_embeddings > 0:
+        print(f"   ✅ Created {new_embeddings} new embeddings")
+    
+    if vector_store.needs_merge():
+        merged = run_in_worker(merge_embeddings)
+        vector_store.load()
+        print(f"   🧩 Merged {merged} index segment(s)")
+
+
+def run_compress_job(pdf_path: Path, min_size_mb: float, priority: int) -> None:
+    """Compress a PDF if it is large enough, then refresh its embeddings."""
+    if COMPRESSOR_AVAILABLE and pdf_path.exists():
+        size_mb = pdf_path.stat().st_size / (1024 * 1024)
+        if size_mb > min_size_mb:
+            print(f"   🗜️  Compressing {pdf_path.name}...")
+            result = run_in_worker(compress_pdf, pdf_path)
+            if not result.get('success'):
+                raise RuntimeError(result.get('error', 'Compression failed'))
+            if result.get('reduction_percent', 0) > 0:
+                print(f"      ✅ Reduced by {result['reduction_percent']}%")
+    
+    schedule_embeddings(priority)
+
+
+def schedule_pdf_processing(pdf_path: Path, min_size_mb: float,
+                            priority: int = PRIORITY_BACKGROUND) -> None:
+    """Queue compression (if needed) followed by an embeddings update."""
+    submit_job(f"compress:{pdf_path}", run_compress_job, pdf_path, min_size_mb, priority,
+               priority=priority, description=f"Process {pdf_path.name}")
+
+
+def run_page_cache_job(pdf_path: Path, count: int) -> None:
+    """Extract the first `count` pages of a PDF into the page cache."""
+    run_in_worker(cache_pages, pdf_path, count)
+
+
+def run_enrichment_job(resources: list) -> None:
+    """Compute size, page count and thumbnails for new files in a worker process."""
+    computed = run_in_worker(enrich_resources, resources, compute_missing=True)
+    if computed > 0:
+        save_metadata(build_catalog())
+        print(f"   🖼️  Enriched {computed} new file(s)")
+
+
 # ============================================
 # FILE WATCHER
 # ============================================
@@ -325,9 +859,10 @@ class FileWatcher(threading.Thread):
         
         # Initial scan
         self.last_hash = get_content_hash()
-        update_metadata()
-        resources = scan_content_directory()
+        resources = build_catalog()
+        save_metadata(resources)
         print(f"📊 Initial scan: {len(resources)} resource(s) found")
+        self._enrich(resources)
         
         while self.running:
             time.sleep(WATCH_INTERVAL)
@@ -339,7 +874,7 @@ class FileWatcher(threading.Thread):
                     timestamp = datetime.now().strftime("%H:%M:%S")
                     print(f"\n🔄 [{timestamp}] Change detected! Updating metadata...")
                     
-                    resources = scan_content_directory()
+                    resources = build_catalog()
                     save_metadata(resources)
                     
                     print(f"   ✅ Updated: {len(resources)} resource(s) indexed")
@@ -347,7 +882,9 @@ class FileWatcher(threading.Thread):
                     for res in resources:
                         print(f"      • {res['title']} ({res['format']})")
                     
-                    # Compress and update embeddings in background
+                    self._enrich(resources)
+                    
+                    # Compress and update embeddings on the job queue
                     if COMPRESSOR_AVAILABLE:
                         self._compress_pdfs(resources)
                     
@@ -357,34 +894,23 @@ class FileWatcher(threading.Thread):
             except Exception as e:
                 print(f"⚠️  Watcher error (non-fatal): {e}")
     
+    def _enrich(self, resources):
+        """Queue size, page count and thumbnail computation for new files."""
+        if ENRICHMENT_AVAILABLE:
+            submit_job('enrich', run_enrichment_job, resources, description='Enrich catalog')
+    
     def _compress_pdfs(self, resources):
-        """Compress large PDFs."""
-        try:
-            pdf_files = [r for r in resources if r['format'] == 'pdf']
-            if pdf_files:
-                for pdf_res in pdf_files:
-                    pdf_path = SCRIPT_DIR / pdf_res['filepath']
-                    if pdf_path.exists():
-                        size_mb = pdf_path.stat().st_size / (1024 * 1024)
-                        if size_mb > 10:
-                            print(f"   🗜️  Compressing {pdf_res['title']}...")
-                            result = compress_pdf(pdf_path)
-                            if result.get('success') and result.get('reduction_percent', 0) > 0:
-                                print(f"      ✅ Reduced by {result['reduction_percent']}%")
-        except Exception as e:
-            print(f"   ⚠️  Compression error: {e}")
+        """Queue compression of large PDFs."""
+        for pdf_res in resources:
+            if pdf_res['format'] == 'pdf':
+                schedule_pdf_processing(SCRIPT_DIR / pdf_res['filepath'], min_size_mb=10)
     
     def _update_embeddings(self, resources):
-        """Update embeddings for PDFs."""
-        try:
-            pdf_count = sum(1 for r in resources if r['format'] == 'pdf')
-            if pdf_count > 0:
-                print(f"   🔄 Updating embeddings for {pdf_count} PDF(s)...")
-                new_embeddings = build_embeddings(force=False)
-                if new_embeddings > 0:
-                    print(f"   ✅ Created {new_embeddings} new embeddings")
-        except Exception as e:
-            print(f"   ⚠️  Embedding error: {e}")
+        """Queue an embeddings update for PDFs."""
+        pdf_count = sum(1 for r in resources if r['format'] == 'pdf')
+        if pdf_count > 0:
+            print(f"   🔄 Queued embeddings update for {pdf_count} PDF(s)")
+            schedule_embeddings()
     
     def stop(self):
         self.running = False
@@ -424,10 +950,37 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
             user_tracker.record_activity(client_ip, user_agent, self.path)
             
             # Handle API endpoints
+            parsed = urlsplit(self.path)
+            if parsed.path == '/api/resources':
+                self.handle_get_resources(parse_qs(parsed.query))
+                return
+            
+            if parsed.path == '/api/metadata':
+                self.handle_get_metadata(parse_qs(parsed.query))
+                return
+            
+            page_match = PAGE_TEXT_ROUTE.match(parsed.path)
+            if page_match:
+                self.handle_get_page_text(int(page_match.group(1)), int(page_match.group(2)))
+                return
+            
+            related_match = RELATED_ROUTE.match(parsed.path)
+            if related_match:
+                self.handle_get_related(int(related_match.group(1)))
+                return
+            
             if self.path == '/api/stats':
                 self.handle_admin_stats()
                 return
             
+            if self.path == '/api/jobs':
+                self.send_json_response(200, {
+                    'success': True,
+                    **(job_scheduler.get_stats() if job_scheduler else {}),
+                    'process_pool': worker_pool.get_stats() if worker_pool else None
+                })
+                return
+            
             if self.path == '/api/courses':
                 self.handle_get_courses()
                 return
@@ -450,6 +1003,10 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
                 self.handle_upload()
             elif self.path == '/api/search':
                 self.handle_semantic_search()
+            elif self.path == '/api/search/batch':
+                self.handle_batch_search()
+            elif self.path == '/api/ask':
+                self.handle_ask()
             elif self.path == '/api/heartbeat':
                 self.handle_heartbeat()
             elif self.path == '/api/courses':
@@ -465,10 +1022,133 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
         """Return admin statistics."""
         try:
             stats = user_tracker.get_stats()
+            if EMBEDDINGS_AVAILABLE:
+                stats['search_cache'] = vector_store.query_cache.get_stats()
             self.send_json_response(200, stats)
         except Exception as e:
             self.send_json_response(500, {'error': str(e)})
     
+    def handle_get_resources(self, params):
+        """Return one filtered page of the catalog."""
+        try:
+            def param(name):
+                values = params.get(name)
+                return values[0].strip() if values and values[0].strip() else None
+            
+            try:
+                limit = int(param('limit') or DEFAULT_PAGE_SIZE)
+                cursor = param('cursor')
+                cursor = int(cursor) if cursor is not None else None
+            except ValueError:
+                self.send_json_response(400, {'error': 'Invalid limit or cursor'})
+                return
+            
+            fields = param('fields')
+            page = resource_catalog.query(
+                category=param('category'),
+                file_format=param('format'),
+                prefix=param('prefix'),
+                cursor=cursor,
+                limit=max(1, min(limit, MAX_PAGE_SIZE)),
+                fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None
+            )
+            self.send_json_response(200, {'success': True, **page})
+        except Exception as e:
+            self.send_json_response(500, {'error': str(e)})
+    
+    def handle_get_metadata(self, params):
+        """Return catalog changes since a version, or the full catalog."""
+        try:
+            since = params.get('since', [''])[0].strip()
+            if not since:
+                version, resources = resource_catalog.snapshot()
+                self.send_json_response(200, {'success': True, 'version': version, 'resources': resources})
+                return
+            
+            try:
+                since = int(since)
+            except ValueError:
+                self.send_json_response(400, {'error': 'Invalid version'})
+                return
+            
+            version, changes = resource_catalog.changes_since(since)
+            if changes is None:
+                self.send_json_response(200, {'success': True, 'version': version, 'full_reload': True})
+            else:
+                self.send_json_response(200, {'success': True, 'version': version, 'changes': changes})
+        except Exception as e:
+            self.send_json_response(500, {'error': str(e)})
+    
+    def handle_get_page_text(self, resource_id, page):
+        """Return the text of one PDF page (1-based) from the shared page cache.
+        
+        A page that isn't cached yet is queued for extraction and answered
+        with 202; the client retries after `retry_after` seconds.
+        """
+        try:
+            resource = resource_catalog.get(resource_id)
+            if resource is None or resource.get('format') != 'pdf':
+                self.send_json_response(404, {'error': 'PDF not found'})
+                return
+            
+            if not PAGE_CACHE_AVAILABLE:
+                self.send_json_response(503, {'error': 'Page text not available'})
+                return
+            
+            pdf_path = SCRIPT_DIR / resource['filepath']
+            page_count, text = cached_page(pdf_path, page - 1)
+            if text is None:
+                if (page < 1 or (page_count is not None and page > page_count)
+                        or not PAGE_EXTRACTION_AVAILABLE or not pdf_path.exists()):
+                    self.send_json_response(404, {'error': 'Page not found'})
+                    return
+                # Extraction runs as a background job, never on this thread
+                if not submit_job(f"pages:{pdf_path}", run_page_cache_job, pdf_path, page + PAGE_PREFETCH,
+                                  priority=PRIORITY_UPLOAD, description=f"Extract pages of {pdf_path.name}"):
+                    self.send_json_response(503, {'error': 'Page extraction not available'})
+                    return
+                self.send_json_response(202, {
+                    'success': False,
+                    'status': 'extracting',
+                    'resource_id': resource_id,
+                    'page': page,
+                    'retry_after': PAGE_RETRY_AFTER
+                })
+                return
+            
+            self.send_json_response(200, {
+                'success': True,
+                'resource_id': resource_id,
+                'page': page,
+                'page_count': page_count,
+                'text': text
+            })
+        except Exception as e:
+            self.send_json_response(500, {'error': str(e)})
+    
+    def handle_get_related(self, resource_id):
+        """Return the resources most similar to one resource."""
+        try:
+            if resource_catalog.get(resource_id) is None:
+                self.send_json_response(404, {'error': 'Resource not found'})
+                return
+            
+            related = []
+            for other_id, score in related_graph.get(resource_id):
+                resource = resource_catalog.get(int(other_id))
+                if resource is not None:
+                    resource['score'] = score
+                    related.append(resource)
+            
+            self.send_json_response(200, {
+                'success': True,
+                'resource_id': resource_id,
+                'related': related,
+                'count': len(related)
+            })
+        except Exception as e:
+            self.send_json_response(500, {'error': str(e)})
+    
     def handle_heartbeat(self):
         """Handle heartbeat for keeping session alive."""
         try:
@@ -517,26 +1197,156 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
             body = self.rfile.read(content_length)
             data = json.loads(body.decode('utf-8'))
             
-            query = data.get('query', '').strip()
-            top_k = data.get('top_k', 5)
-            
+            query = data.get('query', '')
+            query = query.strip() if isinstance(query, str) else ''
             if not query:
                 self.send_json_response(400, {'error': 'Query is required'})
                 return
             
+            options, error = self._search_options(data)
+            if error:
+                self.send_json_response(400, {'error': error})
+                return
+            
             if not EMBEDDINGS_AVAILABLE:
                 self.send_json_response(503, {'error': 'Vector search not available'})
                 return
             
-            results = vector_store.search(query, top_k=top_k)
+            results = vector_store.search(query, **options)
             
             self.send_json_response(200, {
                 'success': True,
                 'query': query,
+                'mode': options['mode'],
+                'results': results,
+                'count': len(results)
+            })
+            
+        except json.JSONDecodeError:
+            self.send_json_response(400, {'error': 'Invalid JSON'})
+        except Exception as e:
+            self.send_json_response(500, {'error': 'Search failed'})
+    
+    def handle_ask(self):
+        """Answer a question with the best matching knowledge index chunks."""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            data = json.loads(body.decode('utf-8'))
+            
+            question = data.get('question', data.get('query', ''))
+            top_k = data.get('top_k', 5)
+            category = data.get('category')
+            
+            if not isinstance(question, str) or not question.strip():
+                self.send_json_response(400, {'error': 'Question is required'})
+                return
+            
+            if not is_bounded_int(top_k, 1, MAX_ASK_RESULTS):
+                self.send_json_response(400, {'error': f'top_k must be between 1 and {MAX_ASK_RESULTS}'})
+                return
+            
+            if category is not None and not isinstance(category, str):
+                self.send_json_response(400, {'error': 'category must be a string'})
+                return
+            
+            if not KNOWLEDGE_INDEX_AVAILABLE:
+                self.send_json_response(503, {'error': 'Question answering not available'})
+                return
+            
+            results = knowledge_index.ask(question.strip(), top_k, category)
+            titles = list(dict.fromkeys(result['title'] for result in results))
+            
+            self.send_json_response(200, {
+                'success': True,
+                'question': question.strip(),
                 'results': results,
+                'titles': titles,
                 'count': len(results)
             })
             
+        except json.JSONDecodeError:
+            self.send_json_response(400, {'error': 'Invalid JSON'})
+        except Exception as e:
+            self.send_json_response(500, {'error': 'Ask failed'})
+    
+    def _search_options(self, data):
+        """Keyword arguments for vector_store.search() and search_many() from a
+        request body, as (options, None), or (None, error) if one is invalid."""
+        top_k = data.get('top_k', 5)
+        mode = data.get('mode', 'tfidf')
+        probes = data.get('probes', ANN_PROBES)
+        
+        if mode not in SEARCH_MODES:
+            names = [f"'{name}'" for name in SEARCH_MODES]
+            return None, f"mode must be {', '.join(names[:-1])} or {names[-1]}"
+        
+        if not is_bounded_int(top_k, 1, MAX_SEARCH_RESULTS):
+            return None, f'top_k must be between 1 and {MAX_SEARCH_RESULTS}'
+        
+        if not is_bounded_int(probes, 1, MAX_ANN_PROBES):
+            return None, f'probes must be between 1 and {MAX_ANN_PROBES}'
+        
+        filters = self._search_filters(data)
+        if filters is None:
+            return None, 'category, resource_id and format must be strings or ids'
+        
+        return {'top_k': top_k, 'mode': mode, 'probes': probes, **filters}, None
+    
+    def _search_filters(self, data):
+        """Search filters from a request body, or None if one is malformed."""
+        filters = {}
+        for field, argument in (('category', 'category'), ('resource_id', 'resource_id'),
+                                ('format', 'file_format')):
+            value = data.get(field)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (str, int)):
+                return None
+            filters[argument] = str(value)
+        return filters
+    
+    def handle_batch_search(self):
+        """Handle a batch of semantic search queries scored in one pass."""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            data = json.loads(body.decode('utf-8'))
+            
+            queries = data.get('queries')
+            if not isinstance(queries, list) or not queries:
+                self.send_json_response(400, {'error': 'queries must be a non-empty list'})
+                return
+            
+            if len(queries) > MAX_BATCH_QUERIES:
+                self.send_json_response(400, {'error': f'At most {MAX_BATCH_QUERIES} queries per batch'})
+                return
+            
+            if not all(isinstance(query, str) and query.strip() for query in queries):
+                self.send_json_response(400, {'error': 'Every query must be a non-empty string'})
+                return
+            
+            options, error = self._search_options(data)
+            if error:
+                self.send_json_response(400, {'error': error})
+                return
+            
+            if not EMBEDDINGS_AVAILABLE:
+                self.send_json_response(503, {'error': 'Vector search not available'})
+                return
+            
+            queries = [query.strip() for query in queries]
+            batch = vector_store.search_many(queries, **options)
+            
+            self.send_json_response(200, {
+                'success': True,
+                'mode': options['mode'],
+                'results': [
+                    {'query': query, 'results': results, 'count': len(results)}
+                    for query, results in zip(queries, batch)
+                ]
+            })
+            
         except json.JSONDecodeError:
             self.send_json_response(400, {'error': 'Invalid JSON'})
         except Exception as e:
@@ -611,11 +1421,11 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
             print(f"\n📤 [{timestamp}] File uploaded: {new_filename}")
             print(f"   Category: {category}, Size: {saved_size / 1024:.1f} KB")
             
-            # Background processing for PDF
+            # Background processing for PDF (ahead of watcher work)
             if file_ext == 'pdf':
-                threading.Thread(target=self._process_pdf, args=(file_path,), daemon=True).start()
+                schedule_pdf_processing(file_path, min_size_mb=5, priority=PRIORITY_UPLOAD)
             
-            resources = scan_content_directory()
+            resources = build_catalog()
             save_metadata(resources)
             
             self.send_json_response(200, {
@@ -628,19 +1438,6 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_json_response(500, {'error': 'Upload failed'})
     
-    def _process_pdf(self, file_path):
-        """Process PDF in background."""
-        try:
-            if COMPRESSOR_AVAILABLE:
-                size_mb = file_path.stat().st_size / (1024 * 1024)
-                if size_mb > 5:
-                    compress_pdf(file_path)
-            
-            if EMBEDDINGS_AVAILABLE:
-                build_embeddings(force=False)
-        except Exception as e:
-            print(f"⚠️  PDF processing error: {e}")
-    
     def send_json_response(self, status, data):
         """Send JSON response."""
         try:
@@ -675,6 +1472,9 @@ class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
         # Cache PDFs/videos for 1 hour
         elif path.endswith(('.pdf', '.mp4', '.webm')):
             self.send_header('Cache-Control', 'public, max-age=3600')
+        # Content-hashed knowledge shards can be cached for good
+        elif KNOWLEDGE_SHARD_FILE.search(path):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
         # Don't cache HTML and JSON (dynamic content)
         elif path.endswith(('.html', '.json')):
             self.send_header('Cache-Control', 'no-cache, must-revalidate')
@@ -736,6 +1536,23 @@ def main():
     print(f"📄 Metadata file: {OUTPUT_FILE}")
     print()
     
+    # Seed the catalog so resource ids stay stable across restarts
+    if OUTPUT_FILE.exists():
+        try:
+            with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
+                resource_catalog.seed(json.load(f))
+        except (json.JSONDecodeError, OSError, KeyError, TypeError):
+            pass
+    
+    # Warm up the vector index off the main thread; searches return no
+    # results until its first snapshot is published
+    if EMBEDDINGS_AVAILABLE:
+        threading.Thread(target=vector_store.load, name='vector-warmup', daemon=True).start()
+    
+    # Start background job workers
+    if job_scheduler is not None:
+        job_scheduler.start()
+    
     # Start file watcher
     watcher = FileWatcher()
     watcher.start()
@@ -765,8 +1582,15 @@ def main():
             print("   • User tracking (admin dashboard)")
             print(f"   • PDF compression: {'✅' if COMPRESSOR_AVAILABLE else '❌'}")
             print(f"   • Vector search: {'✅' if EMBEDDINGS_AVAILABLE else '❌'}")
+            print(f"   • Thumbnails: {'✅' if ENRICHMENT_AVAILABLE else '❌'}")
+            print(f"   • Background jobs: {'✅' if JOB_QUEUE_AVAILABLE else '❌'}")
+            print(f"   • Server-side answers: {'✅' if KNOWLEDGE_INDEX_AVAILABLE else '❌'}")
             print()
             print("📊 Admin stats API: GET /api/stats")
+            print("💬 Ask API: POST /api/ask {question, top_k}")
+            print("📚 Catalog API: GET /api/resources?category=&format=&prefix=&cursor=&limit=&fields=")
+            print("🔁 Catalog deltas: GET /api/metadata?since=<version>")
+            print("⚙️  Background jobs: GET /api/jobs")
             print()
             print("Press Ctrl+C to stop the server")
             print("=" * 50)
@@ -776,6 +1600,10 @@ def main():
     except KeyboardInterrupt:
         print("\n\n👋 Shutting down server...")
         watcher.stop()
+        if job_scheduler is not None:
+            job_scheduler.stop()
+        if worker_pool is not None:
+            worker_pool.shutdown()
         stats = user_tracker.get_stats()
         print(f"📊 Final stats: {stats['total_requests']} requests, {stats['total_unique_users']} unique users")
         print("✅ Server stopped. Goodbye!")
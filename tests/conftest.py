@@ -0,0 +1,58 @@
+"""Shared fixtures: make server.py and scripts/ importable from the tests."""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'scripts'))
+
+import json
+import shutil
+
+import pytest
+
+CONTENT_DIR = ROOT / 'content'
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """Point the vector store and page cache at a scratch directory."""
+    import embeddings
+    import page_cache
+
+    vectors = tmp_path / 'vectors'
+    monkeypatch.setattr(embeddings, 'VECTORS_DIR', vectors)
+    monkeypatch.setattr(embeddings, 'SEGMENTS_DIR', vectors / 'segments')
+    monkeypatch.setattr(embeddings, 'VECTOR_MANIFEST_FILE', vectors / 'manifest.json')
+    monkeypatch.setattr(embeddings, 'VECTOR_INDEX_FILE', vectors / 'index.json')
+    monkeypatch.setattr(embeddings, 'VECTOR_BINARY_FILE', vectors / 'index.bin')
+    monkeypatch.setattr(embeddings, 'RELATED_FILE', vectors / 'related.json')
+    monkeypatch.setattr(page_cache, 'PAGE_CACHE_DIR', tmp_path / 'page_cache')
+    return vectors
+
+
+@pytest.fixture
+def pdf_library(tmp_path, monkeypatch):
+    """Copy PDFs from content/ into a scratch library; returns a function
+    that writes metadata.json for the given (id, file name) pairs. Files
+    already in the library (e.g. copies made by a test) are used as is."""
+    import embeddings
+
+    library = tmp_path / 'content'
+    library.mkdir()
+    metadata_file = tmp_path / 'metadata.json'
+    monkeypatch.setattr(embeddings, 'METADATA_FILE', metadata_file)
+
+    def write(resources):
+        entries = []
+        for resource_id, name in resources:
+            target = library / name
+            if not target.exists():
+                shutil.copy(next(CONTENT_DIR.rglob(name)), target)
+            entries.append({'id': resource_id, 'title': target.stem, 'category': 'textbooks',
+                            'format': 'pdf', 'filepath': str(target)})
+        metadata_file.write_text(json.dumps(entries), encoding='utf-8')
+        return library
+
+    return write
@@ -0,0 +1,441 @@
+"""Vector store tests on scratch indexes (see the index_dir fixture)."""
+
+import importlib.util
+import math
+import random
+import shutil
+import threading
+from collections import Counter, defaultdict
+
+import pytest
+
+import embeddings
+from benchmark_index import SyntheticCorpus, synthetic_words
+from embeddings import ANN_PROBES, BM25Index, IndexSnapshot, VectorStore, load_manifest
+
+requires_pymupdf = pytest.mark.skipif(importlib.util.find_spec('fitz') is None,
+                                      reason='PyMuPDF is not installed')
+requires_numpy = pytest.mark.skipif(not embeddings.NUMPY_AVAILABLE, reason='NumPy is not installed')
+
+
+def random_documents(n_docs, n_terms, seed=7):
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(n_docs):
+        terms = sorted(rng.sample(range(n_terms), rng.randint(1, 12)))
+        documents.append({'terms': terms, 'counts': [rng.randint(1, 5) for _ in terms]})
+    return documents
+
+
+@requires_numpy
+def test_bm25_numpy_load_matches_python(monkeypatch):
+    documents = random_documents(300, 80)
+    vectorised = BM25Index()
+    vectorised.build(documents)
+    monkeypatch.setattr(embeddings, 'NUMPY_AVAILABLE', False)
+    python = BM25Index()
+    python.build(documents)
+
+    assert vectorised.idf == pytest.approx(python.idf)
+    assert vectorised.max_scores == pytest.approx(python.max_scores)
+    assert vectorised.length_norms == pytest.approx(python.length_norms)
+    rng = random.Random(3)
+    for _ in range(20):
+        query = rng.sample(range(90), 4)  # includes ids with no postings
+        expected = python.search(query, 10)
+        found = vectorised.search(query, 10)
+        assert [row for row, _ in found] == [row for row, _ in expected]
+        assert [score for _, score in found] == pytest.approx([score for _, score in expected])
+
+
+@requires_numpy
+@pytest.mark.parametrize('mode', ['tfidf', 'bm25'])
+def test_numpy_and_python_snapshots_rank_alike(index_dir, monkeypatch, mode):
+    corpus = SyntheticCorpus()
+    vectorised = VectorStore()
+    vectorised.commit_changes(load_manifest(), [chunk for _ in range(10) for chunk in corpus.pdf()], set())
+    queries = [' '.join(corpus.pdf()[0]['content'].split()[:6]) for _ in range(10)]
+    expected = [vectorised.search(query, 5, mode=mode) for query in queries]
+    assert all(expected)
+
+    monkeypatch.setattr(embeddings, 'NUMPY_AVAILABLE', False)
+    python = VectorStore()
+    assert python.load()
+    for query, want in zip(queries, expected):
+        found = python.search(query, 5, mode=mode)
+        assert [r['id'] for r in found] == [r['id'] for r in want]
+        assert [r['score'] for r in found] == pytest.approx([r['score'] for r in want], abs=1e-3)
+
+
+@requires_numpy
+def test_snapshots_map_the_view_file_instead_of_combining_segments(index_dir, monkeypatch):
+    corpus = SyntheticCorpus()
+    pdfs = [corpus.pdf() for _ in range(10)]
+    writer = VectorStore()
+    writer.commit_changes(load_manifest(), [chunk for pdf in pdfs[:6] for chunk in pdf], set())
+    writer.commit_changes(load_manifest(), [chunk for pdf in pdfs[6:] for chunk in pdf],
+                          {pdfs[1][0]['source_path']})
+    manifest = load_manifest()
+    assert sorted(path.name for path in (index_dir / 'segments').glob('view_*.bin')) == [manifest['view']['name']]
+
+    with monkeypatch.context() as patch:
+        patch.setattr(embeddings, 'combine_segments', refuse)
+        mapped = IndexSnapshot(manifest)
+    assert mapped._view is not None and not mapped._data.flags.owndata
+    combined = IndexSnapshot({key: value for key, value in manifest.items() if key != 'view'})
+    assert combined._view is None and combined.n_docs == mapped.n_docs == 9 * len(pdfs[0])
+
+    for pdf in pdfs:
+        tokens = embeddings.tokenize(' '.join(pdf[0]['content'].split()[:6]))
+        terms, weights = embeddings.create_tfidf_vector(tokens, mapped.idf, mapped.term_index)
+        for mode in ('tfidf', 'bm25'):
+            want = combined.results(combined.top_k(terms, weights, 5, mode, ANN_PROBES))
+            found = mapped.results(mapped.top_k(terms, weights, 5, mode, ANN_PROBES))
+            assert found == want
+            assert all(not result['id'].startswith(pdfs[1][0]['id'].rsplit('_', 1)[0] + '_') for result in found)
+
+
+def refuse(*args, **kwargs):
+    raise AssertionError('IVF centroids or lists were recomputed')
+
+
+@requires_numpy
+def test_ivf_lists_are_persisted_and_reused(index_dir, monkeypatch):
+    monkeypatch.setattr(embeddings, 'ANN_MIN_DOCS', 100)
+    corpus = SyntheticCorpus()
+    store = VectorStore()
+    store.commit_changes(load_manifest(), [chunk for _ in range(10) for chunk in corpus.pdf()], set())
+    model = load_manifest()['ivf']
+    assert model['lists'] == len(store.snapshot.ivf.centroids)
+
+    # A small addition is filed under the existing centroids
+    monkeypatch.setattr(embeddings, 'train_centroids', refuse)
+    store.commit_changes(load_manifest(), corpus.pdf(), set())
+    manifest = load_manifest()
+    assert manifest['ivf'] == model
+    assert all((index_dir / 'segments' / entry['ivf_lists']).exists() for entry in manifest['segments'])
+
+    # Loading only reads the stored lists
+    monkeypatch.setattr(embeddings.SegmentSketcher, 'nearest_lists', refuse)
+    reader = VectorStore()
+    assert reader.load()
+    ivf = reader.snapshot.ivf
+    assert len(ivf.list_rows) == reader.snapshot.n_docs
+    assert len(ivf.candidates([0], [1.0], model['lists'])) == reader.snapshot.n_docs
+    query = corpus.pdf()[0]['content']
+    results = reader.search(query, 5, mode='ann', probes=model['lists'])
+    assert [r['id'] for r in results] == [r['id'] for r in reader.search(query, 5)]
+
+
+@requires_numpy
+def test_ivf_is_retrained_once_the_index_grows(index_dir, monkeypatch):
+    monkeypatch.setattr(embeddings, 'ANN_MIN_DOCS', 100)
+    corpus = SyntheticCorpus()
+    store = VectorStore()
+    store.commit_changes(load_manifest(), [chunk for _ in range(5) for chunk in corpus.pdf()], set())
+    old = load_manifest()['ivf']
+
+    store.commit_changes(load_manifest(), [chunk for _ in range(20) for chunk in corpus.pdf()], set())
+    manifest = load_manifest()
+    assert manifest['ivf']['name'] != old['name'] and manifest['ivf']['lists'] > old['lists']
+    assert not (index_dir / 'segments' / old['name']).exists()
+    assert sorted(path.name for path in (index_dir / 'segments').glob('*.npy')) == sorted(
+        [manifest['ivf']['name']] + [entry['ivf_lists'] for entry in manifest['segments']])
+
+
+def library_chunks(n_resources=8, chunks_per_resource=3, seed=11):
+    """Chunks of a few small resources, each drawing on its own 15 of 40 words."""
+    rng = random.Random(seed)
+    words = synthetic_words(40)
+    chunks = []
+    for resource in range(1, n_resources + 1):
+        topic = rng.sample(words, 15)
+        for i in range(chunks_per_resource):
+            tokens = rng.choices(topic, k=30)
+            chunks.append({'id': f"{resource}_{i}", 'title': f"Book {resource}", 'category': 'textbooks',
+                           'source_path': f"/library/book-{resource}.pdf", 'content': ' '.join(tokens),
+                           'token_counts': Counter(tokens), 'length': len(tokens)})
+    return chunks
+
+
+def brute_force_related(chunks, idf, top_n):
+    """Cosine of each pair of resources' summed unit TF-IDF chunk vectors."""
+    sums = defaultdict(lambda: defaultdict(float))
+    for chunk in chunks:
+        weights = {word: count * idf[word] for word, count in chunk['token_counts'].items() if word in idf}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        for word, weight in weights.items():
+            sums[chunk['id'].rsplit('_', 1)[0]][word] += weight / norm
+    vectors = {}
+    for resource_id, vector in sums.items():
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors[resource_id] = {word: weight / norm for word, weight in vector.items()}
+
+    related = {}
+    for resource_id, vector in vectors.items():
+        scores = [(other, sum(weight * other_vector.get(word, 0.0) for word, weight in vector.items()))
+                  for other, other_vector in vectors.items() if other != resource_id]
+        scores.sort(key=lambda item: item[1], reverse=True)
+        related[resource_id] = [(other, score) for other, score in scores[:top_n]
+                                if score > embeddings.SCORE_THRESHOLD]
+    return related
+
+
+@pytest.mark.parametrize('use_numpy', [
+    pytest.param(True, marks=requires_numpy),
+    False,
+])
+def test_related_resources_match_brute_force_cosine(index_dir, monkeypatch, use_numpy):
+    monkeypatch.setattr(embeddings, 'VECTOR_DTYPE', 'float32')
+    # Small blocks, so the product runs over several of them
+    monkeypatch.setattr(embeddings, 'RELATED_BLOCK_ROWS', 3)
+    monkeypatch.setattr(embeddings, 'RELATED_BLOCK_ENTRIES', 60)
+    monkeypatch.setattr(embeddings, 'NUMPY_AVAILABLE', embeddings.NUMPY_AVAILABLE and use_numpy)
+    chunks = library_chunks()
+    store = VectorStore()
+    store.commit_changes(load_manifest(), [dict(chunk) for chunk in chunks], set())
+
+    related = store.snapshot.related_resources(top_n=4)
+    expected = brute_force_related(chunks, store.snapshot.idf, 4)
+    assert set(related) == set(expected) == {str(resource) for resource in range(1, 9)}
+    for resource_id, want in expected.items():
+        assert [other for other, _ in related[resource_id]] == [other for other, _ in want]
+        assert [score for _, score in related[resource_id]] == pytest.approx([score for _, score in want], abs=1e-3)
+
+
+@requires_pymupdf
+def test_build_index_survives_a_related_graph_failure(index_dir, pdf_library, monkeypatch, capsys):
+    def fail(self, top_n=embeddings.RELATED_TOP_N):
+        raise MemoryError()
+
+    pdf_library([(1, 'cv.pdf')])
+    monkeypatch.setattr(VectorStore, 'build_related', fail)
+    store = VectorStore()
+    assert store.build_index(workers=1) > 0
+    assert 'Related resources not updated' in capsys.readouterr().out
+    assert not embeddings.RELATED_FILE.exists()
+    assert VectorStore().load() and load_manifest()['total_docs'] == store.snapshot.n_docs > 0
+
+
+@requires_pymupdf
+def test_files_without_text_are_not_extracted_again(index_dir, pdf_library, monkeypatch):
+    library = pdf_library([(1, 'cv.pdf'), (2, 'grade-12.pdf')])
+    store = VectorStore()
+    assert store.build_index(workers=1) > 0
+    assert str(library / 'grade-12.pdf') in load_manifest()['file_hashes']
+
+    extracted = []
+    original = embeddings.extract_chunks
+    monkeypatch.setattr(embeddings, 'extract_chunks',
+                        lambda resource, path: extracted.append(path) or original(resource, path))
+    assert VectorStore().build_index(workers=1) == 0
+    assert extracted == []
+
+
+@requires_pymupdf
+def test_build_embeddings_extracts_serially_and_releases_the_snapshot(index_dir, pdf_library, monkeypatch):
+    pdf_library([(1, 'cv.pdf'), (2, 'Project Proposal1.pdf')])
+    store = VectorStore()
+    monkeypatch.setattr(embeddings, 'vector_store', store)
+    monkeypatch.setattr(embeddings, 'ProcessPoolExecutor', None)  # any pool would fail
+
+    assert embeddings.build_embeddings(workers=1) > 0
+    assert not store.loaded and store.snapshot.segments == []
+
+    reader = VectorStore()
+    assert reader.load() and reader.snapshot.n_docs > 0
+
+
+@requires_pymupdf
+def test_reuploaded_pdf_is_deduplicated_against_earlier_builds(index_dir, pdf_library):
+    library = pdf_library([(1, 'cv.pdf')])
+    store = VectorStore()
+    indexed = store.build_index(workers=1)
+    assert indexed > 0
+
+    shutil.copy(library / 'cv.pdf', library / 'cv-copy.pdf')
+    pdf_library([(1, 'cv.pdf'), (2, 'cv-copy.pdf')])
+    assert VectorStore().build_index(workers=1) == 0
+
+    manifest = load_manifest()
+    copies = manifest['duplicates'][str(library / 'cv-copy.pdf')]
+    assert len(copies) == indexed
+    assert {(path, original) for _, path, original in copies} == {
+        (str(library / 'cv.pdf'), f'1_{i}') for i in range(indexed)}
+    assert str(library / 'cv-copy.pdf') in manifest['file_hashes']
+
+    # Removing the original re-indexes the copy rather than leaving dangling references
+    pdf_library([(2, 'cv-copy.pdf')])
+    assert VectorStore().build_index(workers=1) == indexed
+    assert load_manifest()['duplicates'] == {}
+
+
+@requires_numpy
+def test_int8_weights_with_float32_rerank_keep_the_float32_top_k(index_dir, monkeypatch):
+    corpus = SyntheticCorpus()
+    store = VectorStore()
+    store.commit_changes(load_manifest(), [chunk for _ in range(50) for chunk in corpus.pdf()], set())
+    quantised = store.snapshot
+    assert quantised._data.dtype == embeddings.np.int8 and embeddings.RERANK_FACTOR > 1
+
+    # The same manifest combined in memory with float32 weights
+    monkeypatch.setattr(embeddings, 'VECTOR_DTYPE', 'float32')
+    exact = IndexSnapshot(load_manifest())
+    assert exact._data.dtype == embeddings.np.float32
+
+    rng = random.Random(5)
+    found = expected = 0
+    for _ in range(50):
+        tokens = rng.sample(corpus.words[:2000], 4)
+        terms, weights = embeddings.create_tfidf_vector(tokens, exact.idf, exact.term_index)
+        want = exact.top_k(terms, weights, 10, 'tfidf', ANN_PROBES)
+        got = quantised.top_k(terms, weights, 10, 'tfidf', ANN_PROBES)
+        expected += len(want)
+        found += len({row for row, _ in want} & {row for row, _ in got})
+        # Re-ranked scores are the float32 ones, not the quantised estimates
+        assert dict(got) == pytest.approx({row: score for row, score in want if row in dict(got)}, abs=1e-5)
+    assert expected and found / expected == 1.0
+
+
+@pytest.fixture
+def mixed_library(index_dir, monkeypatch):
+    """An index of 12 synthetic books in two categories, every third an EPUB,
+    large enough for IVF lists; returns the chunks."""
+    monkeypatch.setattr(embeddings, 'ANN_MIN_DOCS', 100)
+    corpus = SyntheticCorpus()
+    chunks = []
+    for i in range(12):
+        for chunk in corpus.pdf():
+            if i % 2:
+                chunk['category'] = 'health-guides'
+            if i % 3 == 0:
+                chunk['source_path'] = chunk['source_path'].replace('.pdf', '.epub')
+            chunks.append(chunk)
+    VectorStore().commit_changes(load_manifest(), [dict(chunk) for chunk in chunks], set())
+    return chunks
+
+
+def sample_queries(chunks):
+    return [' '.join(chunk['content'].split()[:5]) for chunk in chunks[::17]]
+
+
+@requires_numpy
+@pytest.mark.parametrize('mode', ['tfidf', 'bm25', 'ann'])
+@pytest.mark.parametrize('filters', [
+    {},
+    {'category': 'health-guides'},
+    {'resource_id': 'book-4'},
+    {'file_format': 'epub', 'category': 'textbooks'},
+    {'category': 'missing'},
+])
+def test_search_many_matches_one_search_per_query(mixed_library, mode, filters):
+    queries = sample_queries(mixed_library)
+    queries += ['', 'unknownword', queries[0]]  # no terms, no known terms, a repeat
+    batch, single = VectorStore(), VectorStore()
+    assert batch.load() and single.load()
+
+    found = batch.search_many(queries, 5, mode=mode, probes=4, **filters)
+    expected = [single.search(query, 5, mode=mode, probes=4, **filters) for query in queries]
+    assert len(found) == len(queries)
+    for got, want in zip(found, expected):
+        assert [r['id'] for r in got] == [r['id'] for r in want]
+        assert [r['score'] for r in got] == pytest.approx([r['score'] for r in want], abs=1e-4)
+    assert any(found) == (filters.get('category') != 'missing')
+
+
+@requires_numpy
+@pytest.mark.parametrize('mode', ['tfidf', 'bm25', 'ann'])
+def test_filters_return_only_matching_chunks(mixed_library, mode):
+    chunks = {chunk['id']: chunk for chunk in mixed_library}
+    store = VectorStore()
+    assert store.load()
+    snapshot = store.snapshot
+    assert snapshot.ivf is not None
+
+    def matches(chunk, category=None, resource_id=None, file_format=None):
+        return ((category is None or chunk['category'] == category)
+                and (resource_id is None or chunk['id'].rsplit('_', 1)[0] == resource_id)
+                and (file_format is None or chunk['source_path'].endswith('.' + file_format)))
+
+    for filters in ({'category': 'health-guides'}, {'resource_id': 'book-3'}, {'file_format': 'epub'},
+                    {'category': 'textbooks', 'file_format': 'pdf'}):
+        rows = [row for start, end in snapshot.filter_ranges(**{
+            name: filters.get(name) for name in ('category', 'resource_id', 'file_format')})
+            for row in range(start, end)]
+        ids = [hit['id'] for hit in snapshot.results([(row, 0.0) for row in rows])]
+        assert sorted(ids) == sorted(i for i, chunk in chunks.items() if matches(chunk, **filters))
+
+        found = 0
+        for query in sample_queries(mixed_library):
+            results = store.search(query, 10, mode=mode, probes=10 ** 6, **filters)
+            assert all(matches(chunks[r['id']], **filters) for r in results)
+            found += len(results)
+        assert found
+
+    # Filters matching nothing, alone or together (book-1 is an EPUB)
+    for filters in ({'category': 'missing'}, {'resource_id': 'book-1', 'file_format': 'pdf'}):
+        assert snapshot.filter_ranges(filters.get('category'), filters.get('resource_id'),
+                                      filters.get('file_format')) == []
+        assert store.search(sample_queries(mixed_library)[0], 10, mode=mode, **filters) == []
+
+
+@requires_numpy
+def test_searches_during_rebuilds_always_see_a_whole_generation(mixed_library, monkeypatch):
+    monkeypatch.setattr(embeddings, 'MAX_SEGMENTS', 1)
+    store = VectorStore()
+    assert store.load()
+    queries = sample_queries(mixed_library)
+    known = {chunk['id'] for chunk in mixed_library}
+    stop, errors, searches = threading.Event(), [], []
+
+    def search_until_stopped(mode):
+        try:
+            while not stop.is_set():
+                for query in queries:
+                    results = store.search(query, 5, mode=mode, probes=4)
+                    assert {r['id'] for r in results} <= known
+                    searches.append(bool(results))
+        except Exception as e:  # reported by the main thread
+            errors.append(e)
+
+    readers = [threading.Thread(target=search_until_stopped, args=(mode,), daemon=True)
+               for mode in ('tfidf', 'bm25', 'ann')]
+    for reader in readers:
+        reader.start()
+    try:
+        # Re-index book-1 a few times (new segments and tombstones), then compact
+        book = [chunk for chunk in mixed_library if chunk['id'].startswith('book-1_')]
+        for _ in range(3):
+            store.commit_changes(load_manifest(), [dict(chunk) for chunk in book], {book[0]['source_path']})
+        assert store.merge_segments()
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join(30)
+    assert not errors, errors
+    assert searches and all(searches)
+    assert len(store.snapshot.segments) == 1 and store.snapshot.n_docs == len(mixed_library)
+
+
+@requires_numpy
+def test_a_snapshot_held_by_a_search_outlives_release(mixed_library, monkeypatch):
+    monkeypatch.setattr(embeddings, 'MAX_SEGMENTS', 1)
+    store = VectorStore()
+    assert store.load()
+    held = store.snapshot  # as a search in flight would hold it
+    tokens = embeddings.tokenize(sample_queries(mixed_library)[0])
+    terms, weights = embeddings.create_tfidf_vector(tokens, held.idf, held.term_index)
+    before = held.results(held.top_k(terms, weights, 5, 'tfidf', ANN_PROBES))
+
+    store.release()
+    assert not store.loaded
+    # Rewrite the index on disk so the held snapshot's segment files are deleted
+    other = VectorStore()
+    assert other.load()
+    book = [chunk for chunk in mixed_library if chunk['id'].startswith('book-2_')]
+    other.commit_changes(load_manifest(), [dict(chunk) for chunk in book], {book[0]['source_path']})
+    assert other.merge_segments()
+
+    assert held.results(held.top_k(terms, weights, 5, 'tfidf', ANN_PROBES)) == before
+    assert held.results(held.top_k(terms, weights, 5, 'bm25', ANN_PROBES))
+    assert store.search(sample_queries(mixed_library)[0], 5) == other.search(sample_queries(mixed_library)[0], 5)
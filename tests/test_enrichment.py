@@ -0,0 +1,74 @@
+"""Catalog enrichment: the fingerprint-keyed cache and thumbnail files."""
+
+import json
+import os
+import shutil
+
+import pytest
+
+import enrichment
+from conftest import CONTENT_DIR
+from page_cache import get_file_hash
+
+pytest.importorskip('fitz')
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """A scratch project root holding one PDF, with enrichment pointed at it."""
+    monkeypatch.setattr(enrichment, 'PROJECT_DIR', tmp_path)
+    monkeypatch.setattr(enrichment, 'ENRICHMENT_CACHE_FILE', tmp_path / 'portal' / 'data' / 'enrichment_cache.json')
+    monkeypatch.setattr(enrichment, 'THUMBNAILS_DIR', tmp_path / 'portal' / 'data' / 'thumbnails')
+    (tmp_path / 'content').mkdir()
+    shutil.copy(CONTENT_DIR / 'textbooks' / 'cv.pdf', tmp_path / 'content' / 'cv.pdf')
+    return tmp_path
+
+
+def resources():
+    return [{'id': 1, 'title': 'CV', 'format': 'pdf', 'filepath': 'content/cv.pdf'}]
+
+
+def refuse(*args, **kwargs):
+    raise AssertionError('an unchanged file was opened again')
+
+
+def test_results_are_cached_by_fingerprint(project, monkeypatch):
+    first = resources()
+    assert enrichment.enrich_resources(first) == 1
+    assert first[0]['pages'] == 4 and first[0]['size_bytes'] > 0
+
+    pdf_path = project / 'content' / 'cv.pdf'
+    cache = json.loads(enrichment.ENRICHMENT_CACHE_FILE.read_text(encoding='utf-8'))
+    assert list(cache) == [get_file_hash(pdf_path)]
+
+    # An unchanged file is served from the cache without opening it
+    second = resources()
+    with monkeypatch.context() as patch:
+        patch.setattr(enrichment, 'compute_enrichment', refuse)
+        assert enrichment.enrich_resources(second) == 0
+    assert second == first
+
+    # A new file version has a new fingerprint and is computed again
+    stat = pdf_path.stat()
+    os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert enrichment.enrich_resources(resources(), compute_missing=False) == 0
+    assert enrichment.enrich_resources(resources()) == 1
+    cache = json.loads(enrichment.ENRICHMENT_CACHE_FILE.read_text(encoding='utf-8'))
+    assert list(cache) == [get_file_hash(pdf_path)]
+
+
+def test_thumbnails_are_written_under_the_thumbnails_dir(project):
+    first = resources()
+    enrichment.enrich_resources(first)
+    fingerprint = get_file_hash(project / 'content' / 'cv.pdf')
+    assert first[0]['thumbnail'] == f"portal/data/thumbnails/{fingerprint[:16]}.jpg"
+    assert (project / first[0]['thumbnail']).read_bytes()[:2] == b'\xff\xd8'  # JPEG
+
+    # The old version's thumbnail is pruned once its cache entry is gone
+    pdf_path = project / 'content' / 'cv.pdf'
+    stat = pdf_path.stat()
+    os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    second = resources()
+    enrichment.enrich_resources(second)
+    assert second[0]['thumbnail'] != first[0]['thumbnail']
+    assert [path.name for path in enrichment.THUMBNAILS_DIR.iterdir()] == [second[0]['thumbnail'].split('/')[-1]]
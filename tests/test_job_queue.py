@@ -0,0 +1,107 @@
+"""JobScheduler coalescing, ordering and retries."""
+
+import threading
+import time
+
+import pytest
+
+from job_queue import PRIORITY_UPLOAD, JobScheduler
+
+
+@pytest.fixture
+def scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        kwargs.setdefault('retry_delay', 0.01)
+        schedulers.append(JobScheduler(**kwargs))
+        return schedulers[-1]
+
+    yield make
+    for job_scheduler in schedulers:
+        job_scheduler.stop()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_queued_jobs_coalesce_into_one_run(scheduler):
+    jobs = scheduler(max_workers=1)
+    calls = []
+    first = jobs.submit('build', calls.append, 'old')
+    second = jobs.submit('build', calls.append, 'new')
+    assert first is second and first.coalesced == 1
+
+    jobs.start()
+    wait_until(lambda: jobs.get_stats()['totals']['completed'] == 1)
+    assert calls == ['new']
+    assert jobs.get_stats()['totals'] == {'submitted': 2, 'coalesced': 1, 'completed': 1, 'failed': 0,
+                                          'retried': 0}
+
+
+def test_submitting_a_running_key_reruns_it_once(scheduler):
+    jobs = scheduler(max_workers=2)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+
+    jobs.start()
+    jobs.submit('build', work, 1)
+    assert started.wait(5)
+    for value in (2, 3, 4):
+        jobs.submit('build', work, value)
+    assert jobs.get_stats()['pending_count'] == 0  # never two runs of one key at once
+
+    release.set()
+    wait_until(lambda: jobs.get_stats()['totals']['completed'] == 2)
+    assert calls == [1, 4]
+
+
+def test_lower_priority_numbers_run_first(scheduler):
+    jobs = scheduler(max_workers=1)
+    calls = []
+    jobs.submit('watcher', calls.append, 'watcher')
+    jobs.submit('upload', calls.append, 'upload', priority=PRIORITY_UPLOAD)
+    jobs.start()
+    wait_until(lambda: len(calls) == 2)
+    assert calls == ['upload', 'watcher']
+
+
+def test_failed_jobs_are_retried_with_backoff(scheduler):
+    jobs = scheduler(max_workers=1, max_retries=2)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.time())
+        if len(attempts) < 3:
+            raise OSError("busy")
+
+    jobs.start()
+    job = jobs.submit('flaky', flaky)
+    wait_until(lambda: job.status == 'done')
+    assert job.attempts == 3 and job.error is None
+    assert attempts[2] - attempts[1] >= 0.02 - 0.005  # the delay doubles on each retry
+    assert jobs.get_stats()['totals']['retried'] == 2
+
+
+def test_jobs_fail_after_the_last_retry(scheduler):
+    jobs = scheduler(max_workers=1, max_retries=1)
+
+    def broken():
+        raise ValueError("bad input")
+
+    jobs.start()
+    job = jobs.submit('broken', broken)
+    wait_until(lambda: job.status == 'failed')
+    assert job.attempts == 2
+    stats = jobs.get_stats()
+    assert stats['totals']['failed'] == 1
+    assert stats['recent'][0]['error'] == 'ValueError: bad input'
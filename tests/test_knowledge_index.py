@@ -0,0 +1,184 @@
+"""Chatbot knowledge index: shards, route filters, postings and the file cache."""
+
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+import build_knowledge_index as kb
+import page_cache
+from benchmark_index import synthetic_words
+from conftest import CONTENT_DIR
+
+
+@pytest.fixture
+def shard_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb, 'SHARD_DIR', tmp_path / 'knowledge')
+    monkeypatch.setattr(kb, 'SHARD_MANIFEST_FILE', tmp_path / 'knowledge' / 'manifest.json')
+    return tmp_path / 'knowledge'
+
+
+def knowledge_chunks(n_resources=12, chunks_per_resource=4, seed=5):
+    """Chunks shaped like build_index() output, with one keyword in every resource."""
+    rng = random.Random(seed)
+    words = synthetic_words(400)
+    chunks = []
+    for resource in range(n_resources):
+        for i in range(chunks_per_resource):
+            keywords = ['common'] + rng.sample(words, 12)
+            chunks.append({'resource_id': f"res-{resource}", 'title': f"Book {resource}",
+                           'category': 'textbooks', 'content': ' '.join(keywords),
+                           'keywords': keywords, 'chunk_index': i})
+    return chunks
+
+
+def test_every_chunk_is_in_one_shard_found_by_its_keywords(shard_dir):
+    chunks = knowledge_chunks()
+    manifest = kb.write_shards(chunks)
+    assert json.loads(kb.SHARD_MANIFEST_FILE.read_text(encoding='utf-8')) == manifest
+    assert 'terms' not in manifest  # no table listing every keyword
+
+    placed = {}
+    for ordinal, shard in enumerate(manifest['shards']):
+        data = json.loads((shard_dir / shard['file']).read_text(encoding='utf-8'))
+        assert data['resource_id'] == shard['resource_id'] and len(data['chunks']) == shard['chunks']
+        for chunk in data['chunks']:
+            key = (data['resource_id'], chunk['chunk_index'])
+            assert key not in placed
+            placed[key] = ordinal
+    assert set(placed) == {(chunk['resource_id'], chunk['chunk_index']) for chunk in chunks}
+
+    false_routes = lookups = 0
+    for chunk in chunks:
+        ordinal = placed[(chunk['resource_id'], chunk['chunk_index'])]
+        for keyword in chunk['keywords'][1:]:
+            routed = kb.routed_shards(manifest, keyword)
+            assert ordinal in routed
+            owners = {placed[(c['resource_id'], c['chunk_index'])] for c in chunks if keyword in c['keywords']}
+            false_routes += len(set(routed) - owners)
+            lookups += len(manifest['shards'])
+    assert false_routes / lookups < 0.05
+
+    # A keyword in every shard can't narrow a fetch, so it isn't routed
+    assert kb.routed_shards(manifest, 'common') == []
+
+
+def test_route_filters_match_the_chatbot_hashes():
+    # FNV-1a over UTF-8 bytes, as routeHashes() in chatbot.js computes it
+    assert kb.route_probes('', 2 ** 32)[:2] == [0x811c9dc5, (0x811c9dc5 + 0x050c5d1f) % 2 ** 32]
+    positions = kb.route_probes('pāni', 80)
+    assert len(positions) == kb.ROUTE_FILTER_HASHES and all(0 <= p < 80 for p in positions)
+
+
+def test_postings_round_trip_to_term_frequencies_and_lengths(tmp_path):
+    chunks = [{'content': text} for text in (
+        'Water boils at one hundred degrees; water vapour rises.',
+        'The and of, 42 is: to be or not to be',
+        'Pāni is the Urdu word for WATER, water and Water again.',
+        '',
+    )]
+    postings = kb.build_postings(chunks)
+    path = tmp_path / 'index.json'
+    kb.write_json_atomic(path, {'chunks': chunks, 'postings': postings}, separators=(',', ':'))
+    loaded = json.loads(path.read_text(encoding='utf-8'))['postings']
+    assert loaded == postings and loaded['version'] == kb.POSTINGS_VERSION
+
+    # Inverting the postings gives back every chunk's term frequencies and length
+    frequencies = [{} for _ in chunks]
+    for term, entries in loaded['terms'].items():
+        ordinals = [ordinal for ordinal, _ in entries]
+        assert ordinals == sorted(set(ordinals))
+        for ordinal, count in entries:
+            frequencies[ordinal][term] = count
+    assert frequencies == [kb.term_frequencies(chunk['content']) for chunk in chunks]
+    assert frequencies[0]['water'] == 2 and frequencies[2]['water'] == 3 and frequencies[1] == {}
+    assert loaded['chunk_lengths'] == [sum(tf.values()) for tf in frequencies]
+    assert loaded['avg_length'] == round(sum(loaded['chunk_lengths']) / len(chunks), 2)
+    assert list(loaded['terms']) == sorted(loaded['terms'])
+
+    assert kb.build_postings([]) == {'version': kb.POSTINGS_VERSION, 'avg_length': 0.0,
+                                     'chunk_lengths': [], 'terms': {}}
+
+
+def test_add_postings_upgrades_an_index_in_place(tmp_path):
+    path = tmp_path / 'knowledge_index.json'
+    chunks = knowledge_chunks(n_resources=2)
+    path.write_text(json.dumps({'version': 2, 'total_chunks': len(chunks), 'chunks': chunks}), encoding='utf-8')
+
+    assert kb.add_postings(path)
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert data['version'] == 3 and data['chunks'] == chunks
+    assert data['postings'] == kb.build_postings(chunks)
+    assert not kb.add_postings(path)
+
+
+@pytest.fixture
+def knowledge_library(tmp_path, monkeypatch, shard_dir):
+    """Point the indexer at a scratch library; returns a function that
+    writes metadata.json listing the given PDFs (paths under tmp_path)."""
+    data_dir = tmp_path / 'data'
+    monkeypatch.setattr(kb, 'BASE_DIR', tmp_path)
+    monkeypatch.setattr(kb, 'DATA_DIR', data_dir)
+    monkeypatch.setattr(kb, 'METADATA_FILE', data_dir / 'metadata.json')
+    monkeypatch.setattr(kb, 'INDEX_FILE', data_dir / 'knowledge_index.json')
+    monkeypatch.setattr(kb, 'CACHE_DIR', data_dir / 'knowledge_cache')
+    monkeypatch.setattr(page_cache, 'PAGE_CACHE_DIR', data_dir / 'page_cache')
+
+    def write_metadata(paths):
+        data_dir.mkdir(exist_ok=True)
+        kb.METADATA_FILE.write_text(json.dumps([
+            {'id': i + 1, 'title': path.stem, 'category': 'textbooks', 'format': 'pdf',
+             'filepath': str(path.relative_to(tmp_path))} for i, path in enumerate(paths)
+        ]), encoding='utf-8')
+    return write_metadata
+
+
+def long_pdf(path, n_pages):
+    """A PDF whose page i says 'markerI' in a sentence long enough to chunk."""
+    fitz = pytest.importorskip('fitz')
+    doc = fitz.open()
+    for i in range(n_pages):
+        doc.new_page().insert_text((72, 72), f"Page {i} of the handbook mentions marker{i} in a full sentence.")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(str(path))
+    doc.close()
+    return path
+
+
+def test_unchanged_pdfs_are_skipped_and_changed_ones_extracted_again(knowledge_library, tmp_path, monkeypatch):
+    pytest.importorskip('fitz')
+    handbook = long_pdf(tmp_path / 'content' / 'textbooks' / 'handbook.pdf', 60)
+    cv = tmp_path / 'content' / 'textbooks' / 'cv.pdf'
+    shutil.copy(CONTENT_DIR / 'textbooks' / 'cv.pdf', cv)
+    knowledge_library([handbook, cv])
+    extracted = []
+    extract = kb.extract_text_from_pdf
+    monkeypatch.setattr(kb, 'extract_text_from_pdf', lambda path: extracted.append(path.name) or extract(path))
+
+    kb.build_index()
+    assert sorted(extracted) == ['cv.pdf', 'handbook.pdf']
+    first = json.loads(kb.INDEX_FILE.read_text(encoding='utf-8'))
+    text = ' '.join(chunk['content'] for chunk in first['chunks'])
+    assert 'marker0 ' in text and 'marker59 ' in text  # no page limit
+    assert len(list(kb.CACHE_DIR.glob('*.json'))) == 2
+
+    # Nothing changed: both files come from the per-file cache
+    extracted.clear()
+    kb.build_index()
+    assert extracted == []
+    assert json.loads(kb.INDEX_FILE.read_text(encoding='utf-8'))['chunks'] == first['chunks']
+
+    # A new version of one file is extracted again; its old cache entry goes
+    old_fingerprint = kb.file_fingerprint(handbook)
+    long_pdf(handbook, 61)
+    stat = handbook.stat()
+    os.utime(handbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert kb.file_fingerprint(handbook) != old_fingerprint
+    kb.build_index()
+    assert extracted == ['handbook.pdf']
+    text = ' '.join(chunk['content'] for chunk in json.loads(kb.INDEX_FILE.read_text(encoding='utf-8'))['chunks'])
+    assert 'marker60 ' in text
+    assert sorted(path.stem for path in kb.CACHE_DIR.glob('*.json')) == sorted(
+        [kb.file_fingerprint(handbook), kb.file_fingerprint(cv)])
@@ -0,0 +1,89 @@
+"""Page text cache: file format round trip, partial caches and extension."""
+
+import os
+import shutil
+import zlib
+
+import pytest
+
+import page_cache
+from conftest import CONTENT_DIR
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, 'PAGE_CACHE_DIR', tmp_path / 'page_cache')
+    return tmp_path / 'page_cache'
+
+
+def write_cache(pdf_path, pages, page_count):
+    """Write a cache file for pdf_path holding the given page texts."""
+    path = page_cache.cache_file(pdf_path)
+    temp_path = path.with_suffix('.test.tmp')
+    out = page_cache._start_cache_file(temp_path, None, [page_cache.HEADER_SIZE])
+    offsets = [page_cache.HEADER_SIZE]
+    for text in pages:
+        out.write(zlib.compress(text.encode('utf-8')))
+        offsets.append(out.tell())
+    page_cache._finish_cache_file(out, temp_path, path, page_count, offsets)
+
+
+def test_format_round_trip_without_pymupdf(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, 'PYMUPDF_AVAILABLE', False)
+    pdf_path = tmp_path / 'book.pdf'
+    pdf_path.write_bytes(b'%PDF-1.4 placeholder')
+    pages = ['first page', '', 'third — página ٣']
+    write_cache(pdf_path, pages, page_count=5)
+
+    assert list(page_cache.iter_pages(pdf_path)) == pages
+    assert page_cache.cached_page(pdf_path, 2) == (5, pages[2])
+    assert page_cache.cached_page(pdf_path, 3) == (5, None)
+    assert page_cache.get_page(pdf_path, 1) == ''
+    assert page_cache.get_page_count(pdf_path) == 5
+
+
+def test_corrupt_cache_is_ignored(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, 'PYMUPDF_AVAILABLE', False)
+    pdf_path = tmp_path / 'book.pdf'
+    pdf_path.write_bytes(b'%PDF-1.4 placeholder')
+    path = page_cache.cache_file(pdf_path)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'ILMP\x01')
+
+    assert list(page_cache.iter_pages(pdf_path)) == []
+    assert page_cache.cached_page(pdf_path, 0) == (None, None)
+
+
+def test_partial_cache_is_extended(cache_dir, tmp_path):
+    pytest.importorskip('fitz')
+    pdf_path = tmp_path / 'cv.pdf'
+    shutil.copy(CONTENT_DIR / 'textbooks' / 'cv.pdf', pdf_path)
+
+    assert page_cache.cache_pages(pdf_path, 2) == 2
+    page_count, first = page_cache.cached_page(pdf_path, 0)
+    assert page_count == 4 and first
+    assert page_cache.cached_page(pdf_path, 2) == (4, None)
+
+    pages = list(page_cache.iter_pages(pdf_path))
+    assert len(pages) == 4 and pages[0] == first
+    assert [page_cache.cached_page(pdf_path, i)[1] for i in range(4)] == pages
+    assert list(cache_dir.glob('*.tmp')) == []
+
+    # A new file version gets a new entry; prune removes the old one
+    stat = pdf_path.stat()
+    os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert page_cache.get_page(pdf_path, 3) == pages[3]
+    assert page_cache.prune_page_cache([pdf_path]) == 1
+
+
+def test_prune_removes_abandoned_temp_files(cache_dir, tmp_path):
+    cache_dir.mkdir()
+    abandoned = cache_dir / 'abc.123.tmp'
+    in_progress = cache_dir / 'def.456.tmp'
+    abandoned.write_bytes(b'ILMP')
+    in_progress.write_bytes(b'ILMP')
+    old = abandoned.stat().st_mtime - page_cache.STALE_TEMP_AGE - 1
+    os.utime(abandoned, (old, old))
+
+    assert page_cache.prune_page_cache([]) == 1
+    assert list(cache_dir.iterdir()) == [in_progress]
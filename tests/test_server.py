@@ -0,0 +1,363 @@
+"""HTTP endpoint tests against a server bound to a free local port."""
+
+import json
+import math
+import subprocess
+import sys
+import textwrap
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import server
+from conftest import ROOT
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    httpd = server.ThreadedTCPServer(('127.0.0.1', 0), server.ThreadedHTTPHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.status, json.loads(response.read())
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_user_tracker_stats_does_not_deadlock():
+    tracker = server.UserTracker()
+    tracker.record_activity('10.0.0.1', 'Mozilla/5.0 (Linux; Android 12)', '/')
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(tracker.get_stats()), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result['active_users'] == 1
+
+
+def test_admin_stats_endpoint(base_url):
+    status, stats = get_json(f"{base_url}/api/stats")
+    assert status == 200
+    assert stats['total_requests'] >= 1
+    if server.EMBEDDINGS_AVAILABLE:
+        assert {'hits', 'misses'} <= set(stats['search_cache'])
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/api/search', {'query': 'water', 'top_k': '3'}),
+    ('/api/search', {'query': 'water', 'top_k': 10 ** 6}),
+    ('/api/search', {'query': 'water', 'top_k': True}),
+    ('/api/search', {'query': 'water', 'probes': 0}),
+    ('/api/search', {'query': 'water', 'probes': '4'}),
+    ('/api/search', {'query': 3}),
+    ('/api/search/batch', {'queries': ['water'], 'top_k': 0}),
+    ('/api/search/batch', {'queries': ['water'], 'top_k': 5.5}),
+    ('/api/search/batch', {'queries': ['water'], 'probes': 10 ** 6}),
+    ('/api/ask', {'question': 'water', 'top_k': 99}),
+])
+def test_search_rejects_bad_limits(base_url, path, payload):
+    status, body = post_json(base_url + path, payload)
+    assert status == 400
+    assert 'error' in body
+
+
+@pytest.mark.parametrize('queries, error', [
+    (['water'] * (server.MAX_BATCH_QUERIES + 1), f"At most {server.MAX_BATCH_QUERIES} queries per batch"),
+    ([], 'queries must be a non-empty list'),
+    ('water', 'queries must be a non-empty list'),
+    (None, 'queries must be a non-empty list'),
+    (['water', ''], 'Every query must be a non-empty string'),
+    (['water', '   '], 'Every query must be a non-empty string'),
+    (['water', 3], 'Every query must be a non-empty string'),
+    (['water', None], 'Every query must be a non-empty string'),
+])
+def test_batch_search_rejects_bad_query_lists(base_url, queries, error):
+    status, body = post_json(f"{base_url}/api/search/batch", {'queries': queries})
+    assert status == 400
+    assert body['error'] == error
+
+
+class RecordingStore:
+    """Stands in for the vector store: records batches instead of searching."""
+
+    def __init__(self):
+        self.calls = []
+
+    def search_many(self, queries, **options):
+        self.calls.append((queries, options))
+        return [[] for _ in queries]
+
+
+def test_batch_search_accepts_a_full_batch(base_url, monkeypatch):
+    store = RecordingStore()
+    monkeypatch.setattr(server, 'EMBEDDINGS_AVAILABLE', True)
+    monkeypatch.setattr(server, 'vector_store', store)
+    queries = [f" query {i} " for i in range(server.MAX_BATCH_QUERIES)]
+
+    status, body = post_json(f"{base_url}/api/search/batch",
+                             {'queries': queries, 'top_k': 3, 'category': 'textbooks'})
+    assert status == 200 and body['mode'] == 'tfidf'
+    assert [r['query'] for r in body['results']] == [q.strip() for q in queries]
+    assert store.calls == [([q.strip() for q in queries],
+                            {'top_k': 3, 'mode': 'tfidf', 'probes': server.ANN_PROBES, 'category': 'textbooks'})]
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/api/search', {'query': 'water'}),
+    ('/api/search/batch', {'queries': ['water']}),
+])
+def test_search_endpoints_reject_unknown_modes_alike(base_url, path, payload):
+    status, body = post_json(base_url + path, dict(payload, mode='dense'))
+    assert status == 400
+    assert body['error'] == "mode must be 'tfidf', 'bm25' or 'ann'"
+
+
+def test_page_text_is_extracted_in_the_background(base_url, tmp_path, monkeypatch):
+    pytest.importorskip('fitz')
+    import page_cache
+    from conftest import CONTENT_DIR
+
+    monkeypatch.setattr(page_cache, 'PAGE_CACHE_DIR', tmp_path / 'page_cache')
+    pdf_path = tmp_path / 'cv.pdf'
+    pdf_path.write_bytes((CONTENT_DIR / 'textbooks' / 'cv.pdf').read_bytes())
+    catalog = server.ResourceCatalog()
+    catalog.seed([{'id': 7, 'title': 'CV', 'category': 'textbooks', 'format': 'pdf',
+                   'filepath': str(pdf_path)}])
+    scheduler = server.JobScheduler()  # never started: jobs stay queued
+    monkeypatch.setattr(server, 'resource_catalog', catalog)
+    monkeypatch.setattr(server, 'job_scheduler', scheduler)
+
+    status, body = get_json(f"{base_url}/api/resources/7/pages/2")
+    assert status == 202 and body['status'] == 'extracting'
+    assert [job['key'] for job in scheduler.get_stats()['pending']] == [f"pages:{pdf_path}"]
+    assert list((tmp_path / 'page_cache').glob('*')) == []  # nothing extracted inline
+
+    page_cache.cache_pages(pdf_path, 2)
+    status, body = get_json(f"{base_url}/api/resources/7/pages/2")
+    assert status == 200 and body['page_count'] == 4 and body['text']
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get_json(f"{base_url}/api/resources/7/pages/9")
+    assert error.value.code == 404
+
+
+def catalog_resources(count):
+    formats = ['pdf', 'epub', 'pdf']
+    return [{'title': f"Book {i:02d}", 'category': 'textbooks' if i % 2 else 'health-guides',
+             'format': formats[i % 3], 'filepath': f"content/book-{i:02d}.{formats[i % 3]}"}
+            for i in range(count)]
+
+
+def test_catalog_pages_resume_from_the_cursor():
+    catalog = server.ResourceCatalog()
+    catalog.update(catalog_resources(25))
+
+    seen, cursor = [], None
+    while True:
+        page = catalog.query(category='textbooks', cursor=cursor, limit=5)
+        seen.extend(page['resources'])
+        cursor = page['next_cursor'] and int(page['next_cursor'])
+        if cursor is None:
+            break
+    assert [r['title'] for r in seen] == [f"Book {i:02d}" for i in range(1, 25, 2)]
+    assert [r['id'] for r in seen] == sorted(r['id'] for r in seen)
+
+    page = catalog.query(file_format='epub', prefix='book 1', fields=['title'], limit=50)
+    assert page['resources'] == [{'id': 11, 'title': 'Book 10'}, {'id': 14, 'title': 'Book 13'},
+                                 {'id': 17, 'title': 'Book 16'}, {'id': 20, 'title': 'Book 19'}]
+    assert page['next_cursor'] is None
+
+
+def test_resources_endpoint_pages_with_a_cursor(base_url, monkeypatch):
+    catalog = server.ResourceCatalog()
+    catalog.update(catalog_resources(7))
+    monkeypatch.setattr(server, 'resource_catalog', catalog)
+
+    status, first = get_json(f"{base_url}/api/resources?limit=4&fields=title")
+    assert status == 200 and first['count'] == 4 and first['next_cursor'] == '4'
+    status, rest = get_json(f"{base_url}/api/resources?limit=4&cursor={first['next_cursor']}")
+    assert [r['id'] for r in rest['resources']] == [5, 6, 7] and rest['next_cursor'] is None
+
+
+def test_catalog_deltas_since_a_version(base_url, monkeypatch):
+    catalog = server.ResourceCatalog()
+    resources = catalog_resources(3)
+    catalog.seed([dict(r, id=i + 1) for i, r in enumerate(resources)])
+    monkeypatch.setattr(server, 'resource_catalog', catalog)
+    start, _ = catalog.snapshot()
+
+    renamed = [dict(r) for r in resources[1:]]
+    renamed[0]['title'] = 'Book 01, 2nd edition'
+    catalog.update(renamed + [{'title': 'New', 'category': 'textbooks', 'format': 'pdf',
+                               'filepath': 'content/new.pdf'}])
+    catalog.update([dict(r) for r in renamed])  # the new file goes away again
+
+    status, body = get_json(f"{base_url}/api/metadata?since={start}")
+    assert status == 200 and body['version'] == start + 2
+    changes = {(change['op'], change['resource']['id']) for change in body['changes']}
+    assert changes == {('modified', 2), ('removed', 1), ('removed', 4)}
+    assert get_json(f"{base_url}/api/metadata?since={start + 2}")[1]['changes'] == []
+
+    # Versions the log can't answer ask the client to reload
+    assert get_json(f"{base_url}/api/metadata?since={start - 1}")[1]['full_reload'] is True
+    assert get_json(f"{base_url}/api/metadata?since={start + 5}")[1]['full_reload'] is True
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get_json(f"{base_url}/api/metadata?since=latest")
+    assert error.value.code == 400
+
+
+def test_related_endpoint_serves_the_precomputed_graph(base_url, tmp_path, monkeypatch):
+    catalog = server.ResourceCatalog()
+    catalog.seed([dict(r, id=i + 1) for i, r in enumerate(catalog_resources(3))])
+    related_file = tmp_path / 'related.json'
+    related_file.write_text(json.dumps({'format': 1, 'related': {
+        '1': [['3', 0.5], ['99', 0.3], ['2', 0.25]],  # 99 is no longer in the catalog
+    }}), encoding='utf-8')
+    monkeypatch.setattr(server, 'resource_catalog', catalog)
+    monkeypatch.setattr(server, 'related_graph', server.RelatedGraph(related_file))
+
+    status, body = get_json(f"{base_url}/api/resources/1/related")
+    assert status == 200 and body['count'] == 2
+    assert [(r['id'], r['title'], r['score']) for r in body['related']] == [(3, 'Book 02', 0.5),
+                                                                          (2, 'Book 01', 0.25)]
+    assert get_json(f"{base_url}/api/resources/2/related")[1]['related'] == []
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get_json(f"{base_url}/api/resources/42/related")
+    assert error.value.code == 404
+
+
+def test_server_runs_without_the_optional_script_modules(tmp_path):
+    # Each blocked module raises ImportError on import, as if it were missing
+    script = tmp_path / 'check.py'
+    script.write_text(textwrap.dedent(f"""
+        import sys
+        sys.path[:0] = [{str(ROOT)!r}, {str(ROOT / 'scripts')!r}]
+        for name in ('build_knowledge_index', 'job_queue', 'page_cache', 'worker_pool'):
+            sys.modules[name] = None
+        import server
+        assert not (server.KNOWLEDGE_INDEX_AVAILABLE or server.JOB_QUEUE_AVAILABLE
+                    or server.PAGE_CACHE_AVAILABLE or server.WORKER_POOL_AVAILABLE)
+        assert server.submit_job('enrich', print) is False
+        assert server.run_in_worker(sum, [1, 2]) == 3
+        print('ok')
+    """), encoding='utf-8')
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines()[-1] == 'ok'
+
+
+ASK_CHUNKS = [
+    ('Boiling Water', 'science', 'Water boils at one hundred degrees. Heating water makes water vapour rise.'),
+    ('Safe Drinking', 'health-guides', 'Boiling drinking water kills germs. Store boiled water in clean covered pots.'),
+    ('Fractions', 'textbooks', 'Fractions and decimals describe parts of whole numbers in arithmetic lessons.'),
+    ('Village Life', 'textbooks', 'Farmers carry water from the well, tend cattle, plough fields, harvest wheat, '
+                                  'grind flour, bake bread, mend tools and sell vegetables at the weekly market.'),
+    ('Safe Drinking', 'health-guides', 'Wash hands with soap before eating and after using the latrine.'),
+]
+
+
+def write_knowledge_index(path, postings=True):
+    import build_knowledge_index as kb
+
+    chunks = [{'resource_id': i // 2 + 1, 'title': title, 'category': category, 'content': content,
+               'keywords': kb.extract_keywords(content), 'chunk_index': i % 2}
+              for i, (title, category, content) in enumerate(ASK_CHUNKS)]
+    data = {'version': 3 if postings else 2, 'chunks': chunks}
+    if postings:
+        data['postings'] = kb.build_postings(chunks)
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return chunks
+
+
+def bm25_ranking(frequencies, question):
+    """(ordinal, score) of every chunk sharing a term with question, best first."""
+    lengths = [sum(tf.values()) for tf in frequencies]
+    avg_length = sum(lengths) / len(lengths)
+    scores = {}
+    for term in server.extract_keywords(question):
+        having = [i for i, tf in enumerate(frequencies) if term in tf]
+        idf = math.log(1 + (len(frequencies) - len(having) + 0.5) / (len(having) + 0.5))
+        for i in having:
+            tf = frequencies[i][term]
+            norm = server.ASK_BM25_K1 * (1 - server.ASK_BM25_B + server.ASK_BM25_B * lengths[i] / avg_length)
+            scores[i] = scores.get(i, 0.0) + idf * tf * (server.ASK_BM25_K1 + 1) / (tf + norm)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+@pytest.mark.parametrize('postings', [True, False])
+def test_knowledge_index_ranks_chunks_by_bm25(tmp_path, postings):
+    import build_knowledge_index as kb
+
+    path = tmp_path / 'knowledge_index.json'
+    chunks = write_knowledge_index(path, postings)
+    if postings:
+        frequencies = [kb.term_frequencies(chunk['content']) for chunk in chunks]
+    else:  # older files: every keyword counts once
+        frequencies = [dict.fromkeys(chunk['keywords'], 1) for chunk in chunks]
+    index = server.KnowledgeIndex(path)
+
+    for question in ('boiling water', 'How do I store drinking water safely?', 'fractions', 'wheat water'):
+        expected = bm25_ranking(frequencies, question)
+        results = index.ask(question, top_k=len(chunks))
+        assert [(r['title'], r['chunk_index']) for r in results] == [
+            (chunks[i]['title'], chunks[i]['chunk_index']) for i, _ in expected]
+        assert [r['score'] for r in results] == pytest.approx([score for _, score in expected], abs=1e-3)
+
+    best = index.ask('water', top_k=1)
+    assert len(best) == 1 and best[0]['title'] == 'Boiling Water'
+    assert {r['category'] for r in index.ask('water', top_k=5, category='textbooks')} == {'textbooks'}
+    assert index.ask('unrelated astronomy', top_k=5) == []
+
+
+def test_knowledge_index_without_usable_postings_falls_back_to_keywords(tmp_path):
+    path = tmp_path / 'knowledge_index.json'
+    write_knowledge_index(path, postings=False)
+    index = server.KnowledgeIndex(path)
+    fallback = index.ask('boiling drinking water', top_k=5)
+    assert fallback
+
+    # Postings of another layout, or for another chunk list, are ignored too
+    write_knowledge_index(path)
+    data = json.loads(path.read_text(encoding='utf-8'))
+    for postings in (dict(data['postings'], version=server.POSTINGS_VERSION + 1),
+                     dict(data['postings'], chunk_lengths=data['postings']['chunk_lengths'][:-1])):
+        other = tmp_path / f"index-{len(postings['chunk_lengths'])}-{postings['version']}.json"
+        other.write_text(json.dumps(dict(data, postings=postings)), encoding='utf-8')
+        assert server.KnowledgeIndex(other).ask('boiling drinking water', top_k=5) == fallback
+
+
+def test_ask_endpoint_caps_results(base_url, tmp_path, monkeypatch):
+    path = tmp_path / 'knowledge_index.json'
+    chunks = [{'resource_id': i, 'title': f"Book {i % 3}", 'category': 'textbooks', 'chunk_index': 0,
+               'content': f"clean water supply lesson {i}", 'keywords': ['clean', 'water', 'supply', 'lesson']}
+              for i in range(server.MAX_ASK_RESULTS + 5)]
+    path.write_text(json.dumps({'version': 2, 'chunks': chunks}), encoding='utf-8')
+    monkeypatch.setattr(server, 'knowledge_index', server.KnowledgeIndex(path))
+
+    status, body = post_json(f"{base_url}/api/ask", {'question': ' clean water ', 'top_k': server.MAX_ASK_RESULTS})
+    assert status == 200 and body['question'] == 'clean water'
+    assert body['count'] == len(body['results']) == server.MAX_ASK_RESULTS
+    assert body['titles'] == ['Book 0', 'Book 1', 'Book 2']
+
+    status, body = post_json(f"{base_url}/api/ask", {'question': 'water', 'top_k': server.MAX_ASK_RESULTS + 1})
+    assert status == 400 and body['error'] == f"top_k must be between 1 and {server.MAX_ASK_RESULTS}"
+    status, body = post_json(f"{base_url}/api/ask", {'question': '   '})
+    assert status == 400 and body['error'] == 'Question is required'
@@ -0,0 +1,117 @@
+"""Round trips of the binary index format."""
+
+import struct
+
+import pytest
+
+import vector_format
+from vector_format import IndexFormatError, MappedIndex, write_index
+
+VOCABULARY = ['alpha', 'beta', 'gamma', 'ṭālib']
+DOCUMENTS = [
+    {'id': 'a_0', 'content': 'alpha beta', 'terms': [0, 1], 'weights': [0.6, 0.8], 'counts': [1, 2], 'length': 3},
+    {'id': 'a_1', 'content': '', 'terms': [], 'weights': [], 'counts': [], 'length': 0},
+    {'id': 'b_0', 'content': 'ṭālib gamma', 'terms': [2, 3], 'weights': [-1.0, 0.5],
+     'counts': [70000, 1], 'length': 70001},
+]
+
+
+@pytest.fixture
+def mapped(tmp_path):
+    opened = []
+
+    def open_index(**kwargs):
+        path = tmp_path / 'index.bin'
+        size = write_index(path, VOCABULARY, [1.0, 1.5, 2.0, 2.5], DOCUMENTS, extra={'files': {'a': [0, 2]}},
+                           **kwargs)
+        assert size == path.stat().st_size
+        opened.append(MappedIndex(path))
+        return opened[-1]
+
+    yield open_index
+    for index in opened:
+        index.close()
+
+
+def test_float32_round_trip(mapped):
+    index = mapped()
+    assert (index.n_docs, index.vocab_size, index.nnz, index.dtype) == (3, 4, 4, 'float32')
+    assert index.vocabulary() == VOCABULARY
+    assert index.extra == {'files': {'a': [0, 2]}}
+    assert list(index.view('idf')) == [1.0, 1.5, 2.0, 2.5]
+    assert index.record(2) == {'id': 'b_0', 'content': 'ṭālib gamma'}
+
+    doc = index.document(0)
+    assert doc['terms'] == [0, 1] and doc['counts'] == [1, 2] and doc['length'] == 3
+    assert doc['weights'] == pytest.approx([0.6, 0.8])
+    assert index.document(1)['terms'] == []
+    assert index.document(2)['counts'] == [vector_format.MAX_COUNT, 1]
+
+    # Term-major postings: term t's rows and counts
+    post_ptr = list(index.view('post_ptr'))
+    assert post_ptr == [0, 1, 2, 3, 4]
+    assert list(index.view('post_rows')) == [0, 0, 2, 2]
+    assert list(index.view('post_tfs')) == [1, 2, vector_format.MAX_COUNT, 1]
+
+
+def test_int8_weights_are_scaled_per_row(mapped):
+    index = mapped(dtype='int8')
+    assert index.dtype == 'int8'
+    assert list(index.view('weights')) == [95, 127, -127, 64]
+    assert index.document(0)['weights'] == pytest.approx([0.6, 0.8], abs=0.01)
+    assert index.document(2)['weights'] == pytest.approx([-1.0, 0.5], abs=0.01)
+
+
+def test_postings_can_be_left_out(mapped):
+    index = mapped(postings=False)
+    for name in ('post_ptr', 'post_rows', 'post_tfs'):
+        assert len(index.view(name)) == 0
+    assert index.document(2)['terms'] == [2, 3]
+
+
+def test_numpy_arrays_match_views(mapped):
+    np = pytest.importorskip('numpy')
+    index = mapped()
+    for name in ('doc_ptr', 'terms', 'counts', 'lengths', 'weights'):
+        assert np.array_equal(index.array(name), np.array(index.view(name)))
+
+
+def test_signatures_round_trip(tmp_path):
+    path = tmp_path / 'index.bin'
+    signed = [dict(doc, signature=bytes([row]) * 8) for row, doc in enumerate(DOCUMENTS)]
+    write_index(path, VOCABULARY, [], signed)
+    index = MappedIndex(path)
+    assert [index.signature(row) for row in range(3)] == [bytes([row]) * 8 for row in range(3)]
+    assert index.document(1)['signature'] == bytes([1]) * 8
+    assert 'signature' not in index.record(1)
+    index.close()
+
+    # Signatures are all or nothing
+    write_index(path, VOCABULARY, [], signed[:2] + DOCUMENTS[2:])
+    index = MappedIndex(path)
+    assert index.signature(0) is None and 'signature' not in index.document(0)
+    index.close()
+
+
+def test_version_1_files_are_read_without_signatures(tmp_path):
+    # A version 1 header is a version 3 header without the last three section entries
+    path = tmp_path / 'index.bin'
+    write_index(path, VOCABULARY, [], [dict(doc, signature=b'12345678') for doc in DOCUMENTS])
+    data = bytearray(path.read_bytes())
+    data[4:6] = struct.pack('<H', 1)
+    path.write_bytes(bytes(data))
+
+    index = MappedIndex(path)
+    assert index.version == 1
+    assert index.signature(0) is None
+    assert index.document(2)['terms'] == [2, 3]
+    assert index.record(0)['id'] == 'a_0'
+    index.close()
+
+
+@pytest.mark.parametrize('data', [b'', b'ILMV', b'XXXX' + bytes(vector_format.HEADER_SIZE)])
+def test_unreadable_files_are_rejected(tmp_path, data):
+    path = tmp_path / 'index.bin'
+    path.write_bytes(data)
+    with pytest.raises(IndexFormatError):
+        MappedIndex(path)